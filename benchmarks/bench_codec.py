@@ -0,0 +1,74 @@
+"""Compare lines per second of the per-line PDBLINE path with the vectorized codec.
+
+Run as: python benchmarks/bench_codec.py [n_atoms]
+"""
+import sys
+import time
+import numpy as np
+from write_pdb.pdbline import PDBLINE
+from write_pdb.pdbtable import PDBTable
+
+
+def synthetic_pdb(n_atoms, seed=0):
+    """ Deterministic pdb content with n_atoms ATOM records, as bytes. """
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform(-99, 99, (n_atoms, 3))
+    lines = ['REMARK synthetic structure\n']
+    for i, (x, y, z) in enumerate(positions):
+        lines.append(
+            f'ATOM  {i % 99999 + 1:5d}  CA  ALA A{i // 4 % 9999 + 1:4d}    '
+            f'{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           C\n'
+        )
+    lines.append('END\n')
+    return ''.join(lines).encode('ascii')
+
+
+def timed(func, *args):
+    """ Return the wall time of func(*args) in seconds. """
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def line_path(data):
+    lines = data.decode('utf-8').splitlines(keepends=True)
+    return ''.join(PDBLINE.from_line(line).get_line() for line in lines)
+
+
+def codec_path(data):
+    return b''.join(PDBTable.from_bytes(data).iter_blocks(binary=True))
+
+
+def line_positions(data, positions):
+    output = []
+    for line, pos in zip(data.decode('utf-8').splitlines(keepends=True)[1 : ], positions):
+        line_obj = PDBLINE.from_line(line)
+        line_obj.set_positions(pos)
+        output.append(line_obj.get_line())
+    return output
+
+
+def codec_positions(data, positions):
+    table = PDBTable.from_bytes(data)
+    table.set_positions(positions)
+    return b''.join(table.iter_blocks(binary=True))
+
+
+def main():
+    n_atoms = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    data = synthetic_pdb(n_atoms)
+    positions = np.random.default_rng(1).uniform(-99, 99, (n_atoms, 3))
+    assert line_path(data).encode('ascii') == codec_path(data)
+    print(f'{n_atoms} atoms, {len(data) / 1e6:.1f} MB')
+    for name, func, args in [
+        ('parse + format, PDBLINE', line_path, (data,)),
+        ('parse + format, codec', codec_path, (data,)),
+        ('write positions, PDBLINE', line_positions, (data, positions)),
+        ('write positions, codec', codec_positions, (data, positions)),
+    ]:
+        seconds = timed(func, *args)
+        print(f'{name:<28s} {n_atoms / seconds:14,.0f} lines/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Import time of the package and start-up time of the CLI, each in a fresh
+interpreter, as reported by python -X importtime.
+
+For every import, the cumulative import time, the modules with the largest
+own import time and if numpy was imported are reported. The CLI is timed end
+to end on a small file, for the text operations that run without numpy.
+Exits with 1 if one of NUMPY_FREE imports numpy. The results are written
+as JSON, which --compare holds against the results of an earlier commit.
+
+Run as: python benchmarks/bench_import.py --output import_results.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import synthetic
+
+
+IMPORTS = ('write_pdb', 'write_pdb.main', 'write_pdb.pipeline', 'write_pdb.pdbtable', 'write_pdb.parallel')
+# imports of the per-line path, which must not import numpy
+NUMPY_FREE = ('write_pdb', 'write_pdb.main', 'write_pdb.pipeline')
+# CLI runs of the text operations, without input and output
+CLI_RUNS = {
+    'cli.kick': ['--kick', 'REMARK'],
+    'cli.renumber': ['-a', '1', '-r', '1'],
+}
+CLI_ATOMS = 100
+N_TOP = 5
+
+
+def import_time(module):
+    """Import module in a fresh interpreter. Returns the cumulative import
+    time in ms, the own time in ms per imported module and if numpy was imported.
+    """
+    code = f'import sys, {module}; print("numpy" in sys.modules)'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True
+    )
+    own = {}
+    total = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:') : ].split('|')
+        own[name.strip()] = int(self_us) / 1000
+        if name.strip() == module:
+            total = int(cumulative_us) / 1000
+    return total, own, result.stdout.strip() == 'True'
+
+
+def cli_time(options, path):
+    """Run the CLI in a fresh interpreter, returns the wall time in seconds."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        command = [sys.executable, '-m', 'write_pdb.main', '-f', path, '-s', os.path.join(tmp_dir, 'out.pdb')] + options
+        start = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=True)
+        return time.perf_counter() - start
+
+
+def run(repeat):
+    results = []
+    for module in IMPORTS:
+        # the best of repeat runs, the first one also compiles the modules
+        runs = [import_time(module) for __ in range(repeat)]
+        total, own, numpy_imported = min(runs, key=lambda run: run[0])
+        top = sorted(own.items(), key=lambda item: item[1], reverse=True)[ : N_TOP]
+        results.append({'operation': f'import {module}', 'ms': total, 'numpy': numpy_imported, 'top': top})
+        print(f'{"import " + module:<36s} {total:>8.1f} ms   numpy: {"yes" if numpy_imported else "no":<4s}'
+              + '  ' + ', '.join(f'{name} {ms:.1f}' for name, ms in top[ : 3]), flush=True)
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = os.path.join(data_dir, 'small.pdb')
+        synthetic.write_structure(path, CLI_ATOMS)
+        for name, options in CLI_RUNS.items():
+            seconds = min(cli_time(options, path) for __ in range(repeat))
+            results.append({'operation': name, 'ms': seconds * 1000})
+            print(f'{name:<36s} {seconds * 1000:>8.1f} ms', flush=True)
+    return results
+
+
+def compare(results, baseline_file):
+    """Print the change of the times against a baseline JSON file."""
+    with open(baseline_file) as fh:
+        baseline = {item['operation']: item for item in json.load(fh)['results']}
+    print(f'\ntime relative to {baseline_file}:')
+    for item in results:
+        old = baseline.get(item['operation'])
+        if old:
+            print(f'{item["operation"]:<36s} x{item["ms"] / old["ms"]:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5, help='Best of this many runs.')
+    parser.add_argument('--output', '-o', default='import_results.json')
+    parser.add_argument('--compare', help='JSON results of an earlier run.')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    with open(args.output, 'w') as fh:
+        json.dump({'meta': {'python': sys.version.split()[0], 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}, 'results': results}, fh, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+    heavy = [item['operation'] for item in results if item.get('numpy') and item['operation'][len('import ') : ] in NUMPY_FREE]
+    if heavy:
+        print(f'numpy is imported by: {", ".join(heavy)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Scaling of the chunked, multi-process CLI path with the number of processes.
+
+Run as: python benchmarks/bench_parallel.py [n_atoms]
+"""
+import io
+import os
+import sys
+import tempfile
+from bench_codec import synthetic_pdb, timed
+from write_pdb.parallel import ChunkedPipeline
+from write_pdb.pipeline import FusedPipeline
+
+
+OPTIONS = dict(kick='REMARK', n_chains=4)
+
+
+def run_chunked(filename, jobs):
+    out = io.BytesIO()
+    ChunkedPipeline(jobs=jobs, **OPTIONS).run(filename, out)
+    return out.getvalue()
+
+
+def main():
+    n_atoms = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    data = synthetic_pdb(n_atoms)
+    with tempfile.NamedTemporaryFile(suffix='.pdb', delete=False) as fh:
+        fh.write(data)
+    try:
+        serial = ''.join(FusedPipeline(**OPTIONS)(lambda: io.StringIO(data.decode('ascii'))))
+        assert serial.encode('ascii') == run_chunked(fh.name, os.cpu_count())
+        print(f'{n_atoms} atoms, {len(data) / 1e6:.1f} MB, {os.cpu_count()} cores')
+        seconds = timed(lambda: ''.join(FusedPipeline(**OPTIONS)(lambda: io.StringIO(data.decode('ascii')))))
+        print(f'{"serial, FusedPipeline":<24s} {n_atoms / seconds:14,.0f} lines/s')
+        base = None
+        for jobs in range(1, os.cpu_count() + 1):
+            seconds = timed(run_chunked, fh.name, jobs)
+            base = base or seconds
+            print(f'{f"chunked, {jobs} jobs":<24s} {n_atoms / seconds:14,.0f} lines/s  x{base / seconds:.2f}')
+    finally:
+        os.remove(fh.name)
+
+
+if __name__ == '__main__':
+    main()
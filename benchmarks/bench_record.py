@@ -0,0 +1,74 @@
+"""Compare the per-line cost of the original PDBLINE, the PDBLINE built on
+PDBRecord and PDBRecord itself: parsing and rendering every line, renumbering
+the atoms, and the memory held per parsed line. The factors are relative to
+the original PDBLINE, frozen in legacy_pdbline.py.
+
+Run as: python benchmarks/bench_record.py [n_atoms]
+"""
+import sys
+import time
+import tracemalloc
+import synthetic
+from legacy_pdbline import PDBLINE as LegacyPDBLINE
+from write_pdb.pdbline import PDBLINE
+from write_pdb.pdbrecord import PDBRecord
+
+
+RECORD_TYPES = {'original PDBLINE': LegacyPDBLINE, 'PDBLINE': PDBLINE, 'PDBRecord': PDBRecord}
+
+
+def roundtrip(record_type, lines):
+    return [record_type.from_line(line).get_line() for line in lines]
+
+
+def renumber(record_type, lines):
+    output = []
+    for i, line in enumerate(lines):
+        record = record_type.from_line(line)
+        if record.is_atom:
+            record['atomid'] = i % 99999 + 1
+        output.append(record.get_line())
+    return output
+
+
+def held_bytes(record_type, lines):
+    """ Traced memory of all parsed lines held at once, per line. """
+    tracemalloc.start()
+    records = [record_type.from_line(line) for line in lines]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return size / len(lines)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    n_atoms = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lines = synthetic.synthetic_structure(n_atoms).decode('ascii').splitlines(keepends=True)
+    assert roundtrip(PDBLINE, lines) == roundtrip(PDBRecord, lines)
+    assert renumber(PDBLINE, lines) == renumber(PDBRecord, lines)
+    # the original PDBLINE passed HETATM records through unparsed
+    atom_lines = [line for line in lines if not line.startswith('HETATM')]
+    assert renumber(LegacyPDBLINE, atom_lines) == renumber(PDBRecord, atom_lines)
+    print(f'{len(lines)} lines')
+    for name, func in [('roundtrip', roundtrip), ('renumber', renumber)]:
+        seconds = {label: timed(func, record_type, lines) for label, record_type in RECORD_TYPES.items()}
+        reference = seconds['original PDBLINE']
+        print(f'{name:<12s}' + ''.join(
+            f'  {label} {len(lines) / seconds[label]:10,.0f} lines/s x{reference / seconds[label]:.1f}'
+            for label in RECORD_TYPES
+        ))
+    size = {label: held_bytes(record_type, lines) for label, record_type in RECORD_TYPES.items()}
+    reference = size['original PDBLINE']
+    print(f'{"memory":<12s}' + ''.join(
+        f'  {label} {size[label]:10,.0f} B/line   x{reference / size[label]:.1f}' for label in RECORD_TYPES
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""Benchmark every public operation and the CLI on synthetic structures.
+
+For every operation and size, the throughput in lines/s and MB/s, the peak
+RSS and the allocations per line are measured, each in a fresh process so
+that the peak RSS belongs to that operation alone. Allocations are given as
+the peak of the memory traced by tracemalloc per line, and as the number of
+memory blocks per line still held once the operation returns, including
+its result. The results are written as JSON, which --compare holds against
+the results of an earlier commit.
+
+Run as: python benchmarks/run_benchmarks.py --sizes 1000 100000 --output results.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import synthetic
+import write_pdb
+from write_pdb import modify_pdb, modify_table
+from write_pdb.pdbline import PDBLINE
+from write_pdb.pdbrecord import PDBRecord
+from write_pdb.pdbtable import PDBTable
+from write_pdb.mapped import MappedPDB
+from write_pdb.pipeline import FusedPipeline
+from write_pdb.parallel import ChunkedPipeline
+
+
+# the per-line operations take minutes on the largest files
+MAX_LINE_ATOMS = 200_000
+# the generated files have 3 header lines before the first atom record
+N_HEADER = 3
+
+
+def read_lines(path):
+    with open(path) as fh:
+        return (fh.readlines(), )
+
+
+def read_table(path):
+    return (PDBTable.from_file(path), )
+
+
+def read_bytes(path):
+    with open(path, 'rb') as fh:
+        return (fh.read(), )
+
+
+def line_positions(path):
+    lines = read_lines(path)[0]
+    return lines, np.random.default_rng(0).uniform(-99, 99, (len(lines) - N_HEADER - 1, 3))
+
+
+def table_positions(path):
+    table = read_table(path)[0]
+    return table, np.random.default_rng(0).uniform(-99, 99, (len(table), 3))
+
+
+def pdbline_roundtrip(lines):
+    return [PDBLINE.from_line(line).get_line() for line in lines]
+
+
+def pdbrecord_roundtrip(lines):
+    return [PDBRecord.from_line(line).get_line() for line in lines]
+
+
+def mapped_open(path):
+    with MappedPDB(path) as mapped:
+        return mapped.n_lines
+
+
+def render(table):
+    return b''.join(table.iter_blocks(binary=True))
+
+
+def fused(path):
+    pipeline = FusedPipeline(fix_atom_numbering=True, fix_residue_numbering=True, n_chains=1, restart_resid_per_chain=True)
+    with open(path) as fh:
+        lines = fh.readlines()
+    return list(pipeline(lambda: iter(lines)))
+
+
+def chunked(path):
+    output = io.BytesIO()
+    ChunkedPipeline(
+        fix_atom_numbering=True, fix_residue_numbering=True, n_chains=1, restart_resid_per_chain=True, jobs=1
+    ).run(path, output)
+    return output.getvalue()
+
+
+# name: (setup, operation, per line), setup gets the path and returns the arguments
+OPERATIONS = {
+    'pdbline.roundtrip': (read_lines, pdbline_roundtrip, True),
+    'pdbrecord.roundtrip': (read_lines, pdbrecord_roundtrip, True),
+    'modify_pdb.fix_atom_numbering': (read_lines, modify_pdb.fix_atom_numbering, True),
+    'modify_pdb.fix_residue_numbering': (read_lines, lambda lines: modify_pdb.fix_residue_numbering(lines, True), True),
+    'modify_pdb.write_positions': (
+        line_positions, lambda lines, positions: modify_pdb.write_positions(lines, positions, N_HEADER, len(lines) - 1), True
+    ),
+    'modify_pdb.section_into_chains': (read_lines, lambda lines: modify_pdb.section_into_chains(lines, None, 1), True),
+    'pipeline.fused': (lambda path: (path, ), fused, True),
+    'pdbtable.from_bytes': (read_bytes, PDBTable.from_bytes, False),
+    'mapped.open': (lambda path: (path, ), mapped_open, False),
+    'pdbtable.render': (read_table, render, False),
+    'modify_table.fix_atom_numbering': (read_table, modify_table.fix_atom_numbering, False),
+    'modify_table.fix_residue_numbering': (read_table, lambda table: modify_table.fix_residue_numbering(table, True), False),
+    'modify_table.write_positions': (table_positions, modify_table.write_positions, False),
+    'modify_table.section_into_chains': (read_table, lambda table: modify_table.section_into_chains(table, None, 1), False),
+    'parallel.chunked': (lambda path: (path, ), chunked, False),
+}
+# runs the CLI and reports its peak RSS, as the rusage of a child counts
+# the RSS of its parent before the exec
+CLI_WRAPPER = '''
+from write_pdb.main import main
+main()
+print(open('/proc/self/status').read().split('VmHWM:')[1].split()[0])
+'''
+# command line of the end to end runs, without input and output
+CLI_RUNS = {
+    'cli.serial': (['-a', '1', '--kick', 'REMARK'], True),
+    'cli.jobs': (['-a', '1', '--kick', 'REMARK', '-j', str(max(2, os.cpu_count()))], False),
+}
+
+
+def peak_rss_mb():
+    """Peak RSS of the current process in MB. Taken from /proc where
+    available, getrusage also counts the parent of a spawned process.
+    """
+    try:
+        with open('/proc/self/status') as fh:
+            return int(fh.read().split('VmHWM:')[1].split()[0]) / 1024
+    except (OSError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(name, path, repeat):
+    """Run an operation in the current process, returns seconds (best of
+    repeat), peak RSS in MB, peak traced bytes and the number of held blocks.
+    """
+    setup, operation, __ = OPERATIONS[name]
+    args = setup(path)
+    seconds = []
+    # silence the debug output of the line based functions
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        blocks_before = sys.getallocatedblocks()
+        for __ in range(repeat):
+            start = time.perf_counter()
+            result = operation(*args)
+            seconds.append(time.perf_counter() - start)
+        n_blocks = sys.getallocatedblocks() - blocks_before
+        del result
+        peak_rss = peak_rss_mb()
+        tracemalloc.start()
+        operation(*args)
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(seconds), peak_rss, traced_peak, n_blocks
+
+
+def measure_cli(options, path):
+    """Run the CLI in a subprocess, returns seconds and its peak RSS in MB."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        command = [sys.executable, '-c', CLI_WRAPPER, '-f', path, '-s', os.path.join(tmp_dir, 'out.pdb')] + options
+        start = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True)
+        seconds = time.perf_counter() - start
+    if completed.returncode:
+        # the last line of the traceback names the error
+        lines = completed.stderr.strip().splitlines() or [f'exit status {completed.returncode}']
+        raise RuntimeError(lines[-1])
+    return seconds, int(completed.stdout.split()[-1]) / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, names, repeat, max_line_atoms, data_dir):
+    results = []
+    spawn = multiprocessing.get_context('spawn')
+    for n_atoms in sizes:
+        path = os.path.join(data_dir, f'synthetic_{n_atoms}.pdb')
+        n_bytes = synthetic.write_structure(path, n_atoms)
+        with open(path, 'rb') as fh:
+            n_lines = sum(1 for __ in fh)
+        for name in names:
+            per_line = OPERATIONS[name][2] if name in OPERATIONS else CLI_RUNS[name][1]
+            if per_line and n_atoms > max_line_atoms:
+                continue
+            result = {'operation': name, 'n_atoms': n_atoms, 'n_lines': n_lines, 'bytes': n_bytes}
+            # a failing operation is recorded, the others are still measured
+            try:
+                if name in CLI_RUNS:
+                    seconds, peak_rss = measure_cli(CLI_RUNS[name][0], path)
+                else:
+                    # a fresh process per operation, so that the peak RSS is its own
+                    with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+                        seconds, peak_rss, traced_peak, n_blocks = pool.submit(measure, name, path, repeat).result()
+                    result['traced_peak_bytes_per_line'] = traced_peak / n_lines
+                    result['blocks_per_line'] = n_blocks / n_lines
+            except Exception as error:
+                result['error'] = f'{type(error).__name__}: {error}'
+                results.append(result)
+                print(f'{name:<36s} {n_atoms:>10d} atoms failed: {result["error"]}', flush=True)
+                continue
+            result.update(
+                seconds=seconds, lines_per_s=n_lines / seconds, mb_per_s=n_bytes / 1e6 / seconds, peak_rss_mb=peak_rss,
+            )
+            results.append(result)
+            print(
+                f'{name:<36s} {n_atoms:>10d} atoms {result["lines_per_s"]:>14,.0f} lines/s '
+                f'{result["mb_per_s"]:>8.1f} MB/s {peak_rss:>8.1f} MB RSS', flush=True,
+            )
+        os.remove(path)
+    return results
+
+
+def compare(results, baseline_file):
+    """Print the change of the throughput against a baseline JSON file."""
+    with open(baseline_file) as fh:
+        baseline = {(item['operation'], item['n_atoms']): item for item in json.load(fh)['results']}
+    print(f'\nthroughput relative to {baseline_file}:')
+    for item in results:
+        old = baseline.get((item['operation'], item['n_atoms']))
+        if 'error' in item:
+            print(f'{item["operation"]:<36s} {item["n_atoms"]:>10d} atoms  failed')
+        elif old and 'error' not in old:
+            print(f'{item["operation"]:<36s} {item["n_atoms"]:>10d} atoms  x{item["lines_per_s"] / old["lines_per_s"]:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS) + list(CLI_RUNS))
+    parser.add_argument('--repeat', type=int, default=3, help='Best of this many runs.')
+    parser.add_argument('--max_line_atoms', type=int, default=MAX_LINE_ATOMS, help='Largest file for per-line operations.')
+    parser.add_argument('--output', '-o', default='benchmark_results.json')
+    parser.add_argument('--compare', help='JSON results of an earlier run.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        results = run(args.sizes, args.operations, args.repeat, args.max_line_atoms, data_dir)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'write_pdb': os.path.dirname(write_pdb.__file__),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as fh:
+        json.dump(report, fh, indent=1)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Deterministic synthetic pdb files of any size, from the residue registry.
+
+Every file has REMARK lines, protein chains ended by TER, HETATM ions and
+water. Chains have at most MAX_CHAIN_RESIDUES residues and water blocks at
+most MAX_WATER_BLOCK molecules, each in a chain of its own, so that atom and
+residue numbers restarted per chain fit their columns. No two neighbouring
+residues share a resname, also across chains, so the file is valid input for
+fix_residue_numbering.
+
+Run as: python benchmarks/synthetic.py n_atoms filename [seed]
+"""
+import sys
+import numpy as np
+from write_pdb import registry
+from write_pdb.residue_class import build_chain
+
+
+AMINO_ACIDS = [name for name in registry.available_residues() if registry.load_registry()[name]['polymer']]
+IONS = ['NA', 'CL']
+MAX_CHAIN_RESIDUES = 2000
+MAX_WATER_BLOCK = 9999
+# atom ids restarted per chain have to fit the 5 columns of their field
+MAX_CHAIN_ATOMS = 99999
+# share of the atoms in protein chains, the rest is water
+PROTEIN_FRACTION = 0.7
+CHAIN_NAMES = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+
+
+# the terminal states add at most 3 atoms, H1, H2, H3 for H and OC1, OC2 for O
+TERMINAL_ATOMS = 3
+
+
+def random_sequence(rng, n_atoms, previous=None):
+    """ Random sequence of amino acids for a chain with at most n_atoms atoms,
+    which does not start with previous, the last residue of the chain before.
+    Returns the sequence and the number of atoms.
+    """
+    sizes = {name: len(registry.get_residue(name).atomnames) for name in AMINO_ACIDS}
+    sequence = []
+    size = TERMINAL_ATOMS
+    while len(sequence) < MAX_CHAIN_RESIDUES:
+        last = sequence[-1] if sequence else previous
+        choices = [name for name in AMINO_ACIDS if name != last]
+        resname = choices[rng.integers(len(choices))]
+        if size + sizes[resname] > n_atoms:
+            break
+        sequence.append(resname)
+        size += sizes[resname]
+    # proline has no amide H, so count the terminal atoms of the chain
+    n_chain_atoms = sum(
+        len(registry.get_residue(name).get_atoms(i == 0, i == len(sequence) - 1)[0])
+        for i, name in enumerate(sequence)
+    )
+    return sequence, n_chain_atoms
+
+
+def check_chain(chainid, n_chain_atoms):
+    """ Raise a ValueError if a chain has too many atoms for its atom ids. """
+    if n_chain_atoms > MAX_CHAIN_ATOMS:
+        raise ValueError(
+            f'Chain {chainid} has {n_chain_atoms} atoms, the atom ids fit at most {MAX_CHAIN_ATOMS}.'
+        )
+
+
+def iter_blocks(n_atoms, seed=0):
+    """ Yield the file as blocks of bytes. """
+    rng = np.random.default_rng(seed)
+    yield (
+        f'REMARK   1 synthetic structure, {n_atoms} atoms, seed {seed}\n'
+        'REMARK   2 generated by benchmarks/synthetic.py\n'
+        'CRYST1  100.000  100.000  100.000  90.00  90.00  90.00 P 1           1\n'
+    ).encode('ascii')
+    chain_idx = 0
+    sequence = None
+    n_protein = int(n_atoms * PROTEIN_FRACTION)
+    while n_protein > 0:
+        # fix_residue_numbering does not restart at chain boundaries
+        sequence, size = random_sequence(rng, n_protein, sequence[-1] if sequence else None)
+        if not sequence:
+            break
+        chainid = CHAIN_NAMES[chain_idx % len(CHAIN_NAMES)]
+        check_chain(chainid, size)
+        table = build_chain(sequence, rng.uniform(-99, 99, (size, 3)), chainid)
+        yield b''.join(table.iter_blocks(binary=True))
+        yield f'TER   {size + 1:5d}      {sequence[-1]:>3s} {chainid}{len(sequence):4d}\n'.encode('ascii')
+        chain_idx += 1
+        n_protein -= size
+        n_atoms -= size
+    # ions take the atoms that do not make up a whole water
+    n_water, n_ions = divmod(n_atoms, 3)
+    if n_ions:
+        ions = [IONS[i % len(IONS)] for i in range(n_ions)]
+        chainid = CHAIN_NAMES[chain_idx % len(CHAIN_NAMES)]
+        table = build_chain(ions, rng.uniform(-99, 99, (n_ions, 3)), chainid, n_terminus=False, c_terminus=False)
+        yield b''.join(table.iter_blocks(binary=True))
+        chain_idx += 1
+    # neighbouring chains never share an id, as CHAIN_NAMES only repeats after
+    # len(CHAIN_NAMES) chains, so the atom ids restart for every water block
+    for start in range(0, n_water, MAX_WATER_BLOCK):
+        n_block = min(MAX_WATER_BLOCK, n_water - start)
+        chainid = CHAIN_NAMES[chain_idx % len(CHAIN_NAMES)]
+        check_chain(chainid, 3 * n_block)
+        table = build_chain(
+            n_block * ['HOH'], rng.uniform(-99, 99, (3 * n_block, 3)), chainid, n_terminus=False, c_terminus=False
+        )
+        yield b''.join(table.iter_blocks(binary=True))
+        chain_idx += 1
+    yield b'END\n'
+
+
+def synthetic_structure(n_atoms, seed=0):
+    """ Content of a synthetic pdb file with n_atoms atom records, as bytes. """
+    return b''.join(iter_blocks(n_atoms, seed))
+
+
+def write_structure(filename, n_atoms, seed=0):
+    """ Write a synthetic pdb file block by block, returns its size in bytes. """
+    size = 0
+    with open(filename, 'wb') as fh:
+        for block in iter_blocks(n_atoms, seed):
+            fh.write(block)
+            size += len(block)
+    return size
+
+
+if __name__ == '__main__':
+    write_structure(sys.argv[2], int(sys.argv[1]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
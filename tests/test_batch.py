@@ -0,0 +1,106 @@
+import os
+import sys
+import gzip
+import json
+import pytest
+from write_pdb import main
+from write_pdb.batch import collect_jobs, run_batch
+from test_parallel import fused_output, structure
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """ Input directory with nested, compressed and non-pdb files. """
+    source = tmp_path / 'in'
+    (source / 'sub' / 'deeper').mkdir(parents=True)
+    for k, name in enumerate(['a.pdb', 'sub/b.pdb', 'sub/deeper/c.pdb']):
+        (source / name).write_text(structure(n_water=k + 1, seed=k))
+    (source / 'sub' / 'd.pdb.gz').write_bytes(gzip.compress(structure(n_water=4, seed=3).encode('utf-8')))
+    (source / 'notes.txt').write_text('not a pdb file\n')
+    return source
+
+
+def read_output(path):
+    data = path.read_bytes()
+    return gzip.decompress(data) if path.name.endswith('.gz') else data
+
+
+def test_directory_is_mirrored_into_out_dir(tree, tmp_path):
+    options = dict(fix_atom_numbering=True, kick='REMARK')
+    out_dir = tmp_path / 'out'
+    jobs = collect_jobs(str(tree), options, str(out_dir))
+    names = ['a.pdb', 'sub/b.pdb', 'sub/d.pdb.gz', 'sub/deeper/c.pdb']
+    assert sorted(os.path.relpath(file, tree) for file, __, __ in jobs) == names
+    for file, save, file_options in jobs:
+        assert save == os.path.join(str(out_dir), os.path.relpath(file, tree))
+        assert file_options == options
+    results = run_batch(jobs, n_procs=2)
+    assert [result['file'] for result in results] == [file for file, __, __ in jobs]
+    assert not any(result['error'] for result in results)
+    for name in names:
+        path = tree / name
+        if name.endswith('.gz'):
+            # fused_output reads plain text
+            path = tmp_path / 'd.pdb'
+            path.write_bytes(read_output(tree / name))
+        assert read_output(out_dir / name) == fused_output(str(path), **options), name
+
+
+def test_glob_is_mirrored_from_its_fixed_part(tree, tmp_path):
+    jobs = collect_jobs(os.path.join(str(tree), 'sub', '**', '*.pdb'), {}, str(tmp_path / 'out'))
+    assert [save for __, save, __ in jobs] == [
+        str(tmp_path / 'out' / 'b.pdb'), str(tmp_path / 'out' / 'deeper' / 'c.pdb'),
+    ]
+
+
+def test_without_out_dir_the_inputs_are_overwritten(tree):
+    jobs = collect_jobs(str(tree))
+    assert all(file == save for file, save, __ in jobs)
+
+
+def test_recipe_overrides_options_per_file(tree, tmp_path):
+    recipe = tmp_path / 'recipe.json'
+    recipe.write_text(json.dumps({
+        'options': {'fix_atom_numbering': True},
+        'files': [
+            'in/a.pdb',
+            {'file': 'in/sub/b.pdb', 'fix_atom_numbering': False, 'fix_residue_numbering': True},
+            {'file': 'in/sub/deeper/c.pdb', 'save': 'elsewhere/c.pdb', 'kick': 'HOH'},
+        ],
+    }))
+    jobs = collect_jobs(str(recipe), {'kick': 'REMARK'}, str(tmp_path / 'out'))
+    expected_options = [
+        {'kick': 'REMARK', 'fix_atom_numbering': True},
+        {'kick': 'REMARK', 'fix_atom_numbering': False, 'fix_residue_numbering': True},
+        {'kick': 'HOH', 'fix_atom_numbering': True},
+    ]
+    expected_saves = [tmp_path / 'out' / 'a.pdb', tmp_path / 'out' / 'sub' / 'b.pdb', tmp_path / 'elsewhere' / 'c.pdb']
+    assert [file_options for __, __, file_options in jobs] == expected_options
+    assert [save for __, save, __ in jobs] == [str(save) for save in expected_saves]
+    assert not any(result['error'] for result in run_batch(jobs, n_procs=1))
+    for (file, __, __), options, save in zip(jobs, expected_options, expected_saves):
+        assert save.read_bytes() == fused_output(file, **options)
+
+
+def test_failures_are_summarized_with_exit_status(tree, tmp_path, monkeypatch, capsys):
+    manifest = tmp_path / 'files.txt'
+    manifest.write_text('# inputs\nin/a.pdb\nin/missing.pdb\n\nin/sub/b.pdb\n')
+    out_dir = tmp_path / 'out'
+    monkeypatch.setattr(sys, 'argv', ['write_pdb', '--batch', str(manifest), '-o', str(out_dir), '-j', '1', '-a', '1'])
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+    assert exit_info.value.code == 1
+    output = capsys.readouterr().out
+    assert '1 failure(s):' in output
+    assert f"{tmp_path / 'in' / 'missing.pdb'}: FileNotFoundError" in output
+    assert '3 file(s), 1 failed' in output
+    # the other files are still transformed
+    for name in ['a.pdb', 'sub/b.pdb']:
+        assert (out_dir / name).read_bytes() == fused_output(str(tree / name), fix_atom_numbering=True)
+    assert not (out_dir / 'missing.pdb').exists()
+
+
+def test_successful_batch_exits_normally(tree, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['write_pdb', '--batch', str(tree), '-o', str(tmp_path / 'out'), '-j', '1'])
+    main.main()
+    assert '4 file(s), 0 failed' in capsys.readouterr().out
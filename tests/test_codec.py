@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from write_pdb import codec
+from write_pdb.pdbline import PDBLINE
+from write_pdb.pdbtable import PDBTable, RECORD_WIDTH, GAP_COLUMNS, is_atom_line
+
+
+# short records, HETATM, negative coordinates, the widest ids and a record
+# with content past the record width, between passthrough lines
+LINES = [
+    'REMARK   1 test structure\n',
+    'ATOM      1  N   MET A   1      11.104  13.207   2.100  1.00  0.00           N  \n',
+    'ATOM      2  CA  MET A   1      -1.000 -13.207 -99.999\n',
+    'ATOM      3  C   MET A   1\n',
+    'HETATM99999 ZN    ZN Z9999    -999.9999999.999   0.000  1.00 99.99      SEG1ZN  \n',
+    'HETATM  -12  O   HOH W  -5       0.000  -0.001   1.000  0.50-10.00           O  extra columns\n',
+    'TER      23      MET A   1\n',
+    'ATOM  12345 HD21 ASN B 999A     12.345  67.890 -12.345  1.00 20.00      PROT H\n',
+    'END\n',
+]
+
+
+def expected_lines(lines):
+    """ The lines as rendered by PDBLINE, other lines unchanged. """
+    return [PDBLINE.from_line(line).get_line() if is_atom_line(line) else line for line in lines]
+
+
+def test_encode_records_matches_pdbline():
+    data = ''.join(LINES).encode('utf-8')
+    buffer, other_lines, __ = codec.decode_records(data, RECORD_WIDTH, GAP_COLUMNS)
+    for pad_with in (' \n', '\n'):
+        rendered = codec.encode_records(buffer, pad_with.encode('latin-1'))
+        atom_lines = [line for line in LINES if is_atom_line(line)]
+        assert [row.tobytes().decode('latin-1') for row in rendered] == [
+            PDBLINE.from_line(line).get_line(pad_with) for line in atom_lines
+        ]
+    assert other_lines == [line for line in LINES if not is_atom_line(line)]
+
+
+@pytest.mark.parametrize('load', [PDBTable.from_lines, lambda lines: PDBTable.from_bytes(''.join(lines).encode('utf-8'))])
+def test_table_get_lines_matches_pdbline(load):
+    table = load(LINES)
+    assert table.get_lines() == expected_lines(LINES)
+    assert ''.join(table.iter_blocks()) == ''.join(expected_lines(LINES))
+    assert b''.join(table.iter_blocks(binary=True)) == ''.join(expected_lines(LINES)).encode('utf-8')
+
+
+def test_set_positions_matches_pdbline():
+    positions = np.array([[0.0005, -0.0005, 1.2345], [-999.999, 9999.999, -0.0], [1e-9, 12.5, -3.25]])
+    table = PDBTable.from_lines(LINES)
+    table.set_positions(positions, 1, 4)
+    atom_lines = [line for line in LINES if is_atom_line(line)]
+    expected = []
+    for i, line in enumerate(atom_lines):
+        record = PDBLINE.from_line(line)
+        if 1 <= i < 4:
+            record.set_positions(positions[i - 1])
+        expected.append(record.get_line())
+    assert [line for line in table.get_lines() if is_atom_line(line)] == expected
+
+
+def test_format_int_matches_python():
+    values = np.array([0, 1, -1, 9, 10, -9999, 99999, 12345, -123])
+    formatted = codec.format_int(values, 5)
+    assert [row.tobytes().decode('ascii') for row in formatted] == [str(value).rjust(5) for value in values]
+
+
+def test_format_float_matches_python():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([
+        rng.uniform(-999.999, 9999.999, 1000),
+        # rounding ties and signed zeros
+        [0.0005, -0.0005, 0.0015, 2.675, -0.0, 0.0, -0.0004, 1e-12, 999.9995],
+    ])
+    formatted = codec.format_float(values, 8)
+    assert [row.tobytes().decode('ascii') for row in formatted] == [f'{value:.3f}'.rjust(8) for value in values]
+    formatted = codec.format_float(values[ : 10] / 100, 6, 2)
+    assert [row.tobytes().decode('ascii') for row in formatted] == [f'{value:.2f}'.rjust(6) for value in values[ : 10] / 100]
+
+
+@pytest.mark.parametrize('value', [100000, -10000, 10 ** 12])
+def test_format_int_rejects_wide_values(value):
+    with pytest.raises(ValueError):
+        codec.format_int([1, value], 5)
+
+
+@pytest.mark.parametrize('value', [10000.0, -1000.0, 99999.9996, 1e20])
+def test_format_float_rejects_wide_values(value):
+    with pytest.raises(ValueError):
+        codec.format_float([1.0, value], 8)
@@ -0,0 +1,102 @@
+import io
+import gzip
+import lzma
+import pytest
+from write_pdb.compression import (
+    MAGIC, BlockCompressor, compress_gzip, compress_xz, detect_compression, iter_line_blocks, open_input,
+    open_output,
+)
+from test_parallel import structure
+
+
+COMPRESSORS = {'gzip': compress_gzip, 'xz': compress_xz}
+DECOMPRESS = {'gzip': gzip.decompress, 'xz': lzma.decompress}
+CONTENT = structure(n_water=20).encode('utf-8')
+
+
+def compressed(compression, data, threads, block_bytes, writes=1000):
+    """ data compressed by a BlockCompressor, written writes bytes at a time. """
+    output = io.BytesIO()
+    with BlockCompressor(output, COMPRESSORS[compression](1), threads, block_bytes) as writer:
+        for start in range(0, len(data), writes):
+            writer.write(data[start : start + writes])
+    return output.getvalue(), writer.n_blocks
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'xz'])
+@pytest.mark.parametrize('threads', [1, 3])
+def test_blocks_round_trip(tmp_path, compression, threads):
+    data, n_blocks = compressed(compression, CONTENT, threads, block_bytes=4096)
+    assert n_blocks > 8
+    # every block is a member or stream of its own, read as one file
+    assert data.count(MAGIC[compression]) >= n_blocks
+    assert DECOMPRESS[compression](data) == CONTENT
+    path = tmp_path / 'out.pdb'
+    path.write_bytes(data)
+    with open_input(str(path)) as fh:
+        assert fh.read() == CONTENT
+    # the output does not depend on the number of threads
+    assert data == compressed(compression, CONTENT, 2, block_bytes=4096)[0]
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'xz'])
+def test_empty_input_is_a_valid_file(tmp_path, compression):
+    data, n_blocks = compressed(compression, b'', 2, block_bytes=4096)
+    assert n_blocks == 1
+    assert DECOMPRESS[compression](data) == b''
+    path = tmp_path / 'empty.pdb'
+    path.write_bytes(data)
+    with open_input(str(path)) as fh:
+        assert fh.read() == b''
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'xz', None])
+def test_open_output_round_trip(tmp_path, compression):
+    path = tmp_path / 'out.pdb'
+    with open(path, 'wb') as raw:
+        with open_output(raw, compression, threads=2) as fh:
+            fh.write(CONTENT)
+    assert detect_compression(str(path)) == compression
+    with open_input(str(path)) as fh:
+        assert fh.read() == CONTENT
+
+
+def test_zstd_round_trip(tmp_path):
+    pytest.importorskip('zstandard')
+    path = tmp_path / 'out.pdb'
+    with open(path, 'wb') as raw:
+        with open_output(raw, 'zstd', threads=2) as fh:
+            fh.write(CONTENT)
+    assert detect_compression(str(path)) == 'zstd'
+    with open_input(str(path)) as fh:
+        assert fh.read() == CONTENT
+
+
+@pytest.mark.parametrize('name, data, compression', [
+    ('plain.pdb.gz', CONTENT, None),
+    ('plain.pdb.xz', CONTENT, None),
+    ('gzip.pdb', gzip.compress(CONTENT), 'gzip'),
+    ('gzip.pdb.xz', gzip.compress(CONTENT), 'gzip'),
+    ('xz.pdb.gz', lzma.compress(CONTENT), 'xz'),
+])
+def test_magic_bytes_win_over_the_extension(tmp_path, name, data, compression):
+    path = tmp_path / name
+    path.write_bytes(data)
+    assert detect_compression(str(path)) == compression
+    with open_input(str(path)) as fh:
+        assert fh.read() == CONTENT
+
+
+def test_empty_file_is_detected_by_its_extension(tmp_path):
+    (tmp_path / 'empty.pdb.gz').write_bytes(b'')
+    (tmp_path / 'empty.pdb').write_bytes(b'')
+    assert detect_compression(str(tmp_path / 'empty.pdb.gz')) == 'gzip'
+    assert detect_compression(str(tmp_path / 'empty.pdb')) is None
+
+
+@pytest.mark.parametrize('block_bytes', [1, 100, 4096, 1 << 20])
+def test_line_blocks_are_whole_lines(block_bytes):
+    data = CONTENT + b'END'
+    blocks = list(iter_line_blocks(io.BufferedReader(io.BytesIO(data)), block_bytes))
+    assert b''.join(blocks) == data
+    assert all(block.endswith(b'\n') for block in blocks[ : -1])
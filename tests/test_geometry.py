@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from write_pdb.geometry import EmptySelectionError, model_atoms, select_atoms, transform_coordinates, transform_file
+from write_pdb.pdbtable import PDBTable
+
+
+def model_lines(positions, resids):
+    """ Atom records of one model, all oxygens of water. """
+    return [
+        f'ATOM  {i + 1:5d}  O   HOH W{resid:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           O  \n'
+        for i, ((x, y, z), resid) in enumerate(zip(positions, resids))
+    ]
+
+
+def structure(rng, n_models=4, n_atoms=6, resids=None):
+    """ Lines of a multi-model file with random positions per model. """
+    lines = ['REMARK   1 test models\n']
+    for k in range(n_models):
+        model_resids = range(1, n_atoms + 1) if resids is None else resids[k]
+        lines.append(f'MODEL     {k + 1:4d}\n')
+        lines.extend(model_lines(rng.uniform(-50, 50, (len(model_resids), 3)), model_resids))
+        lines.append('ENDMDL\n')
+    lines.append('END\n')
+    return lines
+
+
+def test_select_atoms_counts_from_every_model():
+    table = PDBTable.from_lines(structure(np.random.default_rng(0)))
+    mask = select_atoms(table, idx=(1, 3))
+    for idxs in model_atoms(table):
+        assert mask[idxs].tolist() == [False, True, True, False, False, False]
+
+
+@pytest.mark.parametrize('resids', [None, [range(1, 7), range(1, 5), range(1, 7), range(1, 9)]])
+def test_center_selected_atoms_of_every_model(resids):
+    table = PDBTable.from_lines(structure(np.random.default_rng(1), resids=resids))
+    output = transform_coordinates(table, center=True, selection=dict(idx=(1, 3)))
+    for idxs in model_atoms(output):
+        # the selected atoms are centered at the origin, to the 3 decimals of the file
+        assert np.allclose(output.xyz[idxs[1 : 3]].mean(axis=0), 0, atol=1e-3)
+        # the model is moved as a whole
+        moved = output.xyz[idxs] - table.xyz[idxs]
+        assert np.allclose(moved, moved[0], atol=2e-3)
+
+
+@pytest.mark.parametrize('geometry', [dict(center=True), dict(align=np.zeros((1, 3)))])
+def test_empty_selection_is_an_error(geometry):
+    resids = [range(1, 7), range(10, 16), range(1, 7)]
+    table = PDBTable.from_lines(structure(np.random.default_rng(2), n_models=3, resids=resids))
+    with pytest.raises(EmptySelectionError, match='model 2'):
+        transform_coordinates(table, selection=dict(resid=(1, 1)), **geometry)
+
+
+def test_transform_file_reports_how_the_models_were_moved(tmp_path):
+    rng = np.random.default_rng(3)
+    path = tmp_path / 'in.pdb'
+    path.write_text(''.join(structure(rng)))
+    __, at_once = transform_file(str(path), str(tmp_path / 'a.pdb'), center=True)
+    assert at_once
+    path.write_text(''.join(structure(rng, resids=[range(1, 7), range(1, 5), range(1, 7), range(1, 7)])))
+    __, at_once = transform_file(str(path), str(tmp_path / 'b.pdb'), center=True)
+    assert not at_once
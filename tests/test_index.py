@@ -0,0 +1,117 @@
+import os
+import numpy as np
+import pytest
+from write_pdb.index import PDBIndex, open_index, ranges_to_mask, sidecar_name
+from write_pdb.pdbtable import PDBTable
+from test_parallel import structure
+
+
+@pytest.fixture(scope='module')
+def pdb_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('index') / 'in.pdb'
+    path.write_text(structure(n_water=20))
+    return str(path)
+
+
+@pytest.mark.parametrize('name', ['ALA', 'HOH', 'NA', 'TRP', 'XXX'])
+def test_resname_matches_the_table(pdb_file, name):
+    index, table = PDBIndex.build(pdb_file), PDBTable.from_file(pdb_file)
+    ranges = index.resname(name)
+    # one range per residue, in file order
+    assert (np.diff(ranges[:, 0]) > 0).all()
+    assert (ranges_to_mask(ranges, len(index)) == (table.resname == name)).all()
+
+
+@pytest.mark.parametrize('name', ['CA', 'O', 'HD21', ' N ', 'XX'])
+def test_atomname_matches_the_table(pdb_file, name):
+    index, table = PDBIndex.build(pdb_file), PDBTable.from_file(pdb_file)
+    assert (ranges_to_mask(index.atomname(name), len(index)) == (table.atomname == name.strip())).all()
+    assert (index.select(resname='HOH', atomname=name) == (table.atomname == name.strip()) & (table.resname == 'HOH')).all()
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """ Files indexed by PDBIndex.build, to tell a rebuilt index from a loaded one. """
+    built = []
+    build = PDBIndex.build.__func__
+
+    def counting_build(cls, filename):
+        built.append(filename)
+        return build(cls, filename)
+    monkeypatch.setattr(PDBIndex, 'build', classmethod(counting_build))
+    return built
+
+
+@pytest.fixture
+def indexed_file(tmp_path, pdb_file):
+    path = tmp_path / 'in.pdb'
+    path.write_bytes(open(pdb_file, 'rb').read())
+    return str(path)
+
+
+def assert_same_index(index, other):
+    assert index.key == other.key
+    for name in PDBIndex.ARRAYS:
+        assert (getattr(index, name) == getattr(other, name)).all(), name
+
+
+def test_sidecar_is_built_and_reused(indexed_file, builds):
+    index = open_index(indexed_file)
+    assert builds == [indexed_file]
+    assert os.path.isfile(sidecar_name(indexed_file))
+    assert_same_index(open_index(indexed_file), index)
+    assert builds == [indexed_file]
+
+
+def test_sidecar_is_not_written_without_save(indexed_file, tmp_path, builds):
+    open_index(indexed_file, save=False)
+    sidecar = str(tmp_path / 'other.npz')
+    open_index(indexed_file, sidecar)
+    open_index(indexed_file, sidecar)
+    assert not os.path.exists(sidecar_name(indexed_file))
+    assert builds == [indexed_file] * 2
+
+
+def test_changed_size_invalidates_the_sidecar(indexed_file, builds):
+    open_index(indexed_file)
+    with open(indexed_file, 'a') as fh:
+        fh.write('REMARK   9 appended\n')
+    assert open_index(indexed_file).key['size'] == os.path.getsize(indexed_file)
+    assert builds == [indexed_file] * 2
+
+
+def test_touched_file_is_checked_by_its_hash(indexed_file, builds):
+    """ A new mtime alone keeps the index, the sidecar takes the new mtime. """
+    index = open_index(indexed_file)
+    stat = os.stat(indexed_file)
+    os.utime(indexed_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert open_index(indexed_file).key['mtime_ns'] == stat.st_mtime_ns + 10 ** 9
+    assert PDBIndex.load(sidecar_name(indexed_file)).key['mtime_ns'] == stat.st_mtime_ns + 10 ** 9
+    assert builds == [indexed_file]
+    assert_same_index(open_index(indexed_file), PDBIndex.load(sidecar_name(indexed_file)))
+    assert index.key['hash'] == PDBIndex.load(sidecar_name(indexed_file)).key['hash']
+
+
+def test_changed_content_of_same_size_invalidates_the_sidecar(indexed_file, builds):
+    open_index(indexed_file)
+    data = open(indexed_file, 'rb').read()
+    stat = os.stat(indexed_file)
+    # HOH becomes WAT, the size stays the same
+    with open(indexed_file, 'wb') as fh:
+        fh.write(data.replace(b'HOH', b'WAT'))
+    os.utime(indexed_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    index = open_index(indexed_file)
+    assert builds == [indexed_file] * 2
+    assert len(index.resname('HOH')) == 0
+    assert len(index.resname('WAT')) == 20
+
+
+def test_stale_sidecar_version_is_rebuilt(indexed_file, builds):
+    index = open_index(indexed_file)
+    with np.load(sidecar_name(indexed_file)) as stored:
+        arrays = dict(stored)
+    arrays['version'] = 0
+    with open(sidecar_name(indexed_file), 'wb') as fh:
+        np.savez(fh, **arrays)
+    assert_same_index(open_index(indexed_file), index)
+    assert builds == [indexed_file] * 2
@@ -0,0 +1,100 @@
+import io
+import numpy as np
+import pytest
+from write_pdb import modify_table
+from write_pdb.inplace import PatchablePDB, patch_atom_numbering, patch_file
+from write_pdb.pdbtable import PDBTable
+from test_parallel import structure
+
+
+@pytest.fixture
+def pdb_path(tmp_path):
+    path = tmp_path / 'in.pdb'
+    path.write_text(structure(n_water=10))
+    return path
+
+
+def rewritten(table):
+    """ Bytes of table as written by PDBTable. """
+    output = io.BytesIO()
+    table.write(output)
+    return output.getvalue()
+
+
+def without_ter_lines(data):
+    """ Lines of data but TER lines, whose counters fix_atom_numbering erases. """
+    return [line for line in data.splitlines() if not line.startswith(b'TER')]
+
+
+def test_positions_are_patched_in_place(pdb_path):
+    table = PDBTable.from_file(str(pdb_path))
+    positions = np.random.default_rng(1).uniform(-999, 999, (len(table), 3))
+    assert patch_file(str(pdb_path), positions=positions)
+    table.set_positions(positions)
+    assert pdb_path.read_bytes() == rewritten(table)
+
+
+def test_fields_of_some_rows_are_patched_in_place(pdb_path):
+    table = PDBTable.from_file(str(pdb_path))
+    rows = np.arange(3, len(table), 7)
+    assert patch_file(str(pdb_path), atomid=rows + 1, resid=rows % 100, chainid=['Z'] * len(rows), rows=rows)
+    table.set_int_column('atomid', rows + 1, rows)
+    table.set_int_column('resid', rows % 100, rows)
+    table.set_column('chainid', ['Z'] * len(rows), rows)
+    assert pdb_path.read_bytes() == rewritten(table)
+
+
+def test_index_is_reused(pdb_path):
+    with PatchablePDB(str(pdb_path)) as patchable:
+        index = patchable.index
+        n_atoms = len(patchable)
+    positions = np.zeros((n_atoms, 3))
+    assert patch_file(str(pdb_path), positions=positions, index=index)
+    assert (PDBTable.from_file(str(pdb_path)).xyz == 0).all()
+    # an index that does not point at atom records is refused
+    with pytest.raises(ValueError):
+        patch_file(str(pdb_path), positions=positions, index=(index[0] + 1, index[1]))
+
+
+@pytest.mark.parametrize('restart_atomid_per_chain', [True, False])
+def test_atom_numbering_is_patched_in_place(pdb_path, restart_atomid_per_chain):
+    expected = rewritten(modify_table.fix_atom_numbering(PDBTable.from_file(str(pdb_path)), restart_atomid_per_chain))
+    assert patch_atom_numbering(str(pdb_path), restart_atomid_per_chain)
+    assert without_ter_lines(pdb_path.read_bytes()) == without_ter_lines(expected)
+
+
+def test_atom_numbering_restarts_in_every_model(tmp_path):
+    model = structure(n_water=5)
+    path = tmp_path / 'models.pdb'
+    path.write_text('REMARK   0 header\n' + ''.join(f'MODEL     {k:4d}\n{model}ENDMDL\n' for k in (1, 2, 3)))
+    expected = rewritten(modify_table.fix_atom_numbering(PDBTable.from_file(str(path))))
+    assert patch_atom_numbering(str(path))
+    assert without_ter_lines(path.read_bytes()) == without_ter_lines(expected)
+
+
+def test_short_records_fall_back_to_a_rewrite(pdb_path):
+    """ A record cut before the positions can not be patched, the file is
+    rewritten through a PDBTable instead.
+    """
+    lines = pdb_path.read_text().splitlines(keepends=True)
+    short = next(i for i, line in enumerate(lines) if line.startswith('ATOM'))
+    lines[short] = lines[short][ : 40] + '\n'
+    pdb_path.write_text(''.join(lines))
+    table = PDBTable.from_file(str(pdb_path))
+    positions = np.full((len(table), 3), 1.5)
+    with PatchablePDB(str(pdb_path)) as patchable:
+        assert not patchable.fits('posz')
+        assert patchable.fits('atomid')
+    assert not patch_file(str(pdb_path), positions=positions)
+    table.set_positions(positions)
+    assert pdb_path.read_bytes() == rewritten(table)
+    # fields that fit are still patched in place
+    assert patch_file(str(pdb_path), atomid=np.arange(len(table)))
+
+
+def test_values_that_do_not_fit_leave_the_file_unchanged(pdb_path):
+    before = pdb_path.read_bytes()
+    n_atoms = len(PDBTable.from_file(str(pdb_path)))
+    with pytest.raises(ValueError):
+        patch_file(str(pdb_path), positions=np.zeros((n_atoms, 3)), chainid=['AB'] * n_atoms)
+    assert pdb_path.read_bytes() == before
@@ -0,0 +1,20 @@
+import argparse
+import pytest
+from write_pdb.main import int_range
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('5', (5, None)),
+    ('-5', (-5, None)),
+    ('5-10', (5, 10)),
+    ('-5-3', (-5, 3)),
+    ('-10--5', (-10, -5)),
+])
+def test_int_range_takes_signed_ids(text, expected):
+    assert int_range('-')(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', 'A', '5-', '--5', '1-2-3'])
+def test_int_range_rejects_other_text(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        int_range('-')(text)
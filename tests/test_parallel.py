@@ -0,0 +1,147 @@
+import io
+import itertools
+import numpy as np
+import pytest
+from write_pdb import modify_pdb, modify_table
+from write_pdb.modify_pdb import count_residues
+from write_pdb.parallel import ChunkedPipeline, ModelPipeline, chunk_bounds
+from write_pdb.pdbtable import PDBTable
+from write_pdb.pipeline import FusedPipeline
+from write_pdb.registry import get_residue
+from write_pdb.residue_class import build_chain
+
+
+# chunks of a few lines, so that chunk boundaries fall everywhere, also
+# between the atoms of a residue and right before TER lines
+MIN_CHUNK_BYTES = 2048
+SEQUENCES = [
+    ['MET', 'ALA', 'GLY', 'SER', 'LYS', 'ALA', 'PRO', 'TRP'] * 4,
+    ['GLY', 'LEU', 'ALA'] * 7,
+    ['CYS', 'ASP', 'GLU', 'HIS', 'ILE', 'VAL'] * 5,
+]
+
+
+def structure(n_water=40, seed=0):
+    """ Content of a pdb file with protein chains, ions and water, and
+    scrambled atom and residue numbers.
+    """
+    rng = np.random.default_rng(seed)
+    blocks = ['REMARK   1 test structure\n', 'CRYST1  100.000  100.000  100.000  90.00  90.00  90.00 P 1\n']
+    for chainid, sequence in zip('ABC', SEQUENCES):
+        n_atoms = sum(len(atoms) for atoms in build_atom_names(sequence))
+        table = build_chain(sequence, rng.uniform(-99, 99, (n_atoms, 3)), chainid)
+        table.atomid = rng.integers(1, 99999, len(table))
+        # keep residue boundaries, but number them arbitrarily
+        starts = np.flatnonzero(np.r_[True, table.resid[1 : ] != table.resid[ : -1]])
+        table.resid = np.repeat(rng.permutation(9999)[ : len(starts)] + 1, np.diff(np.r_[starts, len(table)]))
+        blocks.extend(table.iter_blocks())
+        blocks.append(f'TER   {len(table) + 1:5d}      {sequence[-1]:>3s} {chainid}{len(sequence):4d}\n')
+        blocks.append('REMARK   2 between chains\n')
+    table = build_chain(['NA', 'CL'], rng.uniform(-99, 99, (2, 3)), 'X', n_terminus=False, c_terminus=False)
+    blocks.extend(table.iter_blocks())
+    table = build_chain(n_water * ['HOH'], rng.uniform(-99, 99, (3 * n_water, 3)), 'W', n_terminus=False, c_terminus=False)
+    blocks.extend(table.iter_blocks())
+    blocks.append('END\n')
+    return ''.join(blocks)
+
+
+def build_atom_names(sequence):
+    """ Atom names of every residue of a chain, with its terminal states. """
+    return [
+        get_residue(name).get_atoms(i == 0, i == len(sequence) - 1)[0] for i, name in enumerate(sequence)
+    ]
+
+
+@pytest.fixture(scope='module')
+def pdb_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('parallel') / 'in.pdb'
+    path.write_text(structure())
+    return str(path)
+
+
+def fused_output(filename, **options):
+    with open(filename) as fh:
+        lines = fh.readlines()
+    return ''.join(FusedPipeline(**options)(lambda: iter(lines))).encode('utf-8')
+
+
+def chunked_output(filename, jobs, **options):
+    output = io.BytesIO()
+    ChunkedPipeline(jobs=jobs, min_chunk_bytes=MIN_CHUNK_BYTES, **options).run(filename, output)
+    return output.getvalue()
+
+
+def count_output_residues(filename, **options):
+    """ Number of residues the sectioning sees, after the other transformations. """
+    lines = fused_output(filename, **options).decode('utf-8').splitlines(keepends=True)
+    return count_residues(lines)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@pytest.mark.parametrize('kick', [None, 'REMARK', 'HOH'])
+@pytest.mark.parametrize('sectioning', [None, 'int', 'list'])
+def test_chunked_matches_fused(pdb_file, jobs, kick, sectioning):
+    for restart_atomid, restart_resid in itertools.product([True, False], repeat=2):
+        options = dict(
+            kick=kick,
+            fix_atom_numbering=True,
+            fix_residue_numbering=True,
+            restart_atomid_per_chain=restart_atomid,
+            restart_resid_per_chain=restart_resid,
+        )
+        n_residues = count_output_residues(pdb_file, **options)
+        options['residues_per_chain'] = {
+            None: None,
+            'int': next(n for n in range(7, n_residues + 1) if n_residues % n == 0),
+            'list': [n_residues // 3, n_residues // 3, n_residues - 2 * (n_residues // 3)],
+        }[sectioning]
+        assert chunked_output(pdb_file, jobs, **options) == fused_output(pdb_file, **options), options
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@pytest.mark.parametrize('options', [
+    dict(kick='REMARK'),
+    dict(fix_atom_numbering=True),
+    dict(fix_atom_numbering=True, restart_atomid_per_chain=False),
+    dict(fix_residue_numbering=True),
+    dict(fix_residue_numbering=True, restart_resid_per_chain=True),
+    dict(n_chains=1),
+])
+def test_single_transformation_matches_fused(pdb_file, jobs, options):
+    assert chunked_output(pdb_file, jobs, **options) == fused_output(pdb_file, **options)
+
+
+def test_file_is_split_into_many_chunks(pdb_file):
+    assert len(chunk_bounds(pdb_file, 64, MIN_CHUNK_BYTES)) > 16
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_crlf_is_read_as_text(tmp_path, jobs):
+    """ Line endings are translated to \\n, as by FusedPipeline on a file opened in text mode. """
+    path = tmp_path / 'crlf.pdb'
+    path.write_bytes(structure(n_water=5).replace('\n', '\r\n').replace('REMARK   2', 'REMARK 2\rREMARK 3').encode('utf-8'))
+    options = dict(kick='REMARK 3', fix_atom_numbering=True, fix_residue_numbering=True)
+    output = chunked_output(str(path), jobs, **options)
+    assert b'\r' not in output
+    assert output == fused_output(str(path), **options)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_models_drop_other_lines_as_a_single_model(tmp_path, jobs):
+    """ fix_residue_numbering drops the lines outside of the models but MODEL
+    and ENDMDL, as it drops all non atom lines of a file without models.
+    """
+    model_path = tmp_path / 'model.pdb'
+    model_path.write_text(structure(n_water=5))
+    model = fused_output(str(model_path), fix_residue_numbering=True).decode('utf-8')
+    path = tmp_path / 'models.pdb'
+    path.write_text('REMARK   0 header\n' + ''.join(
+        f'MODEL     {k:4d}\n{model_path.read_text()}ENDMDL\nREMARK   4 between\n' for k in (1, 2, 3)
+    ) + 'END\n')
+    expected = ''.join(f'MODEL     {k:4d}\n{model}ENDMDL\n' for k in (1, 2, 3))
+    lines = path.read_text().splitlines(keepends=True)
+    assert ''.join(modify_pdb.fix_residue_numbering(lines)) == expected
+    assert ''.join(modify_table.fix_residue_numbering(PDBTable.from_lines(lines)).get_lines()) == expected
+    output = io.BytesIO()
+    ModelPipeline(jobs=jobs, fix_residue_numbering=True).run(str(path), output)
+    assert output.getvalue().decode('utf-8') == expected
@@ -0,0 +1,28 @@
+import pytest
+from write_pdb.pdbline import PDBLINE
+from write_pdb.pdbrecord import PDBRecord, OTHER_RECORD, parse_line
+from test_codec import LINES
+
+
+def test_pdbline_has_the_fields_of_pdbrecord():
+    for line in LINES:
+        pdb_line, record = PDBLINE.from_line(line), PDBRecord.from_line(line)
+        assert pdb_line.is_atom == record.is_atom
+        assert pdb_line.get_line() == record.get_line()
+        if record.is_atom:
+            assert dict(pdb_line) == {key: record[key] for key in PDBLINE.field_templates}
+
+
+def test_pdbline_renders_only_the_fields_it_has():
+    pdb_line = PDBLINE(None, type='ATOM', atomid=7, resname='ALA')
+    pdb_line['posx'] = '1.500'
+    # fields are right aligned, also the record type
+    assert pdb_line.get_line('\n') == '  ATOM    7      ALA' + 10 * ' ' + '   1.500' + 41 * ' ' + '\n'
+    with pytest.raises(ValueError):
+        pdb_line['resid'] = 12345
+
+
+def test_other_lines_share_a_record():
+    assert parse_line('REMARK   1 test\n') is OTHER_RECORD
+    assert parse_line('TER      23      MET A   1\n') is OTHER_RECORD
+    assert parse_line(LINES[1]).get_line() == PDBRecord.from_line(LINES[1]).get_line()
@@ -0,0 +1,150 @@
+import io
+import gzip
+import asyncio
+import threading
+import pytest
+from write_pdb.parallel import ModelPipeline
+from write_pdb.streaming import (
+    BlockReader, BlockWriter, StreamingModelPipeline, StreamingPipeline, aiter_output, open_pipeline,
+    stream_file, stream_file_async,
+)
+from test_parallel import fused_output, structure
+
+
+# blocks of a few lines, so that block boundaries fall everywhere
+BLOCK_BYTES = 1024
+OPTIONS = [
+    dict(kick='REMARK'),
+    dict(fix_atom_numbering=True, fix_residue_numbering=True),
+    dict(fix_atom_numbering=True, restart_atomid_per_chain=False, residues_per_chain=25),
+    dict(kick='HOH', n_chains=1),
+]
+
+
+@pytest.fixture(scope='module')
+def pdb_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('streaming') / 'in.pdb'
+    path.write_text(structure())
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def models_file(tmp_path_factory):
+    model = structure(n_water=5)
+    path = tmp_path_factory.mktemp('streaming') / 'models.pdb'
+    path.write_text('REMARK   0 header\n' + ''.join(
+        f'MODEL     {k:4d}\n{model}ENDMDL\n' for k in range(1, 6)
+    ) + 'END\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('models', [None, [2, 4]])
+def test_models_are_streamed_through_the_threads(models_file, models):
+    options = dict(kick='REMARK   2', fix_atom_numbering=True, fix_residue_numbering=True)
+    pipeline = open_pipeline(models_file, models=models, queue_blocks=1, **options)
+    assert isinstance(pipeline, StreamingModelPipeline)
+    read_in = set()
+    read_bytes = pipeline.read_bytes
+
+    def record_thread(filename, *args, **kwargs):
+        # the models are read from the file in the reader, later sliced from their bytes
+        if isinstance(filename, str):
+            read_in.add(threading.current_thread().name)
+        return read_bytes(filename, *args, **kwargs)
+
+    pipeline.read_bytes = record_thread
+    output = io.BytesIO()
+    pipeline.run(models_file, output)
+    assert read_in == {'write_pdb-reader'}
+    expected = io.BytesIO()
+    ModelPipeline(models=models, jobs=1, **options).run(models_file, expected)
+    assert output.getvalue() == expected.getvalue()
+
+
+class FailingFile(io.BytesIO):
+    """ Binary file whose writes fail after the first. """
+
+    def write(self, block):
+        if self.tell():
+            raise OSError('disk full')
+        return super().write(block)
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_streamed_output_matches_fused(pdb_file, tmp_path, options):
+    output = tmp_path / 'out.pdb'
+    pipeline = stream_file(pdb_file, str(output), block_bytes=BLOCK_BYTES, queue_blocks=1, **options)
+    assert isinstance(pipeline, StreamingPipeline)
+    assert output.read_bytes() == fused_output(pdb_file, **options)
+
+
+def test_blocks_end_with_whole_lines(pdb_file):
+    blocks = list(StreamingPipeline(BLOCK_BYTES, fix_atom_numbering=True).iter_output(pdb_file))
+    assert len(blocks) > 16
+    assert all(block.endswith(b'\n') for block in blocks)
+    assert b''.join(blocks) == fused_output(pdb_file, fix_atom_numbering=True)
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_aiter_output_matches_fused(pdb_file, options):
+    async def collect():
+        return [block async for block in aiter_output(pdb_file, block_bytes=BLOCK_BYTES, **options)]
+    assert b''.join(asyncio.run(collect())) == fused_output(pdb_file, **options)
+
+
+def test_aiter_output_can_be_left_early(pdb_file):
+    async def first_block():
+        async for block in aiter_output(pdb_file, block_bytes=BLOCK_BYTES, queue_blocks=1):
+            return block
+    assert fused_output(pdb_file).startswith(asyncio.run(first_block()))
+
+
+def test_stream_file_async_matches_fused(pdb_file, tmp_path):
+    output = tmp_path / 'out.pdb.gz'
+    options = dict(fix_atom_numbering=True, fix_residue_numbering=True)
+
+    async def stream():
+        # the event loop keeps running while the file is streamed
+        ticks = 0
+        task = asyncio.ensure_future(stream_file_async(pdb_file, str(output), block_bytes=BLOCK_BYTES, **options))
+        while not task.done():
+            ticks += 1
+            await asyncio.sleep(0)
+        return task.result(), ticks
+    pipeline, ticks = asyncio.run(stream())
+    assert isinstance(pipeline, StreamingPipeline) and ticks > 0
+    assert gzip.decompress(output.read_bytes()) == fused_output(pdb_file, **options)
+
+
+def test_reader_errors_are_raised_in_the_consumer(tmp_path):
+    with BlockReader(str(tmp_path / 'missing.pdb'), BLOCK_BYTES) as reader:
+        with pytest.raises(FileNotFoundError):
+            list(reader)
+    with pytest.raises(FileNotFoundError):
+        stream_file(str(tmp_path / 'missing.pdb'), str(tmp_path / 'out.pdb'))
+    assert not (tmp_path / 'out.pdb').exists()
+
+
+def test_failed_decompression_keeps_the_target(tmp_path):
+    path = tmp_path / 'in.pdb.gz'
+    path.write_bytes(gzip.compress(structure(n_water=5).encode('utf-8'))[ : -64])
+    target = tmp_path / 'out.pdb'
+    target.write_bytes(b'old content\n')
+    with pytest.raises(EOFError):
+        stream_file(str(path), str(target), block_bytes=BLOCK_BYTES)
+    assert target.read_bytes() == b'old content\n'
+
+
+def test_writer_errors_are_raised_in_the_producer(pdb_file):
+    writer = BlockWriter(FailingFile(), queue_blocks=1)
+    writer.write(b'first\n')
+    with pytest.raises(OSError, match='disk full'):
+        try:
+            for __ in range(100):
+                writer.write(b'next\n')
+        finally:
+            writer.close()
+    # the reader stops once the pipeline gives up, with a single block of queue
+    with pytest.raises(OSError, match='disk full'):
+        StreamingPipeline(BLOCK_BYTES, queue_blocks=1).run(pdb_file, FailingFile())
+    assert not [thread for thread in threading.enumerate() if thread.name in ('write_pdb-reader', 'write_pdb-writer')]
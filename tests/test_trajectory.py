@@ -0,0 +1,80 @@
+import io
+import gzip
+import numpy as np
+import pytest
+from write_pdb.pdbline import PDBLINE
+from write_pdb.pdbtable import PDBTable
+from write_pdb.trajectory import TrajectoryWriter, write_trajectory
+from test_parallel import structure
+
+
+LINES = structure(n_water=5).splitlines(keepends=True)
+N_ATOMS = sum(line.startswith(('ATOM', 'HETATM')) for line in LINES)
+
+
+def expected_trajectory(frames, model_ids=None):
+    """ The frames written line by line through PDBLINE: the header once, the
+    atom records with their positions and the TER and REMARK lines between
+    them, as they are, in every model, END at last.
+    """
+    first_atom = next(i for i, line in enumerate(LINES) if line.startswith(('ATOM', 'HETATM')))
+    body = [line for line in LINES[first_atom : ] if line[ : 6].strip() not in ('MODEL', 'ENDMDL', 'END')]
+    output = LINES[ : first_atom]
+    for k, positions in enumerate(frames):
+        output.append(f'MODEL     {k + 1 if model_ids is None else model_ids[k]:4d}\n')
+        atoms = iter(positions)
+        for line in body:
+            pdb_line = PDBLINE.from_line(line)
+            if pdb_line.is_atom:
+                pdb_line.set_positions(next(atoms))
+                line = pdb_line.get_line()
+            output.append(line)
+        output.append('ENDMDL\n')
+    output.append('END\n')
+    return ''.join(output).encode('utf-8')
+
+
+def random_frames(n_frames, seed=0):
+    return np.random.default_rng(seed).uniform(-999, 999, (n_frames, N_ATOMS, 3))
+
+
+@pytest.mark.parametrize('template', ['lines', 'table', 'file'])
+def test_frames_match_pdbline(tmp_path, template):
+    frames = random_frames(4)
+    path = tmp_path / 'in.pdb'
+    path.write_text(''.join(LINES))
+    template = {'lines': LINES, 'table': PDBTable.from_lines(LINES), 'file': str(path)}[template]
+    output = io.BytesIO()
+    with TrajectoryWriter(template, output) as writer:
+        writer.write_frames(frames)
+    assert writer.n_frames == 4
+    assert output.getvalue() == expected_trajectory(frames)
+
+
+def test_memmapped_frames_match_pdbline(tmp_path):
+    frames = random_frames(5, seed=1)
+    mapped = np.lib.format.open_memmap(str(tmp_path / 'frames.npy'), mode='w+', dtype=np.float32, shape=frames.shape)
+    mapped[:] = frames
+    mapped.flush()
+    frames = np.load(str(tmp_path / 'frames.npy'), mmap_mode='r')
+    write_trajectory(LINES, frames, str(tmp_path / 'out.pdb.gz'), threads=2)
+    assert gzip.decompress((tmp_path / 'out.pdb.gz').read_bytes()) == expected_trajectory(frames)
+
+
+def test_frames_are_numbered_by_model_id():
+    frames = random_frames(3, seed=2)
+    output = io.BytesIO()
+    with TrajectoryWriter(LINES, output) as writer:
+        for model_id, positions in zip((10, 20, 30), frames):
+            writer.write_frame(positions, model_id)
+    assert output.getvalue() == expected_trajectory(frames, (10, 20, 30))
+
+
+def test_no_frames_keep_header_and_end(tmp_path):
+    write_trajectory(LINES, [], str(tmp_path / 'out.pdb'))
+    assert (tmp_path / 'out.pdb').read_bytes() == expected_trajectory([])
+
+
+def test_frames_of_the_wrong_size_are_refused():
+    with pytest.raises(AssertionError):
+        TrajectoryWriter(LINES, io.BytesIO()).write_frame(np.zeros((N_ATOMS - 1, 3)))
@@ -1,4 +1,90 @@
-from .residue_class import Residue
-from .modify_pdb import *
-from .pdbline import PDBLINE
-from .main import main
+"""Modify pdb files, see main for the CLI.
+
+Submodules and the public names below are imported on first access, so that
+importing the package, or only the per-line functions, does not import
+numpy or the array based modules.
+
+write_pdb.main is always the module of the CLI, its entry point is
+write_pdb.main.main. The function is not exported as write_pdb.main, as
+importing the module, i.e. by python -m write_pdb.main, binds the module to
+that name, so it would depend on the import order which of both it is.
+"""
+import importlib
+
+
+# public name: submodule it is defined in
+LAZY_ATTRIBUTES = {
+    'Residue': 'residue_class',
+    'build_chain': 'residue_class',
+    'get_residue': 'registry',
+    'render_residue': 'registry',
+    'IsNewChain': 'modify_pdb',
+    'AtomNumbering': 'modify_pdb',
+    'ResidueNumbering': 'modify_pdb',
+    'IsNewResidue': 'modify_pdb',
+    'ChainSectioning': 'modify_pdb',
+    'kick_lines': 'modify_pdb',
+    'iter_fix_atom_numbering': 'modify_pdb',
+    'fix_atom_numbering': 'modify_pdb',
+    'iter_fix_residue_numbering': 'modify_pdb',
+    'fix_residue_numbering': 'modify_pdb',
+    'iter_write_positions': 'modify_pdb',
+    'write_positions': 'modify_pdb',
+    'count_residues': 'modify_pdb',
+    'get_residues_per_chain': 'modify_pdb',
+    'iter_chain_ends': 'modify_pdb',
+    'iter_section_into_chains': 'modify_pdb',
+    'section_into_chains': 'modify_pdb',
+    'PDBLINE': 'pdbline',
+    'PDBRecord': 'pdbrecord',
+    'PDBTable': 'pdbtable',
+    'open_input': 'compression',
+    'open_output': 'compression',
+    'detect_compression': 'compression',
+    'MappedPDB': 'mapped',
+    'PatchablePDB': 'inplace',
+    'patch_file': 'inplace',
+    'PDBIndex': 'index',
+    'open_index': 'index',
+    'TrajectoryWriter': 'trajectory',
+    'write_trajectory': 'trajectory',
+    'ChunkedPipeline': 'parallel',
+    'process_file': 'parallel',
+    'ModelPipeline': 'parallel',
+    'find_models': 'models',
+    'parse_selection': 'models',
+    'transform_coordinates': 'geometry',
+    'transform_file': 'geometry',
+    'select_atoms': 'geometry',
+    'kabsch': 'geometry',
+    'StreamingPipeline': 'streaming',
+    'stream_file': 'streaming',
+    'stream_file_async': 'streaming',
+    'aiter_output': 'streaming',
+    'collect_jobs': 'batch',
+    'run_batch': 'batch',
+    'PipelineStats': 'stats',
+}
+SUBMODULES = (
+    'batch', 'codec', 'compression', 'fileio', 'geometry', 'index', 'inplace', 'main',
+    'mapped', 'models', 'modify_pdb', 'modify_table', 'parallel', 'pdbline', 'pdbrecord', 'pdbtable',
+    'pipeline', 'registry', 'residue_class', 'stats', 'streaming', 'trajectory',
+)
+__all__ = list(LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(f'.{LAZY_ATTRIBUTES[name]}', __name__), name)
+    elif name in SUBMODULES:
+        value = importlib.import_module(f'.{name}', __name__)
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    # importing a submodule sets it as attribute of the package, i.e. main,
+    # so the name is bound after the import
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_ATTRIBUTES) | set(SUBMODULES))
@@ -0,0 +1,157 @@
+import os
+import glob
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from write_pdb.parallel import process_file
+
+
+# keys of a recipe entry that are not transformation options
+ENTRY_KEYS = ('file', 'save')
+# files collected from a directory, plain or compressed
+PDB_PATTERNS = ('*.pdb', '*.pdb.gz', '*.pdb.xz', '*.pdb.zst')
+
+
+def load_recipe(filename):
+    """Load a JSON or TOML recipe, a dict with the optional keys
+    options (dict): Transformations for all files, see ChunkedPipeline.
+    files (list): Entries, either a file name or a dict with the keys file,
+        optionally save and any options that differ for this file.
+    """
+    if filename.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            # python < 3.11, tomli is a dependency there
+            try:
+                import tomli as tomllib
+            except ImportError as error:
+                raise ImportError('TOML recipes need the tomli package before python 3.11, pip install tomli') from error
+        with open(filename, 'rb') as fh:
+            return tomllib.load(fh)
+    with open(filename) as fh:
+        return json.load(fh)
+
+
+def mirror_root(files, source):
+    """Directory whose structure is mirrored in the output directory."""
+    if os.path.isdir(source):
+        return source
+    if glob.has_magic(source):
+        parts = source.split(os.sep)
+        idx = next(i for i, part in enumerate(parts) if glob.has_magic(part))
+        return os.sep.join(parts[ : idx]) or os.curdir
+    if not files:
+        return os.curdir
+    return os.path.commonpath([os.path.dirname(os.path.abspath(file)) for file in files])
+
+
+def collect_jobs(source, options=None, out_dir=None):
+    """List the files to process with their save names and options.
+    Arguments:
+        source (str): Glob pattern, directory (all .pdb files in it, recursively,
+            also compressed ones, see PDB_PATTERNS),
+            JSON/TOML recipe (see load_recipe) or manifest with one file per line.
+            Relative paths in recipes and manifests start at their directory.
+        options (dict): Default transformations, see ChunkedPipeline.
+        out_dir (str): Directory the outputs are written to, mirroring the
+            structure of the inputs, default: overwrite the inputs.
+    Returns:
+        list of (file, save, options).
+    """
+    options = dict(options or {})
+    entries = []
+    if os.path.isdir(source):
+        entries = sorted(
+            file for pattern in PDB_PATTERNS
+            for file in glob.glob(os.path.join(source, '**', pattern), recursive=True)
+        )
+    elif glob.has_magic(source):
+        entries = sorted(glob.glob(source, recursive=True))
+    elif source.endswith(('.json', '.toml')):
+        recipe = load_recipe(source)
+        options.update(recipe.get('options', {}))
+        entries = recipe.get('files', [])
+    else:
+        with open(source) as fh:
+            entries = [line.strip() for line in fh if line.strip() and not line.startswith('#')]
+    base_dir = os.path.dirname(source) if os.path.isfile(source) else ''
+    jobs = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'file': entry}
+        file = os.path.join(base_dir, entry['file'])
+        save = entry.get('save')
+        if save is not None:
+            save = os.path.join(base_dir, save)
+        file_options = dict(options)
+        file_options.update({key: item for key, item in entry.items() if key not in ENTRY_KEYS})
+        jobs.append([file, save, file_options])
+    root = mirror_root([file for file, __, __ in jobs], source)
+    for job in jobs:
+        if job[1] is None:
+            job[1] = job[0] if out_dir is None else os.path.join(out_dir, os.path.relpath(job[0], root))
+    return [tuple(job) for job in jobs]
+
+
+def run_job(job):
+    """Transform a single file, never raises. Returns a dict with file, save,
+    seconds and error, which is None on success.
+    """
+    file, save, options = job
+    start = time.perf_counter()
+    error = None
+    try:
+        save_dir = os.path.dirname(os.path.abspath(save))
+        os.makedirs(save_dir, exist_ok=True)
+        # the files are already spread over the processes, so is the compression
+        process_file(file, save, jobs=1, threads=1, **options)
+    except Exception as exc:
+        error = f'{type(exc).__name__}: {exc}'
+    return {'file': file, 'save': save, 'seconds': time.perf_counter() - start, 'error': error}
+
+
+def run_batch(jobs, n_procs=None, max_in_flight=None):
+    """Process all jobs in a pool of processes, see collect_jobs. At most
+    max_in_flight files are submitted at once, so that huge batches do not
+    queue up in memory. Failures are collected, they do not stop the batch.
+    Arguments:
+        jobs (list): (file, save, options) per file.
+        n_procs (int): Number of processes, default: os.cpu_count()
+        max_in_flight (int): Default: 2 * n_procs
+    Returns:
+        list of the results of run_job, in the order of jobs.
+    """
+    n_procs = n_procs or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * n_procs
+    results = [None] * len(jobs)
+    if n_procs == 1:
+        return [run_job(job) for job in jobs]
+    with ProcessPoolExecutor(n_procs) as pool:
+        pending = {}
+        for idx, job in enumerate(jobs):
+            if len(pending) >= max_in_flight:
+                done, __ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+            pending[pool.submit(run_job, job)] = idx
+        for future in wait(pending).done:
+            results[pending[future]] = future.result()
+    return results
+
+
+def print_summary(results, wall_time):
+    """Print the time per file, all failures and the totals."""
+    for result in results:
+        status = 'FAILED' if result['error'] else 'ok'
+        print(f"{status:<6s} {result['seconds']:8.3f}s  {result['file']}")
+    failures = [result for result in results if result['error']]
+    if failures:
+        print(f'\n{len(failures)} failure(s):')
+        for result in failures:
+            print(f"{result['file']}: {result['error']}")
+    total = sum(result['seconds'] for result in results)
+    print(
+        f'\n{len(results)} file(s), {len(failures)} failed, {wall_time:.2f}s wall time, '
+        f'{total:.2f}s summed over files.'
+    )
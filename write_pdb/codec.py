@@ -0,0 +1,202 @@
+import numpy as np
+
+
+SPACE = ord(' ')
+NEWLINE = ord('\n')
+# number of rows gathered at once when cutting lines into fixed-width records,
+# bounds the size of the temporary index arrays
+CHUNK_SIZE = 1 << 16
+# codes of the record types found by record_kinds
+ATOM, HETATM, TER, MODEL, ENDMDL, OTHER = range(6)
+RECORD_KINDS = ('ATOM', 'HETATM', 'TER', 'MODEL', 'ENDMDL', 'OTHER')
+# first six columns of all lines for which line[:6].strip() is ATOM or HETATM
+ATOM_TYPES = np.frombuffer(b'ATOM   ATOM   ATOMHETATM', dtype=np.uint8).reshape(-1, 6)
+ATOM_TYPE_KINDS = np.array([ATOM, ATOM, ATOM, HETATM], dtype=np.int8)
+WHITESPACE = np.frombuffer(b' \t\n\r\x0b\x0c', dtype=np.uint8)
+
+
+def as_bytes_array(data):
+    """ View bytes, bytearray, mmap or np.ndarray as flat np.ndarray of np.uint8. """
+    if isinstance(data, np.ndarray):
+        return data.reshape(-1).view(np.uint8)
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def normalize_newlines(data):
+    """ Translate \\r\\n and \\r line endings to \\n, as done when opening in text mode. """
+    if b'\r' not in data:
+        return data
+    return bytes(data).replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+
+def line_bounds(data):
+    """ Return the start and end (exclusive, including the newline) of every line. """
+    array = as_bytes_array(data)
+    ends = np.flatnonzero(array == NEWLINE) + 1
+    if len(array) and (not len(ends) or ends[-1] != len(array)):
+        ends = np.append(ends, len(array))
+    starts = np.zeros(len(ends), dtype=np.int64)
+    starts[1 : ] = ends[ : -1]
+    return starts, ends
+
+
+def gather(data, starts, ends, width):
+    """ Cut the lines given by starts and ends into a (-1, width) array of
+    bytes, padding short lines with spaces and cutting long ones.
+    """
+    array = as_bytes_array(data)
+    out = np.empty((len(starts), width), dtype=np.uint8)
+    # lines at least as long as the records are copied row wise
+    full = ends - starts >= width
+    if len(array) >= width:
+        out[full] = np.lib.stride_tricks.sliding_window_view(array, width)[starts[full]]
+    # shorter lines are padded column by column, in chunks to bound the index arrays
+    short_idxs = np.flatnonzero(~full)
+    columns = np.arange(width)
+    for chunk in range(0, len(short_idxs), CHUNK_SIZE):
+        rows = short_idxs[chunk : chunk + CHUNK_SIZE]
+        idxs = starts[rows, None] + columns
+        out[rows] = np.where(
+            idxs < ends[rows, None], array[np.minimum(idxs, len(array) - 1)], SPACE
+        )
+    return out
+
+
+def record_kinds(data, starts, ends):
+    """ Classify every line as one of RECORD_KINDS in a single scan over the
+    first six columns, without creating a str per line. ATOM and HETATM use
+    the same test as PDBLINE.from_line.
+    """
+    heads = gather(data, starts, ends, 6)
+    kinds = np.full(len(starts), OTHER, dtype=np.int8)
+    kinds[(heads[:, : 3] == np.frombuffer(b'TER', dtype=np.uint8)).all(axis=1)] = TER
+    kinds[(heads[:, : 5] == np.frombuffer(b'MODEL', dtype=np.uint8)).all(axis=1)] = MODEL
+    kinds[(heads == np.frombuffer(b'ENDMDL', dtype=np.uint8)).all(axis=1)] = ENDMDL
+    heads[np.isin(heads, WHITESPACE)] = SPACE
+    matches = (heads[:, None, :] == ATOM_TYPES[None]).all(axis=2)
+    is_atom = matches.any(axis=1)
+    kinds[is_atom] = ATOM_TYPE_KINDS[matches[is_atom].argmax(axis=1)]
+    return kinds
+
+
+def atom_mask(data, starts, ends):
+    """ Mask of lines that are ATOM or HETATM records, same test as
+    PDBLINE.from_line, but without creating a str per line.
+    """
+    return np.isin(record_kinds(data, starts, ends), (ATOM, HETATM))
+
+
+def contains_mask(data, starts, ends, pattern):
+    """ Mask of lines that contain pattern (bytes), same as pattern in line,
+    with one search over data per match instead of one per line.
+    """
+    mask = np.zeros(len(starts), dtype=bool)
+    pos = data.find(pattern)
+    while pos != -1:
+        idx = np.searchsorted(ends, pos, side='right')
+        if pos + len(pattern) <= ends[idx]:
+            mask[idx] = True
+            pos = data.find(pattern, ends[idx])
+        else:
+            # matches across a line ending do not count
+            pos = data.find(pattern, pos + 1)
+    return mask
+
+
+def format_int(values, width):
+    """ Format integers right aligned into a (-1, width) array of bytes,
+    byte-identical to str(value).rjust(width).
+    """
+    values = np.asarray(values, dtype=np.int64).reshape(-1)
+    negative = values < 0
+    remainder = np.abs(values)
+    out = np.full((len(values), width), SPACE, dtype=np.uint8)
+    n_chars = negative.astype(np.int64)
+    for column in range(width - 1, -1, -1):
+        # the last column always gets a digit, so that 0 is written as 0
+        has_digit = (remainder > 0) | (column == width - 1)
+        out[has_digit, column] = ord('0') + remainder[has_digit] % 10
+        n_chars += has_digit
+        remainder //= 10
+    if np.any(remainder > 0) or np.any(n_chars > width):
+        raise ValueError(f'Integers do not fit into a field with {width} characters.')
+    sign_column = width - n_chars
+    out[np.flatnonzero(negative), sign_column[negative]] = ord('-')
+    return out
+
+
+def format_float(values, width, decimals=3):
+    """ Format floats right aligned into a (-1, width) array of bytes,
+    byte-identical to f'{value:.{decimals}f}'.rjust(width). Values close to a
+    rounding tie and non-finite values are formatted by python.
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(-1)
+    scale = 10 ** decimals
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = np.abs(values) * scale
+        fraction = scaled - np.floor(scaled)
+        # scaling is not exact, so leave values close to x.5 to python
+        exact = np.isfinite(scaled) & (np.abs(fraction - 0.5) > 1e-6) & (scaled < 1e15)
+    digits = np.where(exact, np.rint(scaled), 0).astype(np.int64)
+    out = np.full((len(values), width), SPACE, dtype=np.uint8)
+    point = width - decimals - 1
+    if point < 1:
+        raise ValueError(f'A field with {width} characters cannot hold {decimals} decimals.')
+    out[:, point] = ord('.')
+    n_chars = np.full(len(values), decimals + 1, dtype=np.int64)
+    for column in list(range(width - 1, point, -1)) + list(range(point - 1, -1, -1)):
+        # there is always a digit before the point
+        has_digit = (digits > 0) | (column >= point - 1)
+        out[has_digit, column] = ord('0') + digits[has_digit] % 10
+        n_chars += has_digit & (column < point)
+        digits //= 10
+    negative = np.signbit(values) & exact
+    n_chars += negative
+    if np.any(digits > 0) or np.any(n_chars > width):
+        raise ValueError(f'Floats do not fit into a field with {width} characters.')
+    out[np.flatnonzero(negative), (width - n_chars)[negative]] = ord('-')
+    for idx in np.flatnonzero(~exact):
+        word = f'{values[idx]:.{decimals}f}'
+        if len(word) > width:
+            raise ValueError(f'Floats do not fit into a field with {width} characters.')
+        out[idx] = np.frombuffer(word.rjust(width).encode('ascii'), dtype=np.uint8)
+    return out
+
+
+def decode_records(data, record_width, gap_columns=(), raw_other=False, bounds=None):
+    """ Split the content of a whole pdb file into atom records and other lines.
+    Arguments:
+        data (bytes, mmap): Content of the pdb file.
+        record_width (int): Width the atom records are padded or cut to.
+        gap_columns (iterable of int): Columns of the records that are set to spaces.
+        raw_other (bool): Keep the other lines as bytes instead of decoding them.
+        bounds (tuple): Precomputed (starts, ends, kinds) of the lines of data,
+            as given by line_bounds and record_kinds.
+    Returns:
+        buffer (np.ndarray (-1, record_width) of np.uint8): Atom records.
+        other_lines (list of str or bytes): Lines that are not atom records.
+        other_after (np.ndarray of int): Number of atom records before each other line.
+    """
+    if bounds is None:
+        data = normalize_newlines(data)
+        starts, ends = line_bounds(data)
+        kinds = record_kinds(data, starts, ends)
+    else:
+        starts, ends, kinds = bounds
+    is_atom = np.isin(kinds, (ATOM, HETATM))
+    buffer = gather(data, starts[is_atom], ends[is_atom], record_width)
+    buffer[:, np.asarray(gap_columns, dtype=np.int64)] = SPACE
+    other_idxs = np.flatnonzero(~is_atom)
+    other_lines = [bytes(data[starts[i] : ends[i]]) for i in other_idxs]
+    if not raw_other:
+        other_lines = [line.decode('utf-8') for line in other_lines]
+    other_after = np.cumsum(is_atom)[other_idxs] if len(other_idxs) else np.zeros(0, dtype=np.int64)
+    return buffer, other_lines, other_after
+
+
+def encode_records(buffer, pad_with=b' \n'):
+    """ Append pad_with to every record, returns np.ndarray of np.uint8. """
+    rendered = np.empty((len(buffer), buffer.shape[1] + len(pad_with)), dtype=np.uint8)
+    rendered[:, : buffer.shape[1]] = buffer
+    rendered[:, buffer.shape[1] : ] = np.frombuffer(pad_with, dtype=np.uint8)
+    return rendered
@@ -0,0 +1,203 @@
+import io
+import os
+import collections
+# gzip, lzma and the thread pool are imported where they are used, so that
+# plain files do not pay for them
+
+
+COMPRESSIONS = ('gzip', 'xz', 'zstd')
+EXTENSIONS = {'.gz': 'gzip', '.xz': 'xz', '.zst': 'zstd'}
+# first bytes of a compressed file, checked before the extension
+MAGIC = {'gzip': b'\x1f\x8b', 'xz': b'\xfd7zXZ\x00', 'zstd': b'\x28\xb5\x2f\xfd'}
+# uncompressed bytes per independently compressed block of the output
+COMPRESS_BLOCK_BYTES = 1 << 22
+DEFAULT_LEVELS = {'gzip': 6, 'xz': 6, 'zstd': 3}
+
+
+def import_zstandard():
+    """The optional zstandard package, needed for .zst files only."""
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(
+            'Reading or writing .zst files needs the zstandard package, install the zstd extra: '
+            'pip install write-pdb[zstd]'
+        ) from error
+    return zstandard
+
+
+def compression_from_name(filename):
+    """Compression given by the extension of filename, None if uncompressed."""
+    return EXTENSIONS.get(os.path.splitext(os.fspath(filename))[1].lower())
+
+
+def detect_compression(filename):
+    """Compression of an existing file, by its magic bytes, else by its extension.
+    Returns one of COMPRESSIONS or None.
+    """
+    with open(filename, 'rb') as fh:
+        head = fh.read(max(len(magic) for magic in MAGIC.values()))
+    for compression, magic in MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    if head:
+        # the content wins over the extension, i.e. for an uncompressed file.gz
+        return None
+    return compression_from_name(filename)
+
+
+def open_input(filename, compression='auto'):
+    """Open a file for binary reading, decompressing it on the fly.
+    Arguments:
+        filename (str): File to read.
+        compression (str): One of COMPRESSIONS, None for plain files, or
+            'auto' to detect it, see detect_compression.
+    """
+    if compression == 'auto':
+        compression = detect_compression(filename)
+    if compression is None:
+        return open(filename, 'rb')
+    if compression == 'gzip':
+        import gzip
+        # reads all members, as written by BlockCompressor
+        return gzip.open(filename, 'rb')
+    if compression == 'xz':
+        import lzma
+        return lzma.open(filename, 'rb')
+    if compression == 'zstd':
+        zstandard = import_zstandard()
+        reader = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader)
+    raise ValueError(f'Unknown compression {compression}, use one of {COMPRESSIONS}.')
+
+
+def compress_gzip(level):
+    import gzip
+
+    def compress(block):
+        # mtime 0, so that the output only depends on the content
+        return gzip.compress(block, level, mtime=0)
+    return compress
+
+
+def compress_xz(level):
+    import lzma
+
+    def compress(block):
+        return lzma.compress(block, lzma.FORMAT_XZ, preset=level)
+    return compress
+
+
+class BlockCompressor(io.BufferedIOBase):
+    """
+    Binary writer that compresses its input in independent blocks of
+    block_bytes in a pool of threads, as pigz does, and writes them in order.
+    Every block is a complete gzip member or xz stream, so the output is a
+    valid file for all readers, that decompress it as one. zlib and lzma
+    release the GIL while compressing, so the blocks are compressed in
+    parallel. At most two blocks per thread are held in memory. The output
+    does not depend on the number of threads. Closing the writer does not
+    close fh.
+    """
+
+    def __init__(self, fh, compress, threads=None, block_bytes=COMPRESS_BLOCK_BYTES):
+        """Arguments:
+        fh (binary file object): Receives the compressed blocks.
+        compress (callable): Compresses a block of bytes into a complete member.
+        threads (int): Number of threads, default: os.cpu_count()
+        block_bytes (int): Uncompressed bytes per block.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        super().__init__()
+        self.fh = fh
+        self.compress = compress
+        self.block_bytes = block_bytes
+        threads = threads or os.cpu_count()
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='write_pdb-compress')
+        self.max_pending = 2 * threads
+        self.pending = collections.deque()
+        self.chunks = []
+        self.n_bytes = 0
+        self.n_blocks = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed file')
+        data = bytes(data)
+        self.chunks.append(data)
+        self.n_bytes += len(data)
+        if self.n_bytes >= self.block_bytes:
+            self.submit()
+        return len(data)
+
+    def submit(self):
+        """Compress the buffered data as the next block."""
+        block = b''.join(self.chunks)
+        self.chunks = []
+        self.n_bytes = 0
+        self.n_blocks += 1
+        self.pending.append(self.executor.submit(self.compress, block))
+        while self.pending and (len(self.pending) > self.max_pending or self.pending[0].done()):
+            self.fh.write(self.pending.popleft().result())
+
+    def close(self):
+        """Compress the rest and wait for all blocks to be written."""
+        if self.closed:
+            return
+        try:
+            # an empty file is still a valid compressed file
+            if self.n_bytes or not self.n_blocks:
+                self.submit()
+            while self.pending:
+                self.fh.write(self.pending.popleft().result())
+            self.fh.flush()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+            super().close()
+
+
+def open_output(fh, compression, threads=None, level=None):
+    """Wrap the binary file fh into a writer compressing with compression.
+    Closing the writer does not close fh.
+    Arguments:
+        fh (binary file object): Receives the compressed data.
+        compression (str): One of COMPRESSIONS, None returns fh itself.
+        threads (int): Threads that compress in parallel, default: os.cpu_count()
+        level (int): Compression level, default: DEFAULT_LEVELS
+    """
+    if compression is None:
+        return fh
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression {compression}, use one of {COMPRESSIONS}.')
+    level = DEFAULT_LEVELS[compression] if level is None else level
+    if compression == 'gzip':
+        return BlockCompressor(fh, compress_gzip(level), threads)
+    if compression == 'xz':
+        return BlockCompressor(fh, compress_xz(level), threads)
+    zstandard = import_zstandard()
+    # zstandard compresses in its own threads
+    compressor = zstandard.ZstdCompressor(level=level, threads=threads or -1)
+    return compressor.stream_writer(fh, closefd=False)
+
+
+def iter_line_blocks(fh, block_bytes):
+    """Read the binary file fh in blocks of whole lines of about block_bytes.
+    A buffered read only returns less than asked for at the end of the file,
+    so every pass over the same content gets the same blocks.
+    """
+    rest = b''
+    while True:
+        data = fh.read(block_bytes)
+        if not data:
+            break
+        data = rest + data
+        cut = data.rfind(b'\n') + 1
+        rest = data[cut : ]
+        if cut:
+            yield data[ : cut]
+    if rest:
+        # last line without a newline
+        yield rest
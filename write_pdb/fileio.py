@@ -0,0 +1,48 @@
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager, suppress
+from write_pdb.compression import compression_from_name, open_output
+
+
+@contextmanager
+def replace_on_success(filename, mode='wb', encoding=None, compression='auto', threads=None):
+    """Open a temporary file next to filename, which replaces filename once
+    the block finishes without an error. Allows overwriting the input file
+    while streaming from it, and never leaves a partially written file.
+    Arguments:
+        filename (str): Save name.
+        mode (str): 'w' or 'wb'.
+        encoding (str): Encoding in text mode.
+        compression (str): Compress what is written, see compression.COMPRESSIONS,
+            'auto' compresses by the extension of filename, None not at all.
+        threads (int): Threads that compress in parallel, default: os.cpu_count()
+    """
+    if compression == 'auto':
+        compression = compression_from_name(filename)
+    save_dir = os.path.dirname(os.path.abspath(filename))
+    if compression is None:
+        temp = tempfile.NamedTemporaryFile(mode, encoding=encoding, dir=save_dir, delete=False)
+    else:
+        temp = tempfile.NamedTemporaryFile('wb', dir=save_dir, delete=False)
+    with temp as raw:
+        fh = raw
+        try:
+            if compression is not None:
+                fh = open_output(raw, compression, threads)
+                if 'b' not in mode:
+                    fh = io.TextIOWrapper(fh, encoding=encoding)
+            yield fh
+            # flush the compressor before the file is closed
+            fh.close()
+        except BaseException:
+            if fh is not raw:
+                with suppress(Exception):
+                    fh.close()
+            raw.close()
+            os.remove(raw.name)
+            raise
+    if os.path.exists(filename):
+        shutil.copymode(filename, raw.name)
+    os.replace(raw.name, filename)
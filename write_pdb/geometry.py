@@ -0,0 +1,373 @@
+import numpy as np
+from write_pdb.pdbtable import PDBTable, as_text
+from write_pdb import modify_table
+from write_pdb.modify_table import model_spans
+from write_pdb.fileio import replace_on_success
+from write_pdb.stats import measure
+
+
+# atomic masses in u of the elements common in pdb files, by element symbol
+MASSES = {
+    'H': 1.008, 'D': 2.014, 'C': 12.011, 'N': 14.007, 'O': 15.999, 'F': 18.998,
+    'NA': 22.990, 'MG': 24.305, 'P': 30.974, 'S': 32.06, 'CL': 35.45, 'K': 39.098,
+    'CA': 40.078, 'MN': 54.938, 'FE': 55.845, 'CO': 58.933, 'NI': 58.693,
+    'CU': 63.546, 'ZN': 65.38, 'SE': 78.971, 'BR': 79.904, 'I': 126.904,
+}
+
+
+class EmptySelectionError(ValueError):
+    """ The selection picks no atoms, where at least one is needed. """
+
+
+# the array functions below take positions as np.ndarray (..., N, 3), leading
+# axes are models, and an optional mask (N,) of bool, that selects the atoms
+
+
+def masses(elements, atomnames=None):
+    """ Masses from the element column, as np.ndarray of float. Atoms without
+    element take the first letter of their atom name, as in old pdb files.
+    Arguments:
+        elements (np.ndarray of str): Stripped element symbols, see PDBTable.element.
+        atomnames (np.ndarray of str): Stripped atom names, see PDBTable.atomname.
+    """
+    elements = np.char.upper(np.asarray(elements, dtype=str))
+    if atomnames is not None:
+        first = np.char.upper(np.char.lstrip(np.asarray(atomnames, dtype=str), '0123456789'))
+        elements = np.where(elements == '', np.char.ljust(first, 1).astype('U1'), elements)
+    symbols, inverse = np.unique(elements, return_inverse=True)
+    unknown = [symbol for symbol in symbols if symbol not in MASSES]
+    if unknown:
+        raise ValueError(f'No mass for the element {unknown[0]!r}, known are {", ".join(MASSES)}.')
+    return np.array([MASSES[symbol] for symbol in symbols])[inverse.reshape(-1)]
+
+
+def parse_cryst1(line):
+    """ Cell lengths and angles (a, b, c, alpha, beta, gamma) of a CRYST1 line. """
+    columns = ((6, 15), (15, 24), (24, 33), (33, 40), (40, 47), (47, 54))
+    try:
+        return tuple(float(line[start : end]) for start, end in columns)
+    except ValueError:
+        raise ValueError(f'Can not read the unit cell from {line.rstrip()!r}.') from None
+
+
+def box_vectors(a, b, c, alpha=90., beta=90., gamma=90.):
+    """ Cell vectors as rows of a np.ndarray (3, 3), a along x and b in the xy plane. """
+    alpha, beta, gamma = np.radians([alpha, beta, gamma])
+    cos_alpha, cos_beta, cos_gamma = np.cos([alpha, beta, gamma])
+    sin_gamma = np.sin(gamma)
+    cy = (cos_alpha - cos_beta * cos_gamma) / sin_gamma
+    box = np.array([
+        [a, 0., 0.],
+        [b * cos_gamma, b * sin_gamma, 0.],
+        [c * cos_beta, c * cy, c * np.sqrt(1. - cos_beta ** 2 - cy ** 2)],
+    ])
+    # cos(90 degrees) is not exactly zero
+    box[np.abs(box) < 1e-10] = 0.
+    return box
+
+
+def find_box(table):
+    """ Cell vectors of the first CRYST1 line of a PDBTable, None if it has none. """
+    for line in table.other_lines:
+        line = as_text(line)
+        if line.startswith('CRYST1'):
+            return box_vectors(*parse_cryst1(line))
+    return None
+
+
+def rotation_matrix(axis, degrees):
+    """ Matrix (3, 3) of the rotation by degrees around axis, counterclockwise
+    when looking against the axis.
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    norm = np.linalg.norm(axis)
+    if not norm:
+        raise ValueError('The rotation axis must not be zero.')
+    x, y, z = axis / norm
+    angle = np.radians(degrees)
+    cos, sin = np.cos(angle), np.sin(angle)
+    cross = np.array([[0., -z, y], [z, 0., -x], [-y, x, 0.]])
+    return cos * np.eye(3) + sin * cross + (1. - cos) * np.outer([x, y, z], [x, y, z])
+
+
+def as_mask(mask):
+    """ Index of the atoms along the N axis, all if mask is None. """
+    return slice(None) if mask is None else np.asarray(mask, dtype=bool)
+
+
+def translate_atoms(xyz, vector, mask=None):
+    """ Copy of xyz with the selected atoms moved by vector (3,) or (..., 3). """
+    mask = as_mask(mask)
+    output = np.array(xyz, dtype=np.float64)
+    output[..., mask, :] += np.asarray(vector, dtype=np.float64)[..., None, :]
+    return output
+
+
+def affine(xyz, matrix, mask=None):
+    """ Copy of xyz with the selected atoms transformed by matrix, a rotation
+    (3, 3), or an affine transformation (3, 4) or (4, 4) with the translation
+    in the last column. Leading axes of matrix broadcast against the models.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if matrix.shape[-2 : ] not in ((3, 3), (3, 4), (4, 4)):
+        raise ValueError(f'Expected a matrix of shape (3, 3), (3, 4) or (4, 4), got {matrix.shape}.')
+    mask = as_mask(mask)
+    output = np.array(xyz, dtype=np.float64)
+    moved = output[..., mask, :] @ np.swapaxes(matrix[..., : 3, : 3], -1, -2)
+    if matrix.shape[-1] == 4:
+        moved += matrix[..., None, : 3, 3]
+    output[..., mask, :] = moved
+    return output
+
+
+def center_of_mass(xyz, weights=None, mask=None):
+    """ Center of mass (..., 3) of the selected atoms.
+    Arguments:
+        xyz (np.ndarray (..., N, 3)): Positions.
+        weights (np.ndarray (N,) or (..., N)): Masses, see masses. Default: the
+            geometric center.
+    """
+    mask = as_mask(mask)
+    xyz = np.asarray(xyz, dtype=np.float64)[..., mask, :]
+    if not xyz.shape[-2]:
+        raise EmptySelectionError('No atoms are selected, they have no center of mass.')
+    if weights is None:
+        return xyz.mean(axis=-2)
+    weights = np.asarray(weights, dtype=np.float64)[..., mask]
+    return np.einsum('...n,...ni->...i', weights, xyz) / weights.sum(axis=-1)[..., None]
+
+
+def wrap_atoms(xyz, box, center=None, mask=None):
+    """ Copy of xyz with the selected atoms moved by whole cell vectors into
+    the cell around center, i.e. their minimum images relative to it.
+    Arguments:
+        box (np.ndarray (3, 3)): Cell vectors as rows, see box_vectors.
+        center (np.ndarray (3,) or (..., 3)): Default: the center of the box,
+            which wraps into the cell at the origin.
+    """
+    box = np.asarray(box, dtype=np.float64)
+    if center is None:
+        center = box.sum(axis=0) / 2
+    mask = as_mask(mask)
+    output = np.array(xyz, dtype=np.float64)
+    inverse = np.linalg.inv(box)
+    offset = (output[..., mask, :] - np.asarray(center)[..., None, :]) @ inverse
+    output[..., mask, :] -= np.floor(offset + 0.5) @ box
+    return output
+
+
+def kabsch(mobile, reference, weights=None):
+    """ Rigid body fit of mobile onto reference, with the Kabsch algorithm.
+    Arguments:
+        mobile (np.ndarray (..., N, 3)): Positions to be fitted, per model.
+        reference (np.ndarray (N, 3) or (..., N, 3)): Target positions.
+        weights (np.ndarray (N,) or (..., N)): Default: all atoms count the same.
+    Returns:
+        rotation (np.ndarray (..., 3, 3)) and translation (np.ndarray (..., 3)),
+        mobile @ rotation.T + translation is closest to reference.
+    """
+    mobile = np.asarray(mobile, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    if mobile.shape[-2] != reference.shape[-2]:
+        raise ValueError(
+            f'Can not fit {mobile.shape[-2]} atoms onto {reference.shape[-2]} atoms of the reference.'
+        )
+    if weights is None:
+        weights = np.ones(mobile.shape[-2])
+    mobile_center = center_of_mass(mobile, weights)
+    reference_center = center_of_mass(reference, weights)
+    covariance = np.einsum(
+        '...n,...ni,...nj->...ij',
+        np.asarray(weights, dtype=np.float64),
+        mobile - mobile_center[..., None, :],
+        reference - reference_center[..., None, :],
+    )
+    u, __, vt = np.linalg.svd(covariance)
+    # flip the smallest axis to get a rotation instead of a reflection
+    correction = np.ones(u.shape[ : -1])
+    correction[..., 2] = np.sign(np.linalg.det(u) * np.linalg.det(vt))
+    rotation = np.swapaxes(vt, -1, -2) @ (correction[..., :, None] * np.swapaxes(u, -1, -2))
+    translation = reference_center - np.einsum('...ij,...j->...i', rotation, mobile_center)
+    return rotation, translation
+
+
+def align_atoms(xyz, reference, weights=None, mask=None):
+    """ Copy of xyz with all atoms moved, such that the selected atoms fit
+    reference (n_selected, 3) best, see kabsch.
+    """
+    mask = as_mask(mask)
+    xyz = np.asarray(xyz, dtype=np.float64)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)[..., mask]
+    rotation, translation = kabsch(xyz[..., mask, :], reference, weights)
+    return xyz @ np.swapaxes(rotation, -1, -2) + translation[..., None, :]
+
+
+def select_atoms(table, chainid=None, resid=None, idx=None):
+    """ Mask of the atom records of a PDBTable that match all given criteria.
+    Arguments:
+        chainid (str or iterable of str): Chain ids, i.e. 'A' or ['A', 'B'].
+        resid (int or tuple): Residue number or inclusive range (first, last).
+        idx (tuple): Range (start, end) of atom records, 0-based, end exclusive,
+            counted from the first atom record of every model, see model_atoms.
+    """
+    mask = np.ones(len(table), dtype=bool)
+    if chainid is not None:
+        chainid = [chainid] if isinstance(chainid, str) else list(chainid)
+        mask &= np.isin(table.chainid, chainid)
+    if resid is not None:
+        first, last = (resid, resid) if np.isscalar(resid) else resid
+        resids = table.resid
+        mask &= (resids >= first) & (resids <= last)
+    if idx is not None:
+        start, end = idx
+        in_range = np.zeros(len(table), dtype=bool)
+        for idxs in model_atoms(table):
+            in_range[idxs[start : end]] = True
+        mask &= in_range
+    return mask
+
+
+def load_reference(reference, selection=None):
+    """ Positions of the selected atoms of the first model of reference, given
+    as PDBTable, file name or positions (n_selected, 3).
+    """
+    if isinstance(reference, str):
+        reference = PDBTable.from_file(reference)
+    if not isinstance(reference, PDBTable):
+        return np.asarray(reference, dtype=np.float64)
+    spans = model_spans(reference)
+    if spans:
+        reference = reference.take(*spans[0])
+    return reference.xyz[select_atoms(reference, **(selection or {}))]
+
+
+def model_atoms(table):
+    """ Atom record indices of every model, as list of np.ndarray, the whole
+    table if it has no MODEL lines.
+    """
+    spans = model_spans(table)
+    if not spans:
+        return [np.arange(len(table))]
+    return [np.arange(atom_start, atom_end) for atom_start, atom_end, __, __ in spans]
+
+
+def stack_models(atoms, mask):
+    """ Atom record indices (n_models, N) of models with the same number of
+    atoms and the same selection, which are moved at once, else None.
+    Arguments:
+        atoms (list of np.ndarray): Atom record indices per model, see model_atoms.
+        mask (np.ndarray (n_atoms,) of bool): Selected atoms, see select_atoms.
+    """
+    if len({len(idxs) for idxs in atoms}) != 1 or not all((mask[idxs] == mask[atoms[0]]).all() for idxs in atoms):
+        return None
+    return np.stack(atoms)
+
+
+def transform_coordinates(
+    table, translate=None, rotate=None, matrix=None, center=False, wrap=False,
+    align=None, selection=None, box=None,
+):
+    """ Move the atoms of every model of a PDBTable, in this order: center,
+    translate, rotate, matrix, wrap and align. Models with the same atoms are
+    stacked into one np.ndarray (n_models, N, 3) and moved at once, else model
+    by model, see stack_models. Atoms outside of the models are not moved.
+    Centering and aligning raise an EmptySelectionError if the selection picks no atoms
+    of a model.
+    Returns a copy of table.
+    Arguments:
+        table (PDBTable): Pdb file to be changed.
+        translate (array-like (3,)): Move the selected atoms by this vector.
+        rotate (tuple): (axis, degrees), rotate the selected atoms around the
+            axis through the origin, see rotation_matrix.
+        matrix (array-like): Transform the selected atoms, see affine.
+        center (bool): Move all atoms such that the center of mass of the
+            selected atoms is at the origin, or at the center of the box if wrap.
+        wrap (bool): Wrap the selected atoms into the box, see wrap_atoms.
+        align (PDBTable, str or array-like): Move all atoms such that the
+            selected atoms fit the same selection of this reference, see
+            load_reference and align_atoms.
+        selection (dict): Keyword arguments of select_atoms, default: all atoms.
+        box (np.ndarray (3, 3)): Cell vectors, default: from the CRYST1 line.
+    """
+    if box is None and wrap:
+        box = find_box(table)
+        if box is None:
+            raise ValueError('Wrapping needs a box, but there is no CRYST1 line.')
+    mask = select_atoms(table, **(selection or {}))
+    weights = masses(table.element, table.atomname) if center else None
+    reference = None if align is None else load_reference(align, selection)
+    center_to = np.zeros(3) if box is None or not wrap else box.sum(axis=0) / 2
+
+    def move(xyz, mask, weights):
+        if center:
+            xyz = xyz + (center_to - center_of_mass(xyz, weights, mask))[..., None, :]
+        if translate is not None:
+            xyz = translate_atoms(xyz, translate, mask)
+        if rotate is not None:
+            xyz = affine(xyz, rotation_matrix(*rotate), mask)
+        if matrix is not None:
+            xyz = affine(xyz, matrix, mask)
+        if wrap:
+            xyz = wrap_atoms(xyz, box, mask=mask)
+        if reference is not None:
+            xyz = align_atoms(xyz, reference, mask=mask)
+        return xyz
+
+    xyz = table.xyz
+    atoms = model_atoms(table)
+    if center or reference is not None:
+        empty = [i for i, idxs in enumerate(atoms) if not mask[idxs].any()]
+        if empty:
+            raise EmptySelectionError(f'The selection picks no atoms of model {empty[0] + 1}, it can not be centered or aligned.')
+    stacked = stack_models(atoms, mask)
+    if stacked is not None:
+        idxs = stacked
+        xyz[idxs] = move(xyz[idxs], mask[atoms[0]], None if weights is None else weights[idxs])
+    else:
+        for idxs in atoms:
+            xyz[idxs] = move(xyz[idxs], mask[idxs], None if weights is None else weights[idxs])
+    output = table.copy()
+    output.xyz = xyz
+    return output
+
+
+def transform_file(
+    filename,
+    save=None,
+    kick=None,
+    fix_atom_numbering=False,
+    fix_residue_numbering=False,
+    residues_per_chain=None,
+    stats=None,
+    threads=None,
+    **geometry,
+):
+    """ Load a whole pdb file, move its atoms with transform_coordinates,
+    apply the other transformations as the CLI does, and write it to save,
+    default: overwrite filename. Compressed files are read and written by
+    their magic bytes and extension.
+    Arguments:
+        geometry: Keyword arguments of transform_coordinates.
+    Returns the transformed PDBTable, and if all models were moved at once,
+    see stack_models.
+    """
+    with measure(stats, 'parse') as stage:
+        table = PDBTable.from_file(filename, kick)
+        stage.add(records=len(table))
+    with measure(stats, 'geometry', records=len(table)):
+        mask = select_atoms(table, **(geometry.get('selection') or {}))
+        at_once = stack_models(model_atoms(table), mask) is not None
+        table = transform_coordinates(table, **geometry)
+    if fix_atom_numbering:
+        with measure(stats, 'fix_atom_numbering', records=len(table)):
+            table = modify_table.fix_atom_numbering(table)
+    if fix_residue_numbering:
+        with measure(stats, 'fix_residue_numbering', records=len(table)):
+            table = modify_table.fix_residue_numbering(table)
+    if residues_per_chain:
+        with measure(stats, 'section_into_chains', records=len(table)):
+            table = modify_table.section_into_chains(table, residues_per_chain)
+    with measure(stats, 'write'), replace_on_success(save or filename, 'wb', threads=threads) as fh:
+        table.write(fh)
+    return table, at_once
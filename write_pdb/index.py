@@ -0,0 +1,303 @@
+import os
+import mmap
+import hashlib
+import numpy as np
+from write_pdb.compression import detect_compression, open_input
+from write_pdb.fileio import replace_on_success
+from write_pdb.inplace import build_index, get_field
+
+
+# the sidecar lives next to the pdb file, as filename + SIDECAR_SUFFIX
+SIDECAR_SUFFIX = '.idx.npz'
+# bump when the stored arrays change, older sidecars are rebuilt
+INDEX_VERSION = 2
+HASH_BLOCK_BYTES = 1 << 24
+
+
+def file_hash(filename):
+    """Hash of the content of a file, as hex str."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_starts(values):
+    """Indices where a new run of equal values starts, the first one included."""
+    if not len(values):
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate([[True], values[1 : ] != values[ : -1]]))
+
+
+def group_by_name(names):
+    """Sorted unique names, stripped, with the offsets and the order of their
+    entries: order[offsets[k] : offsets[k + 1]] are the entries called
+    unique[k], in file order.
+    """
+    unique, codes = np.unique(np.char.strip(names), return_inverse=True)
+    codes = codes.reshape(-1)
+    order = np.argsort(codes, kind='stable')
+    offsets = np.searchsorted(codes[order], np.arange(len(unique) + 1))
+    return unique, offsets, order
+
+
+def ranges_to_mask(ranges, n_atoms):
+    """Turn (k, 2) ranges [start, end) of atom indices into a mask over n_atoms."""
+    change = np.zeros(n_atoms + 1, dtype=np.int64)
+    np.add.at(change, ranges[:, 0], 1)
+    np.add.at(change, ranges[:, 1], -1)
+    return np.cumsum(change[ : -1]) > 0
+
+
+def mask_to_ranges(mask):
+    """Turn a mask over the atoms into (k, 2) ranges [start, end) of atom indices."""
+    edges = np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8))
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1)
+
+
+class PDBIndex:
+    """
+    Index of the atom records of a pdb file, to select atoms without reading
+    the file. Holds the offsets of the records (as used by PatchablePDB), the
+    boundaries of chains and residues, and for every atom and residue name
+    the atoms called so, sorted by name and searched by bisection. Atoms are counted as in write_positions on a
+    PDBTable, i.e. atom records only. Residues start where resid or resname
+    change, as in IsNewResidue, or where the chain changes. Selections return
+    ranges, np.ndarray (k, 2) of [idx_start, idx_end), or masks over the atoms.
+    The index is stored in a sidecar file next to the pdb file, keyed by size,
+    mtime and hash of the pdb file, see open_index.
+    """
+    # arrays stored in the sidecar
+    ARRAYS = (
+        'starts', 'lengths', 'is_hetatm', 'chain_starts', 'chain_ids', 'res_starts', 'res_ids',
+        'resnames', 'resname_offsets', 'resname_ranges', 'atomnames', 'atomname_offsets', 'atomname_atoms',
+    )
+
+    def __init__(self, arrays, key=None):
+        """ Construct from the arrays of build or a sidecar, see ARRAYS.
+        key (dict): size, mtime_ns and hash of the indexed file.
+        """
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.key = key
+        self.res_ends = np.append(self.res_starts[1 : ], len(self.starts))
+        # residues where the resid goes down, a range of residues without
+        # any can be searched with bisection
+        self.res_breaks = np.flatnonzero(np.diff(self.res_ids) < 0) + 1
+
+    @classmethod
+    def build(cls, filename):
+        """ Index a pdb file in one vectorized scan over its bytes. Compressed
+        files are indexed by their decompressed content, so their offsets can
+        not be used to patch them.
+        """
+        stat = os.stat(filename)
+        if detect_compression(filename) is not None:
+            with open_input(filename) as fh:
+                arrays = cls.scan(fh.read())
+            return cls(arrays, {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash(filename)})
+        with open(filename, 'rb') as fh:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+            try:
+                arrays = cls.scan(data)
+                digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+        return cls(arrays, {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest})
+
+    @staticmethod
+    def scan(data):
+        """ Arrays of the index for the content of a pdb file, see ARRAYS. """
+        starts, lengths = build_index(data)
+        arrays = {'starts': starts, 'lengths': lengths}
+        arrays['is_hetatm'] = get_field(data, starts, lengths, 'type') == b'HETATM'
+        chainid = get_field(data, starts, lengths, 'chainid')
+        arrays['chain_starts'] = run_starts(chainid)
+        arrays['chain_ids'] = chainid[arrays['chain_starts']]
+        resid = get_field(data, starts, lengths, 'resid')
+        resname = get_field(data, starts, lengths, 'resname')
+        res_starts = np.union1d(np.union1d(run_starts(resid), run_starts(resname)), arrays['chain_starts'])
+        arrays['res_starts'] = res_starts
+        resid = resid[res_starts]
+        # blank resids count as 0
+        arrays['res_ids'] = np.where(np.char.strip(resid) == b'', b'0', resid).astype(np.int64)
+        # the atom ranges of the residues, grouped by their name
+        arrays['resnames'], arrays['resname_offsets'], order = group_by_name(resname[res_starts])
+        res_ends = np.append(res_starts[1 : ], len(starts)).astype(np.int64)
+        arrays['resname_ranges'] = np.stack([res_starts[order], res_ends[order]], axis=1)
+        atomname = get_field(data, starts, lengths, 'atomname')
+        arrays['atomnames'], arrays['atomname_offsets'], arrays['atomname_atoms'] = group_by_name(atomname)
+        return arrays
+
+    @classmethod
+    def load(cls, sidecar):
+        """ Load an index from a sidecar file, without checking its key. """
+        with np.load(sidecar, allow_pickle=False) as stored:
+            if int(stored['version']) != INDEX_VERSION:
+                raise ValueError(f'{sidecar} has index version {int(stored["version"])}, not {INDEX_VERSION}.')
+            key = {'size': int(stored['size']), 'mtime_ns': int(stored['mtime_ns']), 'hash': str(stored['hash'])}
+            return cls({name: stored[name] for name in cls.ARRAYS}, key)
+
+    def save(self, sidecar):
+        """ Write the index into a sidecar file. """
+        with replace_on_success(sidecar) as fh:
+            np.savez(
+                fh, version=INDEX_VERSION, size=self.key['size'], mtime_ns=self.key['mtime_ns'],
+                hash=self.key['hash'], **{name: getattr(self, name) for name in self.ARRAYS}
+            )
+
+    def matches(self, filename):
+        """ If the index belongs to the current content of filename. Size and
+        mtime are checked first, the hash only if the mtime changed.
+        """
+        stat = os.stat(filename)
+        if self.key is None or stat.st_size != self.key['size']:
+            return False
+        if stat.st_mtime_ns == self.key['mtime_ns']:
+            return True
+        if file_hash(filename) != self.key['hash']:
+            return False
+        self.key['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def __len__(self):
+        """ Number of atom records. """
+        return len(self.starts)
+
+    @property
+    def n_residues(self):
+        return len(self.res_starts)
+
+    @property
+    def offsets(self):
+        """ (starts, lengths) of the atom records, the index of PatchablePDB and patch_file. """
+        return self.starts, self.lengths
+
+    @property
+    def chains(self):
+        """ Chain ids in the order they appear, as str. """
+        return [chainid.decode('ascii') for chainid in dict.fromkeys(self.chain_ids)]
+
+    def chain_ranges(self):
+        """ Atom ranges of all runs of consecutive records of the same chain. """
+        ends = np.append(self.chain_starts[1 : ], len(self))
+        return np.stack([self.chain_starts, ends], axis=1)
+
+    def chain(self, chainid):
+        """ Atom ranges of chain chainid, one per run of its records. """
+        ranges = self.chain_ranges()
+        return ranges[self.chain_ids == chainid.encode('ascii')]
+
+    def residues(self, first, last=None, chainid=None):
+        """ Atom ranges of the residues with first <= resid <= last, within
+        chain chainid if given. Runs of residues with increasing resids are
+        bisected, others are searched residue by residue.
+        """
+        last = first if last is None else last
+        spans = self.chain(chainid) if chainid is not None else np.array([[0, len(self)]])
+        ranges = []
+        for atom_start, atom_end in spans:
+            # residues start at every chain change, so they all lie within the span
+            res_start, res_end = np.searchsorted(self.res_starts, (atom_start, atom_end))
+            ranges.extend(self.search_residues(res_start, res_end, first, last))
+        return np.array(ranges, dtype=np.int64).reshape(-1, 2)
+
+    def search_residues(self, res_start, res_end, first, last):
+        """ Atom ranges of the residues in res_start to res_end with first <= resid <= last. """
+        ranges = []
+        # split at the residues where the resid goes down
+        breaks = self.res_breaks[(self.res_breaks > res_start) & (self.res_breaks < res_end)]
+        bounds = np.concatenate([[res_start], breaks, [res_end]])
+        for lo, hi in zip(bounds[ : -1], bounds[1 : ]):
+            res_ids = self.res_ids[lo : hi]
+            found_lo = lo + np.searchsorted(res_ids, first, side='left')
+            found_hi = lo + np.searchsorted(res_ids, last, side='right')
+            if found_hi > found_lo:
+                ranges.append((self.res_starts[found_lo], self.res_ends[found_hi - 1]))
+        return ranges
+
+    @staticmethod
+    def find_name(names, offsets, name):
+        """ Slice of the entries called name, found by bisection in the sorted
+        names, see group_by_name. Empty if no entry is called name.
+        """
+        name = name.strip().encode('ascii')
+        idx = int(np.searchsorted(names, name))
+        if idx == len(names) or names[idx] != name:
+            return slice(0, 0)
+        return slice(int(offsets[idx]), int(offsets[idx + 1]))
+
+    def resname(self, name):
+        """ Atom ranges of the residues called name, one per residue. """
+        return self.resname_ranges[self.find_name(self.resnames, self.resname_offsets, name)]
+
+    def atomname(self, name):
+        """ Atom ranges of the atoms called name, one per atom. """
+        atoms = self.atomname_atoms[self.find_name(self.atomnames, self.atomname_offsets, name)]
+        return np.stack([atoms, atoms + 1], axis=1)
+
+    def hetatm(self):
+        """ Mask of the HETATM records. """
+        return self.is_hetatm.copy()
+
+    def select(self, chainid=None, resid=None, resname=None, atomname=None, hetatm=None):
+        """ Mask of the atoms matching all given criteria.
+        Arguments:
+            chainid (str): Chain identifier.
+            resid (int or tuple): Residue number, or (first, last) inclusive.
+            resname, atomname (str): Names, without padding.
+            hetatm (bool): Only HETATM records if True, only ATOM records if False.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if resid is not None:
+            first, last = resid if isinstance(resid, tuple) else (resid, resid)
+            mask &= ranges_to_mask(self.residues(first, last, chainid), len(self))
+        elif chainid is not None:
+            mask &= ranges_to_mask(self.chain(chainid), len(self))
+        if resname is not None:
+            mask &= ranges_to_mask(self.resname(resname), len(self))
+        if atomname is not None:
+            mask &= ranges_to_mask(self.atomname(atomname), len(self))
+        if hetatm is not None:
+            mask &= self.is_hetatm if hetatm else ~self.is_hetatm
+        return mask
+
+    def __repr__(self):
+        return f'PDBIndex({len(self)} atom records, {self.n_residues} residues, chains {self.chains})'
+
+
+def sidecar_name(filename):
+    return filename + SIDECAR_SUFFIX
+
+
+def open_index(filename, sidecar=None, save=True):
+    """ Index of filename, loaded from its sidecar if that still matches the
+    file, else built and, if save, written to the sidecar.
+    Arguments:
+        filename (str): Pdb file.
+        sidecar (str): Sidecar file, default: filename + SIDECAR_SUFFIX
+        save (bool): Write a new or updated index to the sidecar.
+    """
+    sidecar = sidecar or sidecar_name(filename)
+    index = None
+    if os.path.isfile(sidecar):
+        try:
+            index = PDBIndex.load(sidecar)
+        except (OSError, ValueError, KeyError):
+            index = None
+    if index is not None:
+        mtime_ns = index.key['mtime_ns']
+        if index.matches(filename):
+            if save and index.key['mtime_ns'] != mtime_ns:
+                index.save(sidecar)
+            return index
+    index = PDBIndex.build(filename)
+    if save:
+        try:
+            index.save(sidecar)
+        except OSError:
+            # the index is still usable without its sidecar, i.e. in a read-only directory
+            pass
+    return index
@@ -0,0 +1,248 @@
+import os
+import mmap
+import numpy as np
+from write_pdb import codec, modify_table
+from write_pdb.compression import detect_compression
+from write_pdb.fileio import replace_on_success
+from write_pdb.models import find_models
+from write_pdb.pdbtable import PDBTable, FIELD_COLUMNS
+
+
+# fields of fixed width that can be overwritten without moving any other byte
+PATCH_FIELDS = ('atomid', 'resid', 'chainid', 'posx', 'posy', 'posz')
+POSITION_FIELDS = ('posx', 'posy', 'posz')
+
+
+def build_index(data):
+    """Offsets of the atom records in the raw bytes of a pdb file. Returns
+    (starts, lengths), with the length of every record without its line ending.
+    Other line endings than \\n are kept, so offsets are those in the file.
+    """
+    array = codec.as_bytes_array(data)
+    starts, ends = codec.line_bounds(array)
+    is_atom = np.isin(codec.record_kinds(array, starts, ends), (codec.ATOM, codec.HETATM))
+    starts, ends = starts[is_atom], ends[is_atom]
+    lengths = ends - starts
+    if len(ends):
+        has_newline = array[ends - 1] == codec.NEWLINE
+        lengths -= has_newline
+        lengths -= has_newline & (lengths > 0) & (array[np.maximum(ends - 2, 0)] == ord('\r'))
+    return starts, lengths
+
+
+def get_field(data, starts, lengths, key):
+    """Field key of the atom records at starts, with the given lengths, as
+    np.ndarray of bytes, with spaces for missing columns.
+    """
+    start, end = FIELD_COLUMNS[key]
+    field = codec.gather(data, starts + start, starts + lengths, end - start)
+    return field.view(f'S{end - start}').reshape(-1)
+
+
+def format_field(key, values):
+    """Format values for field key as np.ndarray (-1, width) of bytes, right
+    aligned as in PDBTable.
+    """
+    start, end = FIELD_COLUMNS[key]
+    width = end - start
+    if key in POSITION_FIELDS:
+        return codec.format_float(values, width)
+    if key in ('atomid', 'resid'):
+        return codec.format_int(values, width)
+    values = np.char.rjust(np.asarray(values).astype(str), width)
+    if values.size and np.char.str_len(values).max() > width:
+        raise ValueError(f'The values to be written into field {key} do not fit into {width} characters.')
+    return codec.as_bytes_array(np.char.encode(values, 'ascii')).reshape(-1, width)
+
+
+class PatchablePDB:
+    """
+    Pdb file mapped read-write, whose fixed-width fields of the atom records
+    (see PATCH_FIELDS) are overwritten in place. Only the bytes of the changed
+    fields are written, so an update costs O(changed atoms), once the offsets
+    of the atom records are known. The offsets are found in one scan over the
+    file, or taken from an earlier run, see index. Records too short to hold
+    a field can not be patched, see fits and patch_file.
+    """
+    def __init__(self, filename, index=None):
+        """ Map the file read-write.
+        Arguments:
+            filename (str): Pdb file to be patched.
+            index (tuple): (starts, lengths) of the atom records, as given by
+                build_index or PatchablePDB.index, default: scan the file.
+        """
+        self.filename = filename
+        if detect_compression(filename) is not None:
+            raise ValueError(f'{filename} is compressed and can not be patched in place.')
+        self.fh = open(filename, 'r+b')
+        size = os.path.getsize(filename)
+        if size:
+            self.buffer = mmap.mmap(self.fh.fileno(), 0)
+            self.data = np.frombuffer(self.buffer, dtype=np.uint8)
+        else:
+            # empty files can not be memory-mapped
+            self.buffer = None
+            self.data = np.zeros(0, dtype=np.uint8)
+        starts, lengths = build_index(self.data) if index is None else index
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if len(self.starts) and self.starts[-1] + self.lengths[-1] > size:
+            raise ValueError(f'The index does not belong to {filename}, it points past the end of the file.')
+
+    @property
+    def index(self):
+        """(starts, lengths) of the atom records, to open the file again without a scan."""
+        return self.starts, self.lengths
+
+    def __len__(self):
+        """ Number of atom records. """
+        return len(self.starts)
+
+    def get_rows(self, rows):
+        """ Atom record indices of rows, given as slice, mask or indices. """
+        if isinstance(rows, slice):
+            return np.arange(*rows.indices(len(self.starts)))
+        rows = np.asarray(rows)
+        return np.flatnonzero(rows) if rows.dtype == bool else rows.astype(np.int64)
+
+    def fits(self, key, rows=slice(None)):
+        """ If field key of all records in rows can be written in place. """
+        return bool(np.all(self.lengths[rows] >= FIELD_COLUMNS[key][1]))
+
+    def check_records(self, rows):
+        """ Check that the records in rows still start with ATOM or HETATM, so
+        that an index given from an earlier run matches the file.
+        """
+        types = self.data[self.starts[rows, None] + np.arange(6)]
+        if not np.all((types[:, None, :] == codec.ATOM_TYPES).all(axis=2).any(axis=1)):
+            raise ValueError(f'The index does not match {self.filename}, please rebuild it.')
+
+    def set_field(self, key, values, rows=slice(None)):
+        """ Overwrite field key, one of PATCH_FIELDS, of the atom records in
+        rows, counting atom records only, with values formatted as in PDBTable.
+        """
+        self.write_field(key, format_field(key, values), rows)
+
+    def write_field(self, key, formatted, rows=slice(None)):
+        """ Overwrite field key with formatted values, see format_field. """
+        if key not in PATCH_FIELDS:
+            raise KeyError(f'Only the fields {PATCH_FIELDS} can be patched in place.')
+        rows = self.get_rows(rows)
+        if not self.fits(key, rows):
+            raise ValueError(f'Some records are too short to hold {key}, the file has to be rewritten.')
+        if len(formatted) != len(rows):
+            raise ValueError(f'Got {len(formatted)} values for {len(rows)} records.')
+        self.check_records(rows)
+        start, end = FIELD_COLUMNS[key]
+        self.data[self.starts[rows, None] + np.arange(start, end)] = formatted
+
+    def set_positions(self, positions, idx_start=0, idx_end=None):
+        """ Set the positions of the atoms idx_start to idx_end (exclusive),
+        counting only atom records, see PDBTable.set_positions.
+        """
+        if idx_end is None:
+            idx_end = len(self)
+        positions = np.asarray(positions, dtype=np.float64)
+        assert (idx_end - idx_start, 3) == positions.shape
+        for i, key in enumerate(POSITION_FIELDS):
+            self.set_field(key, positions[:, i], slice(idx_start, idx_end))
+
+    def get_field(self, key, rows=slice(None)):
+        """ Field key of the atom records in rows as np.ndarray of bytes, with
+        spaces for missing columns.
+        """
+        rows = self.get_rows(rows)
+        return get_field(self.data, self.starts[rows], self.lengths[rows], key)
+
+    def flush(self):
+        if self.buffer is not None:
+            self.buffer.flush()
+
+    def close(self):
+        if self.buffer is not None:
+            # the array has to let go of the map before it can be closed
+            self.data = None
+            self.buffer.close()
+            self.buffer = None
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f'PatchablePDB({self.filename!r}, {len(self)} atom records)'
+
+
+def rewrite_file(filename, fields, rows=slice(None)):
+    """ Set fields, given as dict key: values, of the atom records in rows by
+    rewriting the whole file through a PDBTable.
+    """
+    table = PDBTable.from_file(filename)
+    rows = np.arange(len(table))[rows]
+    for key, values in fields.items():
+        start, end = FIELD_COLUMNS[key]
+        table.buffer[rows, start : end] = format_field(key, values)
+    with replace_on_success(filename) as fh:
+        table.write(fh)
+
+
+def patch_file(filename, positions=None, atomid=None, resid=None, chainid=None, rows=slice(None), index=None):
+    """ Update fields of the atom records of a pdb file in place. If a record
+    is too short to hold one of the fields, the file is rewritten, which
+    formats all atom records as PDBTable does.
+    Arguments:
+        filename (str): Pdb file to be updated.
+        positions (np.ndarray (n, 3)): New positions of the records in rows.
+        atomid, resid, chainid (iterable): New fields of the records in rows.
+        rows (slice, mask or indices): Atom records to update, counting atom
+            records only, default: all
+        index (tuple): Offsets of the atom records, see PatchablePDB.
+    Returns:
+        True if the file was patched in place, False if it was rewritten.
+    """
+    fields = {
+        key: values for key, values in (('atomid', atomid), ('resid', resid), ('chainid', chainid))
+        if values is not None
+    }
+    if positions is not None:
+        positions = np.asarray(positions, dtype=np.float64)
+        fields.update(zip(POSITION_FIELDS, positions.T))
+    with PatchablePDB(filename, index) as patchable:
+        in_place = all(patchable.fits(key, rows) for key in fields)
+        if in_place:
+            # format everything first, so that a value that does not fit leaves the file unchanged
+            formatted = {key: format_field(key, values) for key, values in fields.items()}
+            for key, values in formatted.items():
+                patchable.write_field(key, values, rows)
+    if not in_place:
+        rewrite_file(filename, fields, rows)
+    return in_place
+
+
+def patch_atom_numbering(filename, restart_atomid_per_chain=True, index=None):
+    """ Renumber the atoms as fix_atom_numbering, overwriting only the atomid
+    columns of the file, model by model in multi-model files. Other columns,
+    lines and line endings stay as they are. Falls back to a rewrite as in patch_file.
+    Returns:
+        True if the file was patched in place, False if it was rewritten.
+    """
+    with PatchablePDB(filename, index) as patchable:
+        chainid = patchable.get_field('chainid')
+        models = find_models(patchable.buffer) if patchable.buffer is not None else []
+        if not models:
+            rows = np.arange(len(patchable))
+            atomid, __ = modify_table.atom_numbering_scan(chainid, restart_atomid_per_chain)
+        else:
+            # the numbering starts anew in every model, atoms outside of the models keep their ids
+            bodies = np.array([model[1 : 3] for model in models])
+            bounds = np.searchsorted(patchable.starts, bodies)
+            rows = np.concatenate([np.arange(start, end) for start, end in bounds])
+            atomid = np.concatenate([
+                modify_table.atom_numbering_scan(chainid[start : end], restart_atomid_per_chain)[0]
+                for start, end in bounds
+            ])
+        index = patchable.index
+    return patch_file(filename, atomid=atomid, rows=rows, index=index)
@@ -1,7 +1,77 @@
+import io
 import os
+import re
+import sys
+import mmap
+import time
 import argparse
-from typing import Optional
-import write_pdb
+import contextlib
+from functools import partial
+from write_pdb.compression import detect_compression, open_input
+from write_pdb.fileio import replace_on_success
+from write_pdb.models import has_models, parse_selection
+from write_pdb.pipeline import FusedPipeline
+from write_pdb.stats import PipelineStats, STAGES, PROFILERS
+
+# the array based modes (--batch, --in_place, the geometric transformations,
+# --models, --pipelined and --jobs) import their modules where they are used,
+# so that the per-line path, which runs for every single file, does not import numpy
+
+
+def decode_lines(line):
+    """Decode a line read up to its \n, translating \r\n and \r line endings
+    to \n as done when opening in text mode. Returns a list of lines, as a
+    lone \r also ends a line.
+    """
+    line = line.decode("utf-8")
+    if "\r" not in line:
+        return [line]
+    return io.StringIO(line, newline=None).readlines()
+
+
+def iter_lines(buffer):
+    """Yield the lines of a memory-mapped file as str, starting from the beginning."""
+    buffer.seek(0)
+    for line in iter(buffer.readline, b""):
+        yield from decode_lines(line)
+
+
+def iter_file_lines(filename):
+    """Yield the lines of a compressed file as str, decompressing it anew on every call."""
+    with open_input(filename) as fh:
+        for line in fh:
+            yield from decode_lines(line)
+
+
+def float_values(count):
+    """Argument type for count comma separated floats, i.e. 1,2.5,-3."""
+
+    def parse(text):
+        try:
+            values = tuple(float(value) for value in text.split(","))
+        except ValueError:
+            values = ()
+        if len(values) != count:
+            raise argparse.ArgumentTypeError(f"expected {count} comma separated numbers, got {text!r}")
+        return values
+
+    return parse
+
+
+def int_range(separator):
+    """Argument type for a range first<separator>last of int, or a single int.
+    Both may have a sign, so that with separator "-", -10--5 is -10 to -5.
+    """
+    pattern = re.compile(rf"\s*([+-]?\d+)\s*(?:{re.escape(separator)}\s*([+-]?\d+)\s*)?")
+
+    def parse(text):
+        match = pattern.fullmatch(text)
+        if match is None:
+            raise argparse.ArgumentTypeError(f"expected first{separator}last, got {text!r}")
+        first, last = match.groups()
+        return int(first), int(last) if last is not None else None
+
+    return parse
 
 
 def main():
@@ -38,24 +108,296 @@ def main():
         type=int,
         default=0,
     )
+    parser.add_argument(
+        "--single_pass",
+        help="Section into chains without counting the residues in a first pass, "
+        "the number of residues is only checked at the end.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--translate",
+        help="Move the selected atoms by x,y,z.",
+        type=float_values(3),
+    )
+    parser.add_argument(
+        "--rotate",
+        help="Rotate the selected atoms around the axis x,y,z through the origin by degrees, "
+        "given as x,y,z,degrees.",
+        type=float_values(4),
+    )
+    parser.add_argument(
+        "--matrix",
+        help="Transform the selected atoms by the 3x3 rotation, or 3x4 or 4x4 affine matrix "
+        "in this text file.",
+    )
+    parser.add_argument(
+        "--center",
+        help="Move all atoms such that the center of mass of the selected atoms, by the element "
+        "column, is at the origin, or at the center of the box with --wrap.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--wrap",
+        help="Wrap the selected atoms into the box of the CRYST1 line, by minimum image.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--align",
+        help="Move all atoms such that the selected atoms fit the same atoms of the first model "
+        "of this pdb file best, with the Kabsch algorithm.",
+    )
+    parser.add_argument(
+        "--select_chain",
+        help="Geometric transformations: select the atoms of these chains, i.e. A or A,B.",
+    )
+    parser.add_argument(
+        "--select_resid",
+        help="Geometric transformations: select the atoms of the residues first-last or of one residue. "
+        "Negative ids are given with =, i.e. --select_resid=-5 or --select_resid=-10--5.",
+        type=int_range("-"),
+    )
+    parser.add_argument(
+        "--select_atoms",
+        help="Geometric transformations: select the atom records start:end of every model, "
+        "0-based and end exclusive.",
+        type=int_range(":"),
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        help="Split the file into chunks and transform them in this many processes, default: 1. "
+        "With --batch, the files are transformed in this many processes, default: all cores.",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--pipelined",
+        "-p",
+        help="Overlap reading, transforming and writing: a reader thread prefetches large blocks "
+        "and a writer thread writes the results, which pays off on slow or high latency disks.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--models",
+        "-m",
+        help="Only write these models of a multi-model file, counted from 1 in file order, "
+        "i.e. 1,3,5-10. The other models are skipped by their offsets, without being parsed. "
+        "Multi-model files are always transformed model by model, in --jobs processes or streamed "
+        "with --pipelined, which does not work with --single_pass.",
+    )
+    parser.add_argument(
+        "--threads",
+        "-t",
+        help="Threads that compress the output, if the save name ends in .gz, .xz or .zst. "
+        "Compressed inputs are detected by their magic bytes or extension. Default: all cores.",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--batch",
+        "-b",
+        help="Transform many files in a pool of --jobs processes, given as glob pattern, "
+        "directory, manifest with one file per line or JSON/TOML recipe.",
+    )
+    parser.add_argument(
+        "--out_dir",
+        "-o",
+        help="Batch mode: mirror the input files into this directory instead of overwriting them.",
+    )
+    parser.add_argument(
+        "--in_place",
+        help="With -a only: overwrite just the atom ids in the input file instead of rewriting it, "
+        "leaving all other columns and lines as they are. Records too short to hold the ids "
+        "make it fall back to a rewrite.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stats",
+        nargs="?",
+        const="table",
+        choices=["table", "json"],
+        help="Report time, records, bytes and peak memory per stage to stderr, as table (default) or json.",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=STAGES,
+        help="Run the profiler around this stage and report it with the stats.",
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=PROFILERS,
+        default="cprofile",
+        help="Profiler for --profile.",
+    )
+    parser.add_argument(
+        "--verbose",
+        "-v",
+        help="Log debug messages of the transformations.",
+        action="store_true",
+    )
     args = parser.parse_args()
+    if args.verbose:
+        # nothing is logged above debug level, so logging is only set up when asked for
+        import logging
+
+        logging.basicConfig(level=logging.DEBUG)
+    if args.jobs is None and not args.batch:
+        args.jobs = 1
+    stats = None
+    if args.stats or args.profile:
+        stats = PipelineStats(args.profile, args.profiler)
+    options = dict(
+        kick=args.kick,
+        fix_atom_numbering=bool(args.fix_atom_numbering),
+        fix_residue_numbering=bool(args.fix_resiude_numbering),
+        residues_per_chain=args.section_into_chains or None,
+    )
+
+    geometry = dict(
+        translate=args.translate,
+        rotate=args.rotate and (args.rotate[:3], args.rotate[3]),
+        matrix=args.matrix,
+        center=args.center,
+        wrap=args.wrap,
+        align=args.align,
+    )
+    selection = dict(
+        chainid=args.select_chain and args.select_chain.split(","),
+        resid=args.select_resid,
+        idx=args.select_atoms,
+    )
+    transform_geometry = any(value not in (None, False) for value in geometry.values())
+    if args.select_resid and args.select_resid[1] is None:
+        selection["resid"] = args.select_resid[0]
+    if transform_geometry and (args.batch or args.models or args.pipelined or args.jobs > 1 or args.single_pass):
+        parser.error(
+            "Geometric transformations load the whole file, they do not work with --batch, --models, "
+            "--pipelined, --jobs or --single_pass."
+        )
+    if not transform_geometry and any(value is not None for value in selection.values()):
+        parser.error("--select_chain, --select_resid and --select_atoms only select atoms for geometric transformations.")
+
+    if args.batch:
+        from write_pdb import batch
 
-    if not os.path.isfile(args.file):
+        jobs = batch.collect_jobs(args.batch, options, args.out_dir)
+        start = time.perf_counter()
+        results = batch.run_batch(jobs, args.jobs)
+        batch.print_summary(results, time.perf_counter() - start)
+        if any(result["error"] for result in results):
+            sys.exit(1)
+        return
+    if not args.file or not os.path.isfile(args.file):
         raise FileNotFoundError("Please give .pdb input.")
     if not args.save:
         args.save = args.file
-    with open(args.file, "r", encoding="utf-8") as fh:
-        lines = fh.readlines()
-    if args.kick:
-        lines = [line for line in lines if args.kick not in line]
-    if args.fix_atom_numbering:
-        lines = write_pdb.fix_atom_numbering(lines)
-    if args.fix_resiude_numbering:
-        lines = write_pdb.fix_atom_numbering(lines)
-    if args.section_into_chains:
-        lines = write_pdb.section_into_chains(lines, args.section_into_chains)
-    with open(args.save, "w", encoding="utf-8") as fh:
-        fh.writelines(lines)
+    if args.in_place:
+        if args.save != args.file or args.kick or args.fix_resiude_numbering or args.section_into_chains or args.models or transform_geometry:
+            parser.error("--in_place only works with -a and without --save or other transformations.")
+        if detect_compression(args.file) is not None:
+            parser.error("--in_place does not work on compressed files.")
+        if not args.fix_atom_numbering:
+            return
+        from write_pdb import inplace
+
+        patched = inplace.patch_atom_numbering(args.file)
+        print(f"{'Patched' if patched else 'Rewrote'} {args.file}.")
+        return
+    if transform_geometry:
+        import numpy as np
+        from write_pdb.geometry import EmptySelectionError, transform_file
+
+        if args.matrix:
+            geometry["matrix"] = np.loadtxt(args.matrix, ndmin=2)
+        geometry["selection"] = {key: value for key, value in selection.items() if value is not None}
+        try:
+            __, at_once = transform_file(args.file, args.save, stats=stats, threads=args.threads, **options, **geometry)
+        except EmptySelectionError as error:
+            parser.error(str(error))
+        if at_once:
+            print(f"Moved the atoms of every model of {args.file} at once.")
+        else:
+            print(f"Moved the atoms of the models of {args.file} one by one, their atoms or selections differ.")
+        report_stats(stats, args.stats)
+        return
+    models = None
+    if args.models:
+        try:
+            models = parse_selection(args.models)
+        except ValueError as error:
+            parser.error(f"--models: {error}")
+        if not models:
+            parser.error(f"--models {args.models!r} selects no models.")
+    # only the numbering and the sectioning restart in every model, so kicking
+    # lines and copying files do not search the file for MODEL records
+    per_model = options["fix_atom_numbering"] or options["fix_residue_numbering"] or options["residues_per_chain"]
+    if args.single_pass and (models is not None or (per_model and has_models(args.file))):
+        parser.error("Multi-model files and --models are transformed model by model, without --single_pass.")
+    if args.pipelined:
+        from write_pdb.streaming import StreamingModelPipeline, stream_file
+
+        # multi-model files are streamed model by model, see open_pipeline
+        pipeline = stream_file(args.file, args.save, stats=stats, threads=args.threads, models=models, **options)
+        if isinstance(pipeline, StreamingModelPipeline):
+            n_written = len(models) if models else pipeline.n_models
+            print(
+                f"Streamed {n_written} of {pipeline.n_models} model(s) of {args.file} one by one "
+                "through reader and writer threads."
+            )
+        else:
+            print(f"Streamed {args.file} through reader and writer threads.")
+        report_stats(stats, args.stats)
+        return
+    if models is not None or (per_model and has_models(args.file)):
+        from write_pdb.parallel import process_file
+
+        pipeline = process_file(
+            args.file, args.save, jobs=args.jobs, stats=stats, threads=args.threads, models=models, **options
+        )
+        n_written = len(models) if models else pipeline.n_models
+        print(f"Transformed {n_written} of {pipeline.n_models} model(s) of {args.file} one by one.")
+        report_stats(stats, args.stats)
+        return
+    if args.jobs > 1:
+        from write_pdb.parallel import process_file
+
+        process_file(args.file, args.save, jobs=args.jobs, stats=stats, threads=args.threads, **options)
+        print(f"Used {args.jobs} processes on {args.file}.")
+        report_stats(stats, args.stats)
+        return
+    # fuse all requested transformations into as few passes as possible
+    pipeline = FusedPipeline(**options, single_pass=args.single_pass, stats=stats)
+    # stream into a temporary file, which also allows overwriting the input
+    with open(args.file, "rb") as fh_in, replace_on_success(
+        args.save, "w", encoding="utf-8", threads=args.threads
+    ) as fh_out:
+        if detect_compression(args.file) is not None:
+            buffer = contextlib.nullcontext()
+            open_lines = partial(iter_file_lines, args.file)
+        else:
+            if os.path.getsize(args.file):
+                buffer = mmap.mmap(fh_in.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # empty files can not be memory-mapped
+                buffer = io.BytesIO()
+            open_lines = partial(iter_lines, buffer)
+        with buffer:
+            lines = pipeline(open_lines)
+            if stats is None:
+                fh_out.writelines(lines)
+            else:
+                write = stats.wrap("write", fh_out.write, count_bytes="in")
+                for line in lines:
+                    write(line)
+    print(f"Used {pipeline.n_passes} pass(es) over {args.file}.")
+    report_stats(stats, args.stats)
+
+
+def report_stats(stats, fmt):
+    """Write the stats of the run to stderr, if recorded."""
+    if stats is not None:
+        stats.finish()
+        stats.report(fmt or "table")
 
 
 if __name__ == "__main__":
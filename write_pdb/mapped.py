@@ -0,0 +1,125 @@
+import os
+import mmap
+import numpy as np
+from write_pdb import codec
+from write_pdb.compression import detect_compression, open_input
+from write_pdb.pdbtable import FIELD_COLUMNS
+
+
+class MappedPDB:
+    """
+    Read-only, memory-mapped pdb file with an index of all lines.
+    The start, end and record type (see codec.RECORD_KINDS) of every line are
+    found in one vectorized scan over the mapped bytes. Fields of the atom
+    records are read straight from the map, column by column, without creating
+    a str per line. Can be passed to the functions of modify_pdb instead of
+    a list of lines, which then work on PDBTable.from_mapped(mapped).
+    """
+    def __init__(self, filename):
+        """ Map the file and build the line index.
+        Arguments:
+            filename (str): Pdb file to be mapped.
+        """
+        self.filename = filename
+        self.fh = open(filename, 'rb')
+        if detect_compression(filename) is not None:
+            # compressed files can not be mapped, they are decompressed into memory
+            with open_input(filename) as fh:
+                self.buffer = fh.read()
+        elif os.path.getsize(filename):
+            self.buffer = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # empty files can not be memory-mapped
+            self.buffer = b''
+        # text mode would translate other line endings, which needs a copy
+        self.data = codec.normalize_newlines(self.buffer)
+        self.starts, self.ends = codec.line_bounds(self.data)
+        self.kinds = codec.record_kinds(self.data, self.starts, self.ends)
+        self.atom_rows = np.flatnonzero(np.isin(self.kinds, (codec.ATOM, codec.HETATM)))
+
+    def __len__(self):
+        """ Number of atom records. """
+        return len(self.atom_rows)
+
+    @property
+    def n_lines(self):
+        return len(self.starts)
+
+    def rows_of_kind(self, kind):
+        """ Line indices of all records of a kind, given as str in codec.RECORD_KINDS. """
+        return np.flatnonzero(self.kinds == codec.RECORD_KINDS.index(kind))
+
+    def line(self, idx):
+        """ Raw bytes of line idx, including the line ending. """
+        return bytes(self.data[self.starts[idx] : self.ends[idx]])
+
+    def iter_lines(self):
+        """ Yield all lines as str. """
+        for start, end in zip(self.starts, self.ends):
+            yield bytes(self.data[start : end]).decode('utf-8')
+
+    def get_field(self, key):
+        """ Return field key of all atom records as np.ndarray (n_atoms, width) of bytes,
+        read from the map. Missing columns of short lines are spaces.
+        """
+        start, end = FIELD_COLUMNS[key]
+        return codec.gather(
+            self.data, self.starts[self.atom_rows] + start, self.ends[self.atom_rows], end - start
+        )
+
+    def get_column(self, key):
+        """ Return field key of all atom records, stripped and as str. """
+        field = self.get_field(key)
+        return np.char.strip(field.view(f'S{field.shape[1]}').reshape(-1)).astype(str)
+
+    def get_numbers(self, key, dtype=np.float64):
+        """ Return field key of all atom records parsed as numbers. """
+        field = self.get_field(key)
+        return field.view(f'S{field.shape[1]}').reshape(-1).astype(dtype)
+
+    @property
+    def atomid(self):
+        return self.get_numbers('atomid', np.int64)
+
+    @property
+    def resid(self):
+        return self.get_numbers('resid', np.int64)
+
+    @property
+    def chainid(self):
+        return self.get_column('chainid')
+
+    @property
+    def resname(self):
+        return self.get_column('resname')
+
+    @property
+    def atomname(self):
+        return self.get_column('atomname')
+
+    @property
+    def xyz(self):
+        """ Atom positions as np.ndarray (-1, 3) of float. """
+        return np.stack([self.get_numbers(key) for key in ('posx', 'posy', 'posz')], axis=1)
+
+    def write_lines(self, fh, idx_start=0, idx_end=None):
+        """ Copy lines idx_start to idx_end (exclusive) to a binary file as one byte range. """
+        if idx_end is None:
+            idx_end = self.n_lines
+        if idx_end > idx_start:
+            fh.write(self.data[self.starts[idx_start] : self.ends[idx_end - 1]])
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f'MappedPDB({self.filename!r}, {len(self)} atom records, {self.n_lines} lines)'
+
@@ -0,0 +1,121 @@
+import os
+import mmap
+from write_pdb.compression import detect_compression, open_input, iter_line_blocks
+
+
+# multi-model files are found by searching blocks of this size for MODEL records
+SEARCH_BLOCK_BYTES = 1 << 22
+
+
+def find_record(data, name, start=0, end=None):
+    """Offset of the first line in data[start:end] that begins with name
+    (bytes), -1 if there is none. start has to be the start of a line.
+    """
+    end = len(data) if end is None else end
+    pos = data.find(name, start, end)
+    while pos > start and data[pos - 1 : pos] != b'\n':
+        pos = data.find(name, pos + 1, end)
+    return pos
+
+
+def line_end(data, pos):
+    """Offset after the newline of the line at pos."""
+    newline = data.find(b'\n', pos)
+    return len(data) if newline == -1 else newline + 1
+
+
+def find_models(data):
+    """Byte ranges of the models of the content of a pdb file, found by
+    searching for the MODEL and ENDMDL records without parsing other lines.
+    A model without ENDMDL ends at the next MODEL record or the end of the file.
+    Returns:
+        list of (start, body_start, body_end, end) per model, the MODEL line
+        starts at start, the lines between MODEL and ENDMDL span body_start
+        to body_end, and the ENDMDL line ends at end, all exclusive.
+    """
+    models = []
+    start = find_record(data, b'MODEL')
+    while start != -1:
+        body_start = line_end(data, start)
+        next_model = find_record(data, b'MODEL', body_start)
+        limit = len(data) if next_model == -1 else next_model
+        endmdl = find_record(data, b'ENDMDL', body_start, limit)
+        if endmdl == -1:
+            models.append((start, body_start, limit, limit))
+        else:
+            models.append((start, body_start, endmdl, line_end(data, endmdl)))
+        start = next_model
+    return models
+
+
+def has_models(filename):
+    """If a pdb file contains MODEL records. Plain files are searched through
+    a memory map, compressed ones block by block, up to the first MODEL record.
+    """
+    if detect_compression(filename) is not None:
+        with open_input(filename) as fh:
+            return any(
+                block.startswith(b'MODEL') or b'\nMODEL' in block
+                for block in iter_line_blocks(fh, SEARCH_BLOCK_BYTES)
+            )
+    if not os.path.getsize(filename):
+        return False
+    with open(filename, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return find_record(data, b'MODEL') != -1
+
+
+def model_ranges(pdb_lines):
+    """Line indices (body_start, body_end) of the lines between each MODEL
+    line and its ENDMDL line, as in find_models, empty if there is no MODEL line.
+    Arguments:
+        pdb_lines (list of str): Lines of a pdb file.
+    """
+    model_idxs = [i for i, line in enumerate(pdb_lines) if line.startswith('MODEL')]
+    ranges = []
+    for model_idx, limit in zip(model_idxs, model_idxs[1 : ] + [len(pdb_lines)]):
+        body_end = next(
+            (i for i in range(model_idx + 1, limit) if pdb_lines[i].startswith('ENDMDL')), limit
+        )
+        ranges.append((model_idx + 1, body_end))
+    return ranges
+
+
+def is_frame_line(line):
+    """If a line, str or bytes, is a MODEL or ENDMDL record."""
+    return line.startswith(('MODEL', 'ENDMDL') if isinstance(line, str) else (b'MODEL', b'ENDMDL'))
+
+
+def parse_selection(selection):
+    """Model numbers of a selection such as '1,3,5-10', counted from 1 in file
+    order. Returns a sorted list of int without duplicates.
+    """
+    models = set()
+    for part in selection.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, __, last = part.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise ValueError(f'Can not read the model selection {selection}, use i.e. 1,3,5-10.') from None
+        if first < 1 or last < first:
+            raise ValueError(f'Models are counted from 1 and ranges go up, got {part}.')
+        models.update(range(first, last + 1))
+    return sorted(models)
+
+
+def select_models(n_models, models=None):
+    """Indices of the selected models, all if models is None.
+    Arguments:
+        n_models (int): Number of models in the file.
+        models (iterable of int): Model numbers, counted from 1, see parse_selection.
+    """
+    if models is None:
+        return list(range(n_models))
+    models = sorted(set(models))
+    missing = [model for model in models if not 1 <= model <= n_models]
+    if missing:
+        raise ValueError(f'The file has {n_models} model(s), there is no model {missing[0]}.')
+    return [model - 1 for model in models]
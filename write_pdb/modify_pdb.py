@@ -1,5 +1,56 @@
+import sys
 import string
-from write_pdb.pdbline import PDBLINE
+from write_pdb.pdbrecord import PDBRecord, is_atom_line, other_text, parse_line
+from write_pdb.models import model_ranges, is_frame_line
+# logging is imported by the functions that log, so that the CLI only
+# imports it with --verbose
+
+
+def as_table(pdb_lines):
+    """pdb_lines as PDBTable, if given as PDBTable or MappedPDB, else None.
+    Tables only exist once their module is imported, so lists of lines are
+    told apart without importing numpy.
+    """
+    if 'write_pdb.pdbtable' not in sys.modules:
+        return None
+    from write_pdb.pdbtable import PDBTable
+    from write_pdb.mapped import MappedPDB
+    if isinstance(pdb_lines, MappedPDB):
+        return PDBTable.from_mapped(pdb_lines)
+    if isinstance(pdb_lines, PDBTable):
+        return pdb_lines
+    return None
+
+
+def apply_per_model(transform, pdb_lines, drop_other=False):
+    """Run transform on the lines of every model of a multi-model file, so
+    that the counters start anew in every model, see models.model_ranges.
+    MODEL, ENDMDL and the lines outside of the models are kept as they are.
+    Arguments:
+        transform (callable): Takes the lines of a model, returns a list of lines.
+        pdb_lines (list of str): Lines of the whole file.
+        drop_other (bool): Drop the lines outside of the models that are neither
+            atom records nor MODEL or ENDMDL, for a transform that drops all non
+            atom lines, so that a file gives the same lines with and without models.
+    """
+    pdb_lines = pdb_lines if isinstance(pdb_lines, list) else list(pdb_lines)
+    ranges = model_ranges(pdb_lines)
+    if not ranges:
+        return transform(pdb_lines)
+
+    def outside(lines):
+        if not drop_other:
+            return lines
+        return [line for line in lines if is_frame_line(line) or is_atom_line(line)]
+
+    output = []
+    prev_end = 0
+    for body_start, body_end in ranges:
+        output.extend(outside(pdb_lines[prev_end : body_start]))
+        output.extend(transform(pdb_lines[body_start : body_end]))
+        prev_end = body_end
+    output.extend(outside(pdb_lines[prev_end : ]))
+    return output
 
 
 class IsNewChain:
@@ -21,100 +72,187 @@ class IsNewChain:
         if not pdb_line.is_atom:
             return False
         if self.chainid != pdb_line["chainid"]:
+            is_first_call = self.chainid is None
             self.chainid = pdb_line["chainid"]
-            return self.return_val_first_call
+            return self.return_val_first_call if is_first_call else True
         return False
 
 
+class AtomNumbering:
+    """Renumber atoms line by line, the state of fix_atom_numbering."""
+
+    def __init__(self, restart_atomid_per_chain=True):
+        self.restart_atomid_per_chain = restart_atomid_per_chain
+        self.clear()
+
+    def clear(self):
+        """Reset the counter and the chain tracker."""
+        self.atom_counter = 1
+        self.is_new_chain = IsNewChain(return_val_first_call=False)
+
+    def __call__(self, line_obj):
+        """Renumber line_obj in place, returns if the line is kept."""
+        if self.restart_atomid_per_chain and self.is_new_chain(line_obj):
+            self.atom_counter = 1
+        if line_obj.is_atom:
+            line_obj["atomid"] = self.atom_counter
+            self.atom_counter += 1
+        return True
+
+
+class ResidueNumbering:
+    """Renumber residues line by line, the state of fix_residue_numbering."""
+
+    def __init__(self, restart_resid_per_chain=False):
+        self.restart_resid_per_chain = restart_resid_per_chain
+        self.clear()
+
+    def clear(self):
+        """Reset the counter and the trackers."""
+        self.res_counter = 1
+        self.resname_cache = None
+        self.is_new_chain = IsNewChain()
+        self.found_ca = False
+        self.first_line = True
+
+    def __call__(self, line_obj):
+        """Renumber line_obj in place, returns if the line is kept."""
+        # the first line sets the reference chain
+        if self.first_line:
+            self.is_new_chain(line_obj)
+            self.first_line = False
+        # ignore REMARK TER and other such lines
+        if not line_obj.is_atom:
+            return False
+        if line_obj["atomname"].strip() == "CA":
+            if self.found_ca:
+                raise ValueError(
+                    "Multiple CA atoms found in residue, probably due to "
+                    "Two residues with the same resname next to each other. "
+                    "Please fix this manually. "
+                    )
+            self.found_ca = True
+        if self.resname_cache is None:
+            self.resname_cache = line_obj["resname"]
+        elif line_obj["resname"] != self.resname_cache:
+            if self.restart_resid_per_chain and self.is_new_chain(line_obj):
+                self.res_counter = 1
+            else:
+                self.res_counter += 1
+            self.resname_cache = line_obj["resname"]
+            self.found_ca = False
+        line_obj["resid"] = self.res_counter
+        return True
+
+
+def kick_lines(pdb_lines, kick):
+    """Generator stage that drops all lines containing the str kick.
+    Arguments:
+        pdblines (iterable of str): The pdb lines to be filtered.
+        kick (str): Lines that contain this string are removed.
+    """
+    for line in pdb_lines:
+        if kick not in line:
+            yield line
+
+
+def iter_fix_atom_numbering(pdb_lines, restart_atomid_per_chain=True):
+    """Generator stage of fix_atom_numbering, takes and yields pdb lines one by one."""
+    atom_numbering = AtomNumbering(restart_atomid_per_chain)
+    for line in pdb_lines:
+        line_obj = parse_line(line)
+        atom_numbering(line_obj)
+        yield line_obj.get_line() if line_obj.is_atom else other_text(line)
+
+
 def fix_atom_numbering(pdb_lines, restart_atomid_per_chain=True):
     """Check that the atom numbering is increasing by one each line,
     given a list of pdb lines. Returns a bopy of pdb_lines.
     Arguments:
-        pdblines (list of str): List containing the pdb lines to be changed.
+        pdblines (list of str or PDBTable): List containing the pdb lines to be changed.
+            A PDBTable or MappedPDB is processed with modify_table.fix_atom_numbering.
+            Multi-model files are processed model by model, see apply_per_model.
         restart_atomid_per_chain (bool): Restart the atom numbering at 1 when a
             new chain begins or number starting at the beginning of the file to the end
             default: True
     """
-    output_lines = []
-    atom_counter = 1
-    is_new_chain = IsNewChain(return_val_first_call=False)
+    table = as_table(pdb_lines)
+    if table is not None:
+        from write_pdb import modify_table
+        return modify_table.fix_atom_numbering(table, restart_atomid_per_chain)
+    return apply_per_model(
+        lambda lines: list(iter_fix_atom_numbering(lines, restart_atomid_per_chain)), pdb_lines
+    )
+
+
+def iter_fix_residue_numbering(pdb_lines, restart_resid_per_chain=False):
+    """Generator stage of fix_residue_numbering, takes and yields pdb lines one by one."""
+    residue_numbering = ResidueNumbering(restart_resid_per_chain)
+    import logging
+    logger = logging.getLogger(__name__)
+    # checked once, the message is per atom
+    debug = logger.isEnabledFor(logging.DEBUG)
     for line in pdb_lines:
-        line_obj = PDBLINE.from_line(line)
-        if restart_atomid_per_chain and is_new_chain(line_obj):
-            atom_counter = 1
-        if line_obj.is_atom:
-            line_obj["atomid"] = atom_counter
-            atom_counter += 1
-        output_lines.append(line_obj.get_line())
-    return output_lines
+        line_obj = parse_line(line)
+        if debug and line_obj.is_atom:
+            logger.debug("atom %s is CA: %s", line_obj["atomname"].strip(), line_obj["atomname"].strip() == "CA")
+        # REMARK TER and other such lines are dropped
+        if residue_numbering(line_obj):
+            yield line_obj.get_line()
 
 
 def fix_residue_numbering(pdb_lines, restart_resid_per_chain=False):
     """Check that the residue numbering is increasing by one when the resname
     field chainges, given a list of pdb lines. Returns a bopy of pdb_lines.
     Arguments:
-        pdblines (list of str): List containing the pdb lines to be changed.
+        pdblines (list of str or PDBTable): List containing the pdb lines to be changed.
+            A PDBTable or MappedPDB is processed with modify_table.fix_residue_numbering.
+            Multi-model files are processed model by model, see apply_per_model.
         restart_resid_per_chain (bool): Restart the residue numbering at 1 when a
             new chain begins, default: False
     """
-    output_lines = []
-    res_counter = 1
-    # store the name of resiude we are iterating over right now
-    # to detect when it changes
-    resname_cache = None
-    is_new_chain = IsNewChain()
-    is_new_chain(PDBLINE.from_line(pdb_lines[0]))
-    found_ca = False
-    for line in pdb_lines:
-        line_obj = PDBLINE.from_line(line)
-        # ignore REMARK TER and other such lines
-        if not line_obj.is_atom:
-            continue
-        print(line_obj["atomname"].strip(), line_obj["atomname"].strip() == "CA")
-        if line_obj["atomname"].strip() == "CA":
-            if found_ca:
-                raise ValueError(
-                    "Multiple CA atoms found in residue, probably due to "
-                    "Two residues with the same resname next to each other. "
-                    "Please fix this manually. "
-                    )
-            found_ca = True
-        # set cache the first time a line belonging to residue is encountered
-        if resname_cache is None:
-            resname_cache = PDBLINE.from_line(line)["resname"]
-        # check if a new residue has started, count the number of residues
-        elif line_obj["resname"] != resname_cache:
-            if restart_resid_per_chain and is_new_chain(line_obj):
-                res_counter = 1
-            else:
-                res_counter += 1
-            resname_cache = line_obj["resname"]
-            found_ca = False
-        line_obj["resid"] = res_counter
-        output_lines.append(line_obj.get_line())
-    return output_lines
+    table = as_table(pdb_lines)
+    if table is not None:
+        from write_pdb import modify_table
+        return modify_table.fix_residue_numbering(table, restart_resid_per_chain)
+    return apply_per_model(
+        lambda lines: list(iter_fix_residue_numbering(lines, restart_resid_per_chain)), pdb_lines, drop_other=True
+    )
+
+
+def iter_write_positions(pdb_lines, positions, idx_start=0):
+    """Generator stage of write_positions. Lines from idx_start on get the
+    positions in order, until all positions are used up.
+    """
+    idx_end = idx_start + len(positions)
+    for i, line in enumerate(pdb_lines):
+        if idx_start <= i < idx_end:
+            line_obj = PDBRecord.from_line(line)
+            line_obj.set_positions(positions[i - idx_start])
+            line = line_obj.get_line()
+        yield line
 
 
 def write_positions(pdb_lines, positions, idx_start=0, idx_end="inf"):
     """Write new positions into a pdb file.
     Arguments
-        pdblines (list of str): List containing the pdb lines to be changed.
+        pdblines (list of str or PDBTable): List containing the pdb lines to be changed.
+            A PDBTable or MappedPDB is processed with modify_table.write_positions, where
+            idx_start and idx_end count atom records only.
         positions (np.ndarray (-1, 3)): Positions to be written into the pdb.
         idx_start (int): Index where to start changing pos in lines, 0-based
             default: 0; incluse
         idx_end (int): Index where to end changing pos in lines, 0-based
             default: int(1e99); exclusive
     """
+    table = as_table(pdb_lines)
+    if table is not None:
+        from write_pdb import modify_table
+        return modify_table.write_positions(table, positions, idx_start, idx_end)
     if idx_end == "inf":
         idx_end = len(pdb_lines)
-    output_lines = pdb_lines[:idx_start]
     assert (idx_end - idx_start, 3) == positions.shape
-    for line, pos in zip(pdb_lines[idx_start:idx_end], positions):
-        line_obj = PDBLINE.from_line(line)
-        line_obj.set_positions(pos)
-        output_lines.append(line_obj.get_line())
-    output_lines.extend(pdb_lines[idx_end:])
-    return output_lines
+    return list(iter_write_positions(pdb_lines, positions, idx_start))
 
 
 class IsNewResidue:
@@ -137,34 +275,28 @@ class IsNewResidue:
     def __call__(self, pdb_line):
         if not pdb_line.is_atom:
             return False
-        if self.resid != pdb_line["resid"] or self.resid != pdb_line["resid"]:
+        if self.resid != pdb_line["resid"] or self.resname != pdb_line["resname"]:
             self.resname = pdb_line["resname"]
             self.resid = pdb_line["resid"]
             return True
         return False
 
 
-def section_into_chains(
-    pdb_lines, residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase
-):
-    """Define a given number of residues into a chain. Chains are identified
-    by upper case letters in alphabetical order. Does not change residue numbering.
-    Checks that a 'TER' line is inserted after a chain finishes.
-    Arguments
-        residues_per_chain (list of ints or int): Number of residues per chain.
-            If int, all chains get the same number of residues
-            If list, runs through the list and assigns a chain for each
-            integer in the list with that number of residues.
-        chain_names (list of str): List of chain names to be used. Must be at least
-            as long as the number of chains that are defined by n_lines / residues_per_chain.
-            default: string.ascii_uppercase
+def count_residues(pdb_lines):
+    """Count the residues in pdb lines, where a new residue starts when
+    either the resid or the resname changes. Consumes the lines.
     """
-    # we count the number of residues by iterating through all lines
-    # where a new residue starts when either the resid or the resname changes
     is_new_residue = IsNewResidue()
-    n_residues = int(sum(is_new_residue(PDBLINE.from_line(line)) for line in pdb_lines))
-    print(f"Input {residues_per_chain=}, computed {n_residues=}")
-    # check input
+    return int(sum(is_new_residue(parse_line(line)) for line in pdb_lines))
+
+
+def get_residues_per_chain(n_residues, residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase):
+    """Check the input to section_into_chains and return the number of residues
+    for each chain as list of ints.
+    Arguments
+        n_residues (int): Total number of residues.
+        residues_per_chain, n_chains, chain_names: see section_into_chains.
+    """
     if residues_per_chain is None and n_chains is None:
         raise ValueError("Please provide either residues_per_chain or n_chains")
     if residues_per_chain is None:
@@ -172,11 +304,6 @@ def section_into_chains(
         if float(int(residues_per_chain)) != residues_per_chain:
             raise ValueError(f"{n_residues=} is not divisible by {n_chains=}")
         residues_per_chain = int(residues_per_chain)
-    if n_residues / residues_per_chain > len(chain_names):
-        raise ValueError("We have more residues than chain names, please provide more chain names")
-    # clear the residue counter
-    is_new_residue.clear()
-    # set up residues per chain
     if isinstance(residues_per_chain, int):
         assert n_residues % residues_per_chain == 0, (
             "The number of residues per chain is an integer, so every chain should "
@@ -187,37 +314,156 @@ def section_into_chains(
         )
         residues_per_chain = n_residues // residues_per_chain * [residues_per_chain]
     elif isinstance(residues_per_chain, list):
-        if sum([isinstance(x, int) for x in residues_per_chain]) != 0:
+        if not all(isinstance(x, int) for x in residues_per_chain):
             raise TypeError("Type of residues_per_chain needs to be int or list of ints")
         n_residues_chain = sum(residues_per_chain)
-        assert n_residues % pdb_lines == 0, (
+        assert n_residues == n_residues_chain, (
             "The number of residues per chain is a list, so every chain should "
             "have the number of residues given in the list. The sum of integers "
-            f"is f{n_residues_chain}, which is not the same as the total number of "
+            f"is {n_residues_chain}, which is not the same as the total number of "
             f"in pdb_lines, which is {n_residues}"
         )
     else:
         raise TypeError("Type of residues_per_chain needs to be int or list of ints")
-    # now do the actual sectioning into chains
-    output_lines = []
-    chain_counter = 0
-    res_counter = 0
-    for i, line in enumerate(pdb_lines):
-        line_obj = PDBLINE.from_line(line)
+    if len(residues_per_chain) > len(chain_names):
+        raise ValueError("We have more residues than chain names, please provide more chain names")
+    return residues_per_chain
+
+
+def iter_chain_ends(residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase, n_residues=None):
+    """Yield the running number of residues at which each chain ends.
+    If n_residues is known, the input is checked up front as in section_into_chains,
+    otherwise residues_per_chain has to be given and chains are generated on the fly.
+    """
+    if n_residues is not None:
+        residues_per_chain = get_residues_per_chain(
+            n_residues, residues_per_chain, n_chains, chain_names
+        )
+    elif residues_per_chain is None:
+        raise ValueError(
+            "Sectioning into n_chains needs the number of residues, "
+            "please count them first with count_residues."
+        )
+    chain_end = 0
+    if isinstance(residues_per_chain, int):
+        while True:
+            chain_end += residues_per_chain
+            yield chain_end
+    for n_residues_chain in residues_per_chain:
+        chain_end += n_residues_chain
+        yield chain_end
+
+
+class ChainSectioning:
+    """Assign chains line by line, the state of section_into_chains.
+    See iter_section_into_chains for the arguments."""
+
+    def __init__(
+        self, residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase, n_residues=None
+    ):
+        self.residues_per_chain = residues_per_chain
+        self.n_chains = n_chains
+        self.chain_names = chain_names
+        self.n_residues = n_residues
+        self.chain_ends = iter_chain_ends(residues_per_chain, n_chains, chain_names, n_residues)
+        self.chain_end = next(self.chain_ends)
+        self.is_new_residue = IsNewResidue()
+        self.chain_counter = 0
+        self.res_counter = 0
+
+    def __call__(self, line_obj):
+        """Set the chainid of the atom line_obj, returns if a new chain has started."""
+        self.res_counter += self.is_new_residue(line_obj)
+        new_chain = self.res_counter > self.chain_end
+        if new_chain:
+            self.chain_counter += 1
+            self.chain_end = next(self.chain_ends, None)
+            if self.chain_end is None or self.chain_counter >= len(self.chain_names):
+                raise ValueError(
+                    "We have more residues than chains, please check residues_per_chain "
+                    "or provide more chain names"
+                )
+        line_obj["chainid"] = self.chain_names[self.chain_counter]
+        return new_chain
+
+    def finish(self):
+        """Check the input now that all residues were counted, if not done up front."""
+        if self.n_residues is None:
+            get_residues_per_chain(
+                self.res_counter, self.residues_per_chain, self.n_chains, self.chain_names
+            )
+
+
+def iter_section_into_chains(
+    pdb_lines, residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase, n_residues=None
+):
+    """Generator stage of section_into_chains, takes and yields pdb lines one by one,
+    looking one line ahead to find existing TER lines.
+    Without n_residues, the lines are sectioned in a single pass, n_chains can not be used
+    and the number of residues is only checked when the last line was read.
+    Arguments
+        n_residues (int): Number of residues in pdb_lines, i.e. from count_residues
+            in a first pass over the input, default: None
+        See section_into_chains for the other arguments.
+    """
+    sectioning = ChainSectioning(residues_per_chain, n_chains, chain_names, n_residues)
+    lines = iter(pdb_lines)
+    line = next(lines, None)
+    while line is not None:
+        next_line = next(lines, None)
+        line_obj = parse_line(line)
         # erase counter in TER lines
         if line.startswith("TER"):
-            output_lines.append("TER \n")
+            yield "TER \n"
         # leave other non ATOM HEATATM lines unchanged
         elif not line_obj.is_atom:
-            output_lines.append(line)
+            yield line
         else:
-            res_counter += is_new_residue(line_obj)
-            # check if a new chain should start
-            if int(res_counter) > sum(residues_per_chain[: chain_counter + 1]):
-                chain_counter += 1
-                # check if the next line is a "TER" line, if not, add one
-                if not "TER" in pdb_lines[i + 1]:
-                    output_lines.append("TER \n")
-            line_obj["chainid"] = chain_names[chain_counter]
-            output_lines.append(line_obj.get_line())
-    return output_lines
+            # check if the next line is a "TER" line, if not, add one
+            if sectioning(line_obj) and (next_line is None or "TER" not in next_line):
+                yield "TER \n"
+            yield line_obj.get_line()
+        line = next_line
+    sectioning.finish()
+
+
+def section_into_chains(
+    pdb_lines, residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase
+):
+    """Define a given number of residues into a chain. Chains are identified
+    by upper case letters in alphabetical order. Does not change residue numbering.
+    Checks that a 'TER' line is inserted after a chain finishes.
+    Arguments
+        pdblines (list of str or PDBTable): List containing the pdb lines to be changed.
+            A PDBTable or MappedPDB is processed with modify_table.section_into_chains.
+            Multi-model files are processed model by model, see apply_per_model.
+        residues_per_chain (list of ints or int): Number of residues per chain.
+            If int, all chains get the same number of residues
+            If list, runs through the list and assigns a chain for each
+            integer in the list with that number of residues.
+        n_chains (int): Number of chains of equal length, used if residues_per_chain is None.
+        chain_names (list of str): List of chain names to be used. Must be at least
+            as long as the number of chains that are defined by n_lines / residues_per_chain.
+            default: string.ascii_uppercase
+    """
+    table = as_table(pdb_lines)
+    if table is not None:
+        from write_pdb import modify_table
+        return modify_table.section_into_chains(
+            table, residues_per_chain, n_chains, chain_names
+        )
+    return apply_per_model(
+        lambda lines: section_model(lines, residues_per_chain, n_chains, chain_names), pdb_lines
+    )
+
+
+def section_model(pdb_lines, residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase):
+    """section_into_chains for the lines of a single model."""
+    # we count the number of residues by iterating through all lines
+    # where a new residue starts when either the resid or the resname changes
+    n_residues = count_residues(pdb_lines)
+    import logging
+    logging.getLogger(__name__).debug("Input residues_per_chain=%s, computed n_residues=%s", residues_per_chain, n_residues)
+    return list(iter_section_into_chains(
+        pdb_lines, residues_per_chain, n_chains, chain_names, n_residues
+    ))
@@ -0,0 +1,313 @@
+import string
+import numpy as np
+from write_pdb.pdbtable import PDBTable, as_text
+# checks the input of both versions of section_into_chains
+from write_pdb.modify_pdb import get_residues_per_chain
+from write_pdb.models import model_ranges, is_frame_line
+
+
+def segment_starts(starts):
+    """ Given a mask of segment starts, return for every element the index
+    where its segment starts. The first element always starts a segment.
+    """
+    return np.maximum.accumulate(np.where(starts, np.arange(len(starts)), 0))
+
+
+def count_from_starts(starts):
+    """ Given a mask of segment starts, return a counter that runs from 1
+    within each segment.
+    """
+    return np.arange(len(starts)) - segment_starts(starts) + 1
+
+
+def erase_ter_lines(table, ter_line):
+    """ Replace all TER lines of the table in place with ter_line. """
+    table.other_lines = [
+        ter_line if as_text(line).startswith('TER') else line for line in table.other_lines
+    ]
+
+
+def model_spans(table):
+    """ Models of a multi-model table as (atom_start, atom_end, other_start,
+    other_end) of their atom records and of their other lines between MODEL
+    and ENDMDL, see models.model_ranges. Empty if there is no MODEL line.
+    """
+    n_other = len(table.other_lines)
+    def atoms_before(other_idx):
+        return int(table.other_after[other_idx]) if other_idx < n_other else len(table)
+    # the MODEL line is the other line before body_start
+    return [
+        (atoms_before(body_start - 1), atoms_before(body_end), body_start, body_end)
+        for body_start, body_end in model_ranges([as_text(line) for line in table.other_lines])
+    ]
+
+
+def apply_per_model(transform, table, drop_other=False):
+    """ Run transform on the atom records and lines of every model of a
+    multi-model table, as modify_pdb.apply_per_model. MODEL, ENDMDL and the
+    lines outside of the models are kept as they are.
+    Arguments:
+        transform (callable): Takes the table of a model, returns a new table.
+        table (PDBTable): The whole file.
+        drop_other (bool): Drop the other lines outside of the models but
+            MODEL and ENDMDL, see modify_pdb.apply_per_model.
+    """
+    spans = model_spans(table)
+    if not spans:
+        return transform(table)
+
+    def outside(piece):
+        if not drop_other:
+            return piece
+        keep = [i for i, line in enumerate(piece.other_lines) if is_frame_line(line)]
+        return PDBTable(piece.buffer, [piece.other_lines[i] for i in keep], piece.other_after[keep])
+
+    pieces = []
+    prev_atom, prev_other = 0, 0
+    for atom_start, atom_end, other_start, other_end in spans:
+        pieces.append(outside(table.take(prev_atom, atom_start, prev_other, other_start)))
+        pieces.append(transform(table.take(atom_start, atom_end, other_start, other_end)))
+        prev_atom, prev_other = atom_end, other_end
+    pieces.append(outside(table.take(prev_atom, len(table), prev_other, len(table.other_lines))))
+    return PDBTable.concatenate(pieces)
+
+
+def atom_numbering_scan(chainid, restart_atomid_per_chain=True, carry=(None, 1)):
+    """Atom ids of consecutive atom records, as assigned by fix_atom_numbering.
+    Arguments:
+        chainid (np.ndarray of bytes): Chainid field of the atom records.
+        restart_atomid_per_chain (bool): See fix_atom_numbering.
+        carry (tuple): State after the preceding atom records, (chainid of the
+            previous record or None, next atom id), default: start of a file.
+    Returns:
+        atomid (np.ndarray of int), carry after the last record.
+    """
+    prev_chainid, next_atomid = carry
+    n_atoms = len(chainid)
+    if not n_atoms:
+        return np.zeros(0, dtype=np.int64), carry
+    if restart_atomid_per_chain:
+        starts = np.zeros(n_atoms, dtype=bool)
+        starts[1 : ] = chainid[1 : ] != chainid[ : -1]
+        starts[0] = prev_chainid is not None and chainid[0] != prev_chainid
+        atomid = count_from_starts(starts)
+        # the records before the first new chain continue the previous count
+        n_continued = int(starts.argmax()) if starts.any() else n_atoms
+        atomid[ : n_continued] += next_atomid - 1
+    else:
+        atomid = next_atomid + np.arange(n_atoms)
+    return atomid, (chainid[-1], int(atomid[-1]) + 1)
+
+
+def residue_numbering_scan(resname, chainid, is_ca, restart_resid_per_chain=False, carry=(None, 1, False, None)):
+    """Resids of consecutive atom records, as assigned by fix_residue_numbering.
+    Arguments:
+        resname, chainid (np.ndarray of bytes): Fields of the atom records.
+        is_ca (np.ndarray of bool): Mask of CA atoms.
+        restart_resid_per_chain (bool): See fix_residue_numbering.
+        carry (tuple): State after the preceding atom records, (resname of the
+            previous record or None, its resid, if its stretch of the same resname
+            has a CA atom, reference chain of IsNewChain or None), default: start
+            of a file that does not start with an atom record.
+    Returns:
+        resid (np.ndarray of int), carry after the last record.
+    """
+    resname_cache, res_counter, found_ca, reference_chain = carry
+    n_atoms = len(resname)
+    if not n_atoms:
+        return np.zeros(0, dtype=np.int64), carry
+    new_resname = np.zeros(n_atoms, dtype=bool)
+    new_resname[1 : ] = resname[1 : ] != resname[ : -1]
+    new_resname[0] = resname_cache is not None and resname[0] != resname_cache
+    # every stretch of the same resname may only contain a single CA atom
+    stretch = np.cumsum(new_resname)
+    n_ca = np.bincount(stretch[is_ca], minlength=stretch[-1] + 1)
+    n_ca[0] += found_ca
+    if n_ca.max() > 1:
+        raise ValueError(
+            "Multiple CA atoms found in residue, probably due to "
+            "Two residues with the same resname next to each other. "
+            "Please fix this manually. "
+            )
+    starts = np.zeros(n_atoms, dtype=bool)
+    change_idxs = np.flatnonzero(new_resname)
+    if restart_resid_per_chain and len(change_idxs):
+        # IsNewChain is only asked when the resname changes, so the reference
+        # chain is the one of the last resname change, or of the first line
+        reference = np.empty(len(change_idxs), dtype=chainid.dtype)
+        reference[0] = b'' if reference_chain is None else reference_chain
+        reference[1 : ] = chainid[change_idxs[ : -1]]
+        starts[change_idxs[chainid[change_idxs] != reference]] = True
+        reference_chain = chainid[change_idxs[-1]]
+    resid = res_counter + stretch
+    if starts.any():
+        first_start = int(starts.argmax())
+        restarted = stretch - stretch[segment_starts(starts)] + 1
+        resid[first_start : ] = restarted[first_start : ]
+    carry = (resname[-1], int(resid[-1]), bool(n_ca[stretch[-1]]), reference_chain)
+    return resid, carry
+
+
+def new_residue_scan(resid, resname, carry=(None, None)):
+    """Mask of consecutive atom records that start a new residue, i.e. where
+    either resid or resname changes, as in IsNewResidue.
+    Arguments:
+        resid, resname (np.ndarray): Fields of the atom records.
+        carry (tuple): (resid, resname) of the previous atom record, default: None
+    Returns:
+        mask (np.ndarray of bool), carry after the last record.
+    """
+    if not len(resid):
+        return np.zeros(0, dtype=bool), carry
+    mask = np.ones(len(resid), dtype=bool)
+    mask[1 : ] = (resid[1 : ] != resid[ : -1]) | (resname[1 : ] != resname[ : -1])
+    prev_resid, prev_resname = carry
+    mask[0] = prev_resid is None or resid[0] != prev_resid or resname[0] != prev_resname
+    return mask, (resid[-1], resname[-1])
+
+
+def fix_atom_numbering(table, restart_atomid_per_chain=True):
+    """Vectorized version of modify_pdb.fix_atom_numbering for a PDBTable.
+    Returns a copy of table.
+    Multi-model tables are processed model by model, see apply_per_model.
+    Arguments:
+        table (PDBTable): Pdb file to be changed.
+        restart_atomid_per_chain (bool): Restart the atom numbering at 1 when a
+            new chain begins or number starting at the beginning of the file to the end
+            default: True
+    """
+    return apply_per_model(
+        lambda model: fix_atom_numbering_chunk(model, restart_atomid_per_chain)[0], table
+    )
+
+
+def fix_atom_numbering_chunk(table, restart_atomid_per_chain=True, carry=(None, 1)):
+    """fix_atom_numbering for a chunk of a file, continuing from carry,
+    see atom_numbering_scan. Returns a copy of table and the carry after it.
+    """
+    output = table.copy()
+    atomid, carry = atom_numbering_scan(output.records['chainid'], restart_atomid_per_chain, carry)
+    output.atomid = atomid
+    # PDBLINE.from_line erases the counter in TER lines
+    erase_ter_lines(output, 'TER\n')
+    return output, carry
+
+
+def fix_residue_numbering(table, restart_resid_per_chain=False):
+    """Vectorized version of modify_pdb.fix_residue_numbering for a PDBTable.
+    Like the line based version, a new residue starts when the resname changes
+    and all non atom lines are dropped. Returns a copy of table.
+    Multi-model tables are processed model by model, see apply_per_model.
+    Arguments:
+        table (PDBTable): Pdb file to be changed.
+        restart_resid_per_chain (bool): Restart the residue numbering at 1 when a
+            new chain begins, default: False
+    """
+    return apply_per_model(
+        lambda model: fix_model_residues(model, restart_resid_per_chain), table, drop_other=True
+    )
+
+
+def fix_model_residues(table, restart_resid_per_chain=False):
+    """ fix_residue_numbering for the table of a single model. """
+    first_line_is_atom = len(table) and (not len(table.other_after) or table.other_after[0] > 0)
+    reference_chain = table.records['chainid'][0] if first_line_is_atom else None
+    carry = (None, 1, False, reference_chain)
+    return fix_residue_numbering_chunk(table, restart_resid_per_chain, carry)[0]
+
+
+def fix_residue_numbering_chunk(table, restart_resid_per_chain=False, carry=(None, 1, False, None)):
+    """fix_residue_numbering for a chunk of a file, continuing from carry,
+    see residue_numbering_scan. Returns a copy of table and the carry after it.
+    """
+    output = PDBTable(table.buffer.copy())
+    records = output.records
+    is_ca = np.char.strip(records['atomname']) == b'CA'
+    resid, carry = residue_numbering_scan(
+        records['resname'], records['chainid'], is_ca, restart_resid_per_chain, carry
+    )
+    output.resid = resid
+    return output, carry
+
+
+def write_positions(table, positions, idx_start=0, idx_end='inf'):
+    """Vectorized version of modify_pdb.write_positions for a PDBTable.
+    Unlike the line based version, idx_start and idx_end count atom records only.
+    Arguments
+        table (PDBTable): Pdb file to be changed.
+        positions (np.ndarray (-1, 3)): Positions to be written into the pdb.
+        idx_start (int): Index of first atom to be changed, 0-based
+            default: 0; incluse
+        idx_end (int): Index where to end changing pos, 0-based
+            default: int(1e99); exclusive
+    """
+    if idx_end == 'inf':
+        idx_end = len(table)
+    output = table.copy()
+    output.set_positions(positions, idx_start, idx_end)
+    return output
+
+
+def section_into_chains(
+    table, residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase
+):
+    """Vectorized version of modify_pdb.section_into_chains for a PDBTable.
+    Returns a copy of table.
+    Multi-model tables are processed model by model, see apply_per_model.
+    Arguments
+        table (PDBTable): Pdb file to be changed.
+        residues_per_chain, n_chains, chain_names: see modify_pdb.section_into_chains.
+    """
+    return apply_per_model(
+        lambda model: section_model(model, residues_per_chain, n_chains, chain_names), table
+    )
+
+
+def section_model(table, residues_per_chain, n_chains=None, chain_names=string.ascii_uppercase):
+    """ section_into_chains for the table of a single model. """
+    new_residue, __ = new_residue_scan(table.records['resid'], table.records['resname'])
+    residues_per_chain = get_residues_per_chain(
+        int(new_residue.sum()), residues_per_chain, n_chains, chain_names
+    )
+    return section_chunk(table, new_residue, np.cumsum(residues_per_chain), chain_names)[0]
+
+
+def section_chunk(table, new_residue, chain_ends, chain_names, carry=(0, None), next_line_has_ter=False):
+    """section_into_chains for a chunk of a file, continuing from carry.
+    Arguments
+        table (PDBTable): Chunk to be changed.
+        new_residue (np.ndarray of bool): Atom records starting a new residue,
+            from new_residue_scan.
+        chain_ends (np.ndarray of int): Running number of residues at which each chain ends.
+        chain_names (list of str): See section_into_chains.
+        carry (tuple): State after the preceding atom records, (number of residues,
+            chain index of the previous atom record or None), default: start of a file.
+        next_line_has_ter (bool): If the line after the chunk is a TER line.
+    Returns:
+        Copy of table and the carry after it.
+    """
+    output = table.copy()
+    erase_ter_lines(output, 'TER \n')
+    if not len(output):
+        return output, carry
+    # chain index of every atom record from its running residue count
+    res_counter = carry[0] + np.cumsum(new_residue)
+    chain_idx = np.searchsorted(chain_ends, res_counter, side='left')
+    output.chainid = np.array(list(chain_names), dtype=str)[chain_idx]
+    prev_chain_idx = np.empty_like(chain_idx)
+    prev_chain_idx[1 : ] = chain_idx[ : -1]
+    prev_chain_idx[0] = chain_idx[0] if carry[1] is None else carry[1]
+    # add a TER line before every new chain, unless the next line is a TER line
+    ter_after = []
+    for atom_idx in np.flatnonzero(chain_idx != prev_chain_idx):
+        following = np.flatnonzero(table.other_after == atom_idx + 1)
+        if len(following):
+            next_has_ter = 'TER' in as_text(table.other_lines[following[0]])
+        elif atom_idx + 1 < len(table):
+            next_has_ter = b'TER' in table.buffer[atom_idx + 1].tobytes()
+        else:
+            next_has_ter = next_line_has_ter
+        if not next_has_ter:
+            ter_after.append(atom_idx)
+    output.insert_lines(ter_after, len(ter_after) * ['TER \n'])
+    return output, (int(res_counter[-1]), int(chain_idx[-1]))
@@ -0,0 +1,504 @@
+import os
+import mmap
+import string
+import itertools
+import collections
+import multiprocessing
+import numpy as np
+from write_pdb import codec, modify_table
+from write_pdb.compression import detect_compression, open_input, iter_line_blocks
+from write_pdb.fileio import replace_on_success
+from write_pdb.models import find_models, has_models, select_models
+from write_pdb.pdbtable import PDBTable, FIELD_COLUMNS, RECORD_WIDTH, GAP_COLUMNS
+from write_pdb.stats import PipelineStats, measure
+
+
+# chunks are at least this many bytes, smaller files use fewer chunks
+MIN_CHUNK_BYTES = 1 << 20
+# chunks per job, more chunks balance the load between the processes
+CHUNKS_PER_JOB = 4
+
+
+def chunk_bounds(filename, n_chunks, min_chunk_bytes=MIN_CHUNK_BYTES):
+    """Split a file into at most n_chunks byte ranges that start at line boundaries.
+    Returns a list of (start, end), end exclusive.
+    """
+    size = os.path.getsize(filename)
+    if not size:
+        return []
+    n_chunks = max(1, min(n_chunks, size // min_chunk_bytes))
+    bounds = [0]
+    with open(filename, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for i in range(1, n_chunks):
+            newline = data.find(b'\n', max(bounds[-1], i * size // n_chunks))
+            if newline == -1 or newline + 1 == size:
+                break
+            if newline + 1 > bounds[-1]:
+                bounds.append(newline + 1)
+    bounds.append(size)
+    return list(zip(bounds[ : -1], bounds[1 : ]))
+
+
+def imap_bounded(pool, func, tasks, n_ahead):
+    """Pool.imap, which only sends n_ahead tasks ahead of the results, so
+    that tasks which carry their data do not pile up in memory.
+    """
+    tasks = iter(tasks)
+    pending = collections.deque(pool.apply_async(func, (task, )) for task in itertools.islice(tasks, n_ahead))
+    while pending:
+        result = pending.popleft().get()
+        pending.extend(pool.apply_async(func, (task, )) for task in itertools.islice(tasks, 1))
+        yield result
+
+
+class ChunkedPipeline:
+    """
+    Run the transformations of the CLI on byte ranges of a file in a pool of
+    processes, giving the same output as FusedPipeline.
+    Each transformation is a scan whose state (the carry) after a record only
+    depends on the previous state, see modify_table. The first, cheap pass
+    collects the few columns the scans need from every chunk in parallel, the
+    main process folds the scans over them to get the carry at the start of
+    every chunk, and the second pass transforms the chunks in parallel starting
+    from their carries. The chunks are written in file order.
+    Compressed files can not be split by offset, they are decompressed in the
+    main process, once per pass, and their blocks are sent to the workers.
+    """
+
+    def __init__(
+        self,
+        kick=None,
+        fix_atom_numbering=False,
+        fix_residue_numbering=False,
+        residues_per_chain=None,
+        n_chains=None,
+        chain_names=string.ascii_uppercase,
+        restart_atomid_per_chain=True,
+        restart_resid_per_chain=False,
+        jobs=None,
+        min_chunk_bytes=MIN_CHUNK_BYTES,
+        stats=None,
+    ):
+        """Arguments:
+        kick, fix_atom_numbering, fix_residue_numbering, residues_per_chain,
+            n_chains, chain_names: See FusedPipeline.
+        jobs (int): Number of processes, default: os.cpu_count()
+        min_chunk_bytes (int): Lower bound of the chunk size.
+        stats (PipelineStats): Record the time per stage, the stages of the
+            worker processes are added up, default: None
+        """
+        self.kick = kick.encode('utf-8') if kick else None
+        self.fix_atom_numbering = fix_atom_numbering
+        self.fix_residue_numbering = fix_residue_numbering
+        self.section = residues_per_chain is not None or n_chains is not None
+        self.residues_per_chain = residues_per_chain
+        self.n_chains = n_chains
+        self.chain_names = chain_names
+        self.restart_atomid_per_chain = restart_atomid_per_chain
+        self.restart_resid_per_chain = restart_resid_per_chain
+        self.jobs = jobs or os.cpu_count()
+        self.min_chunk_bytes = min_chunk_bytes
+        self.stats = stats
+        self.collect_stats = stats is not None
+
+    def __getstate__(self):
+        # worker processes record into their own stats, see transform_chunk
+        state = self.__dict__.copy()
+        state['stats'] = None
+        return state
+
+    @property
+    def parse(self):
+        """If the atom records are changed, else lines are only kicked."""
+        return self.fix_atom_numbering or self.fix_residue_numbering or self.section
+
+    def read_bytes(self, filename, start, end, stats=None):
+        """Read the bytes start to end of filename, which may also be the
+        bytes of a decompressed block themselves, see iter_blocks.
+        """
+        if isinstance(filename, bytes):
+            return filename[start : end]
+        with measure(stats, 'read', bytes_in=end - start):
+            with open(filename, 'rb') as fh:
+                fh.seek(start)
+                return fh.read(end - start)
+
+    def split_block(self, data, stats=None):
+        """Bounds (starts, ends, kinds) of the lines of a block of whole lines,
+        without the kicked lines. data has to have \n line endings, see
+        codec.normalize_newlines.
+        """
+        starts, ends = codec.line_bounds(data)
+        if self.kick:
+            with measure(stats, 'kick', records=len(starts)):
+                keep = ~codec.contains_mask(data, starts, ends, self.kick)
+                starts, ends = starts[keep], ends[keep]
+        return starts, ends, codec.record_kinds(data, starts, ends)
+
+    def kick_block(self, data, stats=None):
+        """A block of whole lines without the kicked lines, else unchanged
+        except for \n line endings, as in text mode.
+        """
+        data = codec.normalize_newlines(data)
+        if not self.kick:
+            return bytes(data)
+        starts, ends, __ = self.split_block(data, stats)
+        return b''.join(data[line_start : line_end] for line_start, line_end in zip(starts, ends))
+
+    def decode_block(self, data, stats=None):
+        """Parse a block of whole lines into a PDBTable."""
+        data = codec.normalize_newlines(data)
+        bounds = self.split_block(data, stats)
+        with measure(stats, 'parse', records=len(bounds[0])):
+            return PDBTable(*codec.decode_records(
+                data, RECORD_WIDTH, GAP_COLUMNS, raw_other=True, bounds=bounds
+            ))
+
+    def scan_chunk(self, task):
+        """First pass over a chunk, given as (filename, start, end), see scan_block."""
+        return self.scan_block(self.read_bytes(*task))
+
+    def scan_block(self, data):
+        """Returns the columns the scans need from a block of whole lines and
+        what the neighbouring blocks need to know about its first line.
+        """
+        return self.summarize(self.decode_block(data))
+
+    def summarize(self, table):
+        """The summary of scan_block, from the parsed, untransformed block."""
+        records = table.records
+        first_is_other = len(table.other_after) and table.other_after[0] == 0
+        # first line that arrives at the sectioning, where non atom lines are
+        # dropped by fix_residue_numbering
+        if first_is_other and not self.fix_residue_numbering:
+            first_line = table.other_lines[0]
+        elif len(table):
+            first_line = table.buffer[0].tobytes()
+        else:
+            first_line = None
+        return {
+            'chainid': records['chainid'].copy(),
+            'resname': records['resname'].copy(),
+            'resid': records['resid'].copy(),
+            'is_ca': np.char.strip(records['atomname']) == b'CA',
+            'n_lines': table.n_lines,
+            'first_line_is_atom': bool(len(table)) and not first_is_other,
+            'first_line_has_ter': None if first_line is None else b'TER' in first_line,
+        }
+
+    def start_carries(self, first_summary=None):
+        """Carries at the start of the file, first_summary is that of the first
+        chunk with any lines.
+        """
+        # fix_residue_numbering compares to the chain of the first line, if it is an atom
+        reference_chain = None
+        if first_summary is not None and first_summary['first_line_is_atom']:
+            reference_chain = first_summary['chainid'][0]
+        return {
+            'atom': (None, 1), 'residue': (None, 1, False, reference_chain),
+            'count': (None, None), 'n_residues': 0,
+        }
+
+    def advance_carries(self, carry, summary):
+        """Carries after a chunk, given those at its start and its summary."""
+        carry = dict(carry)
+        if self.fix_atom_numbering:
+            __, carry['atom'] = modify_table.atom_numbering_scan(
+                summary['chainid'], self.restart_atomid_per_chain, carry['atom']
+            )
+        resid = summary['resid']
+        if self.fix_residue_numbering:
+            numbers, carry['residue'] = modify_table.residue_numbering_scan(
+                summary['resname'], summary['chainid'], summary['is_ca'],
+                self.restart_resid_per_chain, carry['residue'],
+            )
+            # residues are compared by their fields, as in IsNewResidue
+            start, end = FIELD_COLUMNS['resid']
+            resid = codec.format_int(numbers, end - start).view(resid.dtype).reshape(-1)
+        if self.section:
+            new_residue, carry['count'] = modify_table.new_residue_scan(
+                resid, summary['resname'], carry['count']
+            )
+            carry['n_residues'] += int(new_residue.sum())
+        return carry
+
+    def plan(self, summaries):
+        """Fold the scans over the columns of all chunks in order.
+        Returns the carries at the start of every chunk.
+        """
+        carry = self.start_carries(next((summary for summary in summaries if summary['n_lines']), None))
+        carries = []
+        for summary in summaries:
+            carries.append(carry)
+            carry = self.advance_carries(carry, summary)
+        n_residues = carry['n_residues']
+        if not self.section:
+            return carries
+        residues_per_chain = modify_table.get_residues_per_chain(
+            n_residues, self.residues_per_chain, self.n_chains, self.chain_names
+        )
+        chain_ends = np.cumsum(residues_per_chain)
+        next_line_has_ter = False
+        for carry, summary in reversed(list(zip(carries, summaries))):
+            # the chain of the last atom record before the chunk
+            prev_chain_idx = None
+            if carry['count'][0] is not None:
+                prev_chain_idx = int(np.searchsorted(chain_ends, carry['n_residues'], side='left'))
+            carry['section'] = (carry['n_residues'], prev_chain_idx)
+            carry['chain_ends'] = chain_ends
+            carry['next_line_has_ter'] = next_line_has_ter
+            if summary['first_line_has_ter'] is not None:
+                next_line_has_ter = summary['first_line_has_ter']
+        return carries
+
+    def transform_chunk(self, task):
+        """Second pass over a chunk, given as (filename, start, end, carry).
+        Returns the transformed chunk as bytes, and the stages recorded in a
+        worker process if stats are collected, see PipelineStats.as_dict.
+        """
+        stats = self.stats
+        if stats is None and self.collect_stats:
+            stats = PipelineStats()
+        block = self.transform_table(task, stats)
+        if stats is None or stats is self.stats:
+            return block, None
+        return block, stats.as_dict()
+
+    def transform_table(self, task, stats=None):
+        """Run all transformations on a chunk, see transform_chunk."""
+        filename, start, end, carry = task
+        return self.transform_block(self.read_bytes(filename, start, end, stats), carry, stats)
+
+    def transform_block(self, data, carry, stats=None):
+        """Run all transformations on a block of whole lines, starting from
+        carry, see plan. Returns the transformed block as bytes.
+        """
+        if not self.parse:
+            return self.kick_block(data, stats)
+        return self.transform_records(self.decode_block(data, stats), carry, stats)
+
+    def transform_records(self, table, carry, stats=None):
+        """transform_block for a block already parsed by decode_block."""
+        if self.fix_atom_numbering:
+            with measure(stats, 'fix_atom_numbering', records=len(table)):
+                table, __ = modify_table.fix_atom_numbering_chunk(
+                    table, self.restart_atomid_per_chain, carry['atom']
+                )
+        if self.fix_residue_numbering:
+            with measure(stats, 'fix_residue_numbering', records=len(table)):
+                table, __ = modify_table.fix_residue_numbering_chunk(
+                    table, self.restart_resid_per_chain, carry['residue']
+                )
+        if self.section:
+            with measure(stats, 'section_into_chains', records=len(table)):
+                new_residue, __ = modify_table.new_residue_scan(
+                    table.records['resid'], table.records['resname'], carry['count']
+                )
+                table, __ = modify_table.section_chunk(
+                    table, new_residue, carry['chain_ends'], self.chain_names,
+                    carry['section'], carry['next_line_has_ter'],
+                )
+        with measure(stats, 'render', records=table.n_lines) as stage:
+            block = b''.join(table.iter_blocks(binary=True))
+            stage.add(bytes_out=len(block))
+        return block
+
+    def iter_blocks(self, filename):
+        """Tasks of a compressed file, its decompressed blocks of whole lines
+        as (data, 0, len(data)), see read_bytes.
+        """
+        with open_input(filename) as fh:
+            blocks = iter_line_blocks(fh, self.min_chunk_bytes)
+            if self.stats is not None:
+                blocks = self.stats.iter_timed('read', blocks)
+            for data in blocks:
+                yield data, 0, len(data)
+
+    def run(self, filename, fh_out):
+        """Transform filename and write the result into the binary file fh_out."""
+        if detect_compression(filename) is not None:
+            def iter_tasks():
+                return self.iter_blocks(filename)
+            if self.jobs > 1:
+                with multiprocessing.Pool(self.jobs) as pool:
+                    def map_func(func, tasks):
+                        return imap_bounded(pool, func, tasks, self.jobs * CHUNKS_PER_JOB)
+                    self.write_chunks(iter_tasks, fh_out, map_func)
+            else:
+                self.write_chunks(iter_tasks, fh_out, map)
+            return
+        chunks = chunk_bounds(filename, self.jobs * CHUNKS_PER_JOB, self.min_chunk_bytes)
+        tasks = [(filename, start, end) for start, end in chunks]
+        if self.jobs > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(min(self.jobs, len(tasks))) as pool:
+                self.write_chunks(lambda: tasks, fh_out, pool.imap)
+        else:
+            self.write_chunks(lambda: tasks, fh_out, map)
+
+    def write_chunks(self, iter_tasks, fh_out, map_func):
+        """Run both passes over the tasks given by iter_tasks() with
+        map_func, i.e. map or Pool.imap.
+        """
+        if self.parse:
+            with measure(self.stats, 'scan') as stage:
+                summaries = list(map_func(self.scan_chunk, iter_tasks()))
+                stage.add(records=len(summaries))
+            with measure(self.stats, 'plan', records=len(summaries)):
+                carries = self.plan(summaries)
+        else:
+            carries = itertools.repeat(None)
+        tasks = (task + (carry, ) for task, carry in zip(iter_tasks(), carries))
+        for block, stages in map_func(self.transform_chunk, tasks):
+            if stages:
+                self.stats.merge(stages)
+            with measure(self.stats, 'write', records=1, bytes_in=len(block)):
+                fh_out.write(block)
+
+
+class ModelPipeline(ChunkedPipeline):
+    """
+    Run the transformations of the CLI on every model of a multi-model file
+    on its own, as if the lines between its MODEL and ENDMDL records were a
+    file, so that all counters start anew in every model. The models are
+    transformed in a pool of processes and written in file order. MODEL,
+    ENDMDL and all lines outside of the models are only kicked, and with
+    fix_residue_numbering only MODEL, ENDMDL and atom records are kept, as
+    in modify_pdb.apply_per_model. The models
+    are found by their offsets, see models.find_models, and only the selected
+    ones are read and parsed. A file without MODEL records is a single model,
+    which is transformed in one process.
+    """
+
+    def __init__(self, models=None, **kwargs):
+        """Arguments:
+        models (iterable of int): Models to write, counted from 1 in file
+            order, default: all, see models.parse_selection.
+        kwargs: Transformations, jobs and stats, see ChunkedPipeline.
+        """
+        super().__init__(**kwargs)
+        self.models = models
+        self.n_models = None
+
+    def transform_table(self, task, stats=None):
+        """Transform a model, given as (filename, start, end, body_start,
+        body_end), see models.find_models, starting from the carries at the
+        start of a file.
+        """
+        filename, start, end, body_start, body_end = task
+        data = self.read_bytes(filename, start, end, stats)
+        body = data[body_start - start : body_end - start]
+        if self.parse:
+            # the body is parsed once, for its plan and its transformation
+            table = self.decode_block(body, stats)
+            carry = self.plan([self.summarize(table)])[0]
+            body = self.transform_records(table, carry, stats)
+        else:
+            body = self.kick_block(body, stats)
+        return b''.join([
+            self.frame_block(data[ : body_start - start], stats),
+            body,
+            self.frame_block(data[body_end - start : ], stats),
+        ])
+
+    def frame_block(self, data, stats=None):
+        """Lines outside of the model bodies, kicked. fix_residue_numbering
+        drops all non atom lines, here all but MODEL and ENDMDL, see
+        modify_pdb.apply_per_model.
+        """
+        data = self.kick_block(data, stats)
+        if not self.fix_residue_numbering:
+            return data
+        starts, ends, kinds = self.split_block(data)
+        keep = np.isin(kinds, (codec.ATOM, codec.HETATM, codec.MODEL, codec.ENDMDL))
+        return b''.join(data[line_start : line_end] for line_start, line_end in zip(starts[keep], ends[keep]))
+
+    def run(self, filename, fh_out):
+        """Transform filename and write the result into the binary file fh_out."""
+        for block in self.iter_output(filename):
+            with measure(self.stats, 'write', records=1, bytes_in=len(block)):
+                fh_out.write(block)
+
+    def iter_output(self, filename):
+        """Yield the transformed content of filename as blocks of bytes, the
+        lines before the first model, every selected model and the lines after
+        the last model.
+        """
+        compressed = detect_compression(filename) is not None
+        models = []
+        size = 0
+        header = footer = b''
+        if compressed:
+            # compressed files can not be read by offset, the models are sent to the workers
+            with measure(self.stats, 'read') as stage, open_input(filename) as fh:
+                data = fh.read()
+                stage.add(bytes_in=len(data))
+            models, size = find_models(data), len(data)
+        elif os.path.getsize(filename):
+            with open(filename, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                models, size = find_models(data), len(data)
+                if models:
+                    header, footer = data[ : models[0][0]], data[models[-1][3] : ]
+        if compressed and models:
+            header, footer = data[ : models[0][0]], data[models[-1][3] : ]
+        if not models:
+            if self.models is not None:
+                raise ValueError(f'{filename} has no MODEL records to select from.')
+            # the whole file is a single model
+            models = [(0, 0, size, size)] if size else []
+        self.n_models = len(models)
+        # the lines between an ENDMDL record and the next MODEL record go with the model before
+        ranges = [
+            (start, next_model[0] if next_model else end, body_start, body_end)
+            for (start, body_start, body_end, end), next_model in zip(models, models[1 : ] + [None])
+        ]
+        ranges = [ranges[idx] for idx in select_models(len(models), self.models)]
+        if compressed:
+            tasks = [
+                (data[start : end], 0, end - start, body_start - start, body_end - start)
+                for start, end, body_start, body_end in ranges
+            ]
+        else:
+            tasks = [(filename, ) + model_range for model_range in ranges]
+        yield self.frame_block(header, self.stats)
+        yield from self.iter_models(self.transform_tasks(tasks))
+        yield self.frame_block(footer, self.stats)
+
+    def transform_tasks(self, tasks):
+        """Yield the results of transform_chunk for every model, given as tasks
+        of transform_table, in order, in a pool of processes if jobs > 1.
+        """
+        if self.jobs > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(min(self.jobs, len(tasks))) as pool:
+                yield from imap_bounded(pool, self.transform_chunk, tasks, self.jobs * CHUNKS_PER_JOB)
+        else:
+            yield from map(self.transform_chunk, tasks)
+
+    def iter_models(self, results):
+        """Yield the transformed models, given as results of transform_chunk."""
+        for block, stages in results:
+            if stages:
+                self.stats.merge(stages)
+            yield block
+
+
+def process_file(filename, save=None, jobs=None, stats=None, threads=None, models=None, **kwargs):
+    """Transform a pdb file in parallel, with the same result as the CLI.
+    Compressed files are read and written by their magic bytes or extension.
+    Multi-model files, or a selection of their models, are transformed model
+    by model, see ModelPipeline.
+    Arguments:
+        filename (str): Load name.
+        save (str): Save name, default: overwrite filename.
+        jobs (int): Number of processes, default: os.cpu_count()
+        stats (PipelineStats): Record the time per stage, default: None
+        threads (int): Threads that compress the output, default: os.cpu_count()
+        models (iterable of int): Models to write, counted from 1, default: all
+        kwargs: Transformations, see ChunkedPipeline.
+    """
+    if models is not None or has_models(filename):
+        pipeline = ModelPipeline(models=models, jobs=jobs, stats=stats, **kwargs)
+    else:
+        pipeline = ChunkedPipeline(jobs=jobs, stats=stats, **kwargs)
+    with replace_on_success(save or filename, threads=threads) as fh_out:
+        pipeline.run(filename, fh_out)
+    return pipeline
@@ -0,0 +1,189 @@
+# Standart pdb definition, changed to make it zero based and compatible
+# with python indexing by subtracting one from the left index.
+# Shared by PDBRecord, PDBLINE and PDBTable.
+FIELD_TEMPLATES = {
+    'type':        ([0, 6],     '“ATOM”',		                     'character'),
+    'atomid':      ([6, 11],	'Atom serial number	right',	         'integer'),
+    'atomname':    ([12, 16],	'Atom name	left',	                 'character'),
+    'altlocid':    ([16, 17],   'Alternate location indicator',	     'character'),
+    'resname':     ([17, 20],	'Residue name	right',	             'character'),
+    'chainid':     ([21, 22],   'Chain identifier',		             'character'),
+    'resid':       ([22, 26],	'Residue sequence number	right',	 'integer'),
+    'code':        ([26, 27],   'Code for insertions of residues',	 'character'),
+    'posx':        ([30, 38],	'X orthogonal A coordinate	right',  'real (8.3)'),
+    'posy':        ([38, 46],	'Y orthogonal A coordinate	right',  'real (8.3)'),
+    'posz':        ([46, 54],	'Z orthogonal A coordinate	right',  'real (8.3)'),
+    'occupancy':   ([54, 60],	'Occupancy	right',	                 'real (6.2)'),
+    'tempfact':    ([60, 66],	'Temperature factor	right',	         'real (6.2)'),
+    'segid':       ([72, 76],	'Segment identifier	left',	         'character'),
+    'element':     ([76, 78],	'Element symbol	right',	             'character'),
+}
+# column layout, zero based, right index exclusive
+COLUMNS = {key: tuple(columns) for key, (columns, __, __) in FIELD_TEMPLATES.items()}
+RECORD_WIDTH = 79
+# type of the value of every field, others are str
+INT_FIELDS = ('atomid', 'resid')
+FLOAT_FORMATS = {
+    'posx': '.3f', 'posy': '.3f', 'posz': '.3f', 'occupancy': '.2f', 'tempfact': '.2f',
+}
+
+
+def get_runs(columns, width=RECORD_WIDTH):
+    """Group the fields into runs of adjacent columns. Returns a list of
+    (start, end, fields, gap), with the fields of the run as (key, start, end)
+    and the blank gap that follows it.
+    """
+    runs = []
+    for key, (start, end) in sorted(columns.items(), key=lambda item: item[1]):
+        if runs and runs[-1][1] == start:
+            runs[-1][1] = end
+            runs[-1][2].append((key, start, end))
+        else:
+            runs.append([start, end, [(key, start, end)]])
+    gaps = [next_run[0] - run[1] for run, next_run in zip(runs, runs[1 : ])] + [width - runs[-1][1]]
+    return [(start, end, tuple(fields), ' ' * gap) for (start, end, fields), gap in zip(runs, gaps)]
+
+
+def pad_field(key, item):
+    """str(item) right aligned in the columns of field key. Raises a
+    ValueError if it does not fit.
+    """
+    start, end = COLUMNS[key]
+    item = str(item)
+    if len(item) > end - start:
+        raise ValueError(f'{item} does not fit into the {end - start} columns of {key}.')
+    return item.rjust(end - start)
+
+
+def is_atom_line(line):
+    """If a line is an ATOM or HETATM record, the only lines that are parsed."""
+    return line[ : 6].strip() in ('ATOM', 'HETATM')
+
+
+def other_text(line):
+    """Text of a line that is not an atom record, with the counter of TER lines erased."""
+    return 'TER\n' if line.startswith('TER') else line
+
+
+class PDBRecord:
+    """
+    Lightweight record of a single pdb line, the per-line counterpart of a
+    row of PDBTable. Only the line is stored, fields are sliced from it when
+    accessed and changed fields are kept apart until the line is rendered.
+    Supports the item access of PDBLINE with the padded field strings, and
+    typed attributes: ints for atomid and resid, floats for the positions,
+    occupancy and tempfact, stripped str for the others. Lines that are not
+    ATOM or HETATM records are not parsed at all.
+    """
+    __slots__ = ('line', 'fields', 'is_atom')
+    columns = COLUMNS
+    runs = get_runs(COLUMNS)
+
+    def __init__(self, line, is_atom=True):
+        """Arguments:
+        line (str): The line, atom records at least RECORD_WIDTH long.
+        is_atom (bool): If the line is an ATOM or HETATM record.
+        """
+        self.line = line
+        self.fields = None
+        self.is_atom = is_atom
+
+    @classmethod
+    def from_line(cls, pdb_line):
+        """Construct a record from a full pdb line given as a str, see PDBLINE.from_line."""
+        if not is_atom_line(pdb_line):
+            return cls(other_text(pdb_line), False)
+        if len(pdb_line) < RECORD_WIDTH:
+            pdb_line += ' ' * (RECORD_WIDTH - len(pdb_line))
+        return cls(pdb_line)
+
+    @property
+    def input_line(self):
+        return self.line
+
+    def __getitem__(self, key):
+        """Field as the padded str, as in PDBLINE."""
+        if self.fields and key in self.fields:
+            return self.fields[key]
+        start, end = self.columns[key]
+        return self.line[start : end]
+
+    def __setitem__(self, key, item):
+        """Set a field to str(item), right aligned, see pad_field."""
+        if self.fields is None:
+            self.fields = {}
+        self.fields[key] = pad_field(key, item)
+
+    def get_line(self, pad_with=' \n'):
+        """Render the record, same output as PDBLINE.get_line. Lines that are
+        not atom records are returned unmodified.
+        """
+        if not self.is_atom:
+            return self.line
+        line = self.line
+        pieces = []
+        for start, end, __, gap in self.runs:
+            pieces.append(line[start : end])
+            pieces.append(gap)
+        if self.fields:
+            # the runs put every field at its columns, so changed fields are spliced in
+            line = ''.join(pieces)
+            columns = self.columns
+            for key, item in self.fields.items():
+                start, end = columns[key]
+                line = line[ : start] + item + line[end : ]
+            return line + pad_with
+        pieces.append(pad_with)
+        return ''.join(pieces)
+
+    def set_positions(self, pos):
+        """Set the position of the atom, in the 8.3 format."""
+        self.posx, self.posy, self.posz = pos
+
+    def to_pdbline(self):
+        """The record as PDBLINE."""
+        from write_pdb.pdbline import PDBLINE
+        return PDBLINE.from_line(self.get_line() if self.is_atom else self.line)
+
+    def __repr__(self):
+        return self.get_line().strip('\n')
+
+
+def field_property(key):
+    """Typed attribute for the field key of PDBRecord."""
+    if key in INT_FIELDS:
+        def parse(text):
+            return int(text) if text.strip() else None
+        render = str
+    elif key in FLOAT_FORMATS:
+        def parse(text):
+            return float(text) if text.strip() else None
+        render = ('{:' + FLOAT_FORMATS[key] + '}').format
+    else:
+        parse = str.strip
+        render = str
+
+    def getter(self):
+        return parse(self[key])
+
+    def setter(self, value):
+        self[key] = render(value)
+
+    return property(getter, setter, doc=f'Field {key} of the record.')
+
+
+for _key in COLUMNS:
+    setattr(PDBRecord, _key, field_property(_key))
+del _key
+
+
+# all lines that are not atom records share this record, as the per-line steps
+# only check is_atom on them, and it is never changed nor rendered
+OTHER_RECORD = PDBRecord('', is_atom=False)
+
+
+def parse_line(line):
+    """PDBRecord of an atom record, OTHER_RECORD for all other lines, whose
+    text is other_text(line). Creates no object for lines that are not atoms.
+    """
+    return PDBRecord.from_line(line) if is_atom_line(line) else OTHER_RECORD
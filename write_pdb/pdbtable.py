@@ -0,0 +1,322 @@
+import io
+import numpy as np
+from write_pdb import codec
+from write_pdb.compression import open_input, compression_from_name, open_output
+from write_pdb.pdbline import PDBLINE
+# same test as in PDBLINE.from_line
+from write_pdb.pdbrecord import is_atom_line
+
+
+# column layout of the ATOM and HETATM records, taken from PDBLINE so that
+# both representations stay in sync. Zero based, right index exclusive.
+FIELD_COLUMNS = {
+    key: tuple(columns) for key, (columns, __, __) in PDBLINE(None).field_templates.items()
+}
+# PDBLINE.get_line renders 79 columns before the line ending
+RECORD_WIDTH = 79
+RECORD_DTYPE = np.dtype({
+    'names': list(FIELD_COLUMNS),
+    'formats': [f'S{end - start}' for start, end in FIELD_COLUMNS.values()],
+    'offsets': [start for start, __ in FIELD_COLUMNS.values()],
+    'itemsize': RECORD_WIDTH,
+})
+# columns not covered by any field, PDBLINE.get_line leaves them empty
+GAP_COLUMNS = np.array(sorted(
+    set(range(RECORD_WIDTH))
+    - {idx for start, end in FIELD_COLUMNS.values() for idx in range(start, end)}
+))
+
+
+def as_text(line):
+    """ Return a passthrough line as str, lines from a mapped file are kept as bytes. """
+    return line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def as_bytes(line):
+    """ Return a passthrough line as bytes. """
+    return line if isinstance(line, bytes) else line.encode('utf-8')
+
+
+class PDBTable:
+    """
+    A whole pdb file, with the ATOM and HETATM records stored column wise.
+    The atom records live in a single structured array with one fixed-width
+    byte field per column (see FIELD_COLUMNS), so that transformations work on
+    entire columns at once and never create per-line objects. All other lines
+    (REMARK, TER, ...) are passed through as they are, together with the number
+    of atom records preceding them in the file. Passthrough lines are str, or
+    bytes when read from a MappedPDB, which are copied to binary output as they are.
+    """
+    def __init__(self, buffer, other_lines=(), other_after=()):
+        """ Construct from already parsed data, see PDBTable.from_lines.
+        Arguments:
+            buffer (np.ndarray (-1, RECORD_WIDTH) of np.uint8): The atom records
+                as fixed-width bytes, with empty GAP_COLUMNS.
+            other_lines (list of str or bytes): All lines that are not atom records.
+            other_after (iterable of int): For each of other_lines, the number of
+                atom records that come before it in the file.
+        """
+        self.buffer = buffer
+        # copies of structured arrays do not keep the bytes between fields,
+        # so the table owns the plain byte buffer and records is only a view
+        self.records = buffer.view(RECORD_DTYPE).reshape(-1)
+        self.other_lines = list(other_lines)
+        self.other_after = np.asarray(other_after, dtype=np.int64)
+        assert len(self.other_lines) == len(self.other_after)
+
+    @classmethod
+    def from_lines(cls, pdb_lines):
+        """ Parse an iterable of pdb lines, i.e. an open file, into a PDBTable. """
+        atom_lines = []
+        other_lines = []
+        other_after = []
+        for line in pdb_lines:
+            if is_atom_line(line):
+                # pad or cut line to the record width, as in PDBLINE.from_line
+                atom_lines.append(line[ : RECORD_WIDTH].ljust(RECORD_WIDTH))
+            else:
+                other_lines.append(line)
+                other_after.append(len(atom_lines))
+        buffer = np.frombuffer(''.join(atom_lines).encode('latin-1'), dtype=np.uint8)
+        buffer = buffer.reshape(-1, RECORD_WIDTH).copy()
+        buffer[:, GAP_COLUMNS] = ord(' ')
+        return cls(buffer, other_lines, other_after)
+
+    @classmethod
+    def from_bytes(cls, data, kick=None):
+        """ Parse the content of a whole pdb file with the vectorized codec,
+        without creating a str per atom record. Lines containing kick (str)
+        are dropped, as in modify_pdb.kick_lines.
+        """
+        if kick is None:
+            return cls(*codec.decode_records(data, RECORD_WIDTH, GAP_COLUMNS))
+        data = codec.normalize_newlines(data)
+        starts, ends = codec.line_bounds(data)
+        keep = ~codec.contains_mask(data, starts, ends, kick.encode('utf-8'))
+        starts, ends = starts[keep], ends[keep]
+        bounds = (starts, ends, codec.record_kinds(data, starts, ends))
+        return cls(*codec.decode_records(data, RECORD_WIDTH, GAP_COLUMNS, bounds=bounds))
+
+    @classmethod
+    def from_mapped(cls, mapped):
+        """ Build a PDBTable from a MappedPDB, reusing its line index. The atom
+        records are copied into the table, the other lines are kept as raw bytes.
+        """
+        return cls(*codec.decode_records(
+            mapped.data, RECORD_WIDTH, GAP_COLUMNS, raw_other=True,
+            bounds=(mapped.starts, mapped.ends, mapped.kinds),
+        ))
+
+    @classmethod
+    def from_file(cls, filename, kick=None):
+        """ Load a pdb file into a PDBTable, compressed files are decompressed.
+        Lines containing kick are dropped, see from_bytes.
+        """
+        with open_input(filename) as fh:
+            return cls.from_bytes(fh.read(), kick)
+
+    def __len__(self):
+        """ Number of atom records. """
+        return len(self.records)
+
+    @property
+    def n_lines(self):
+        """ Number of lines when written out. """
+        return len(self.records) + len(self.other_lines)
+
+    def copy(self):
+        """ Return a deep copy of the table. """
+        return PDBTable(self.buffer.copy(), self.other_lines, self.other_after.copy())
+
+    def take(self, atom_start, atom_end, other_start, other_end):
+        """ Return the part of the file made of the atom records atom_start to
+        atom_end and the other lines other_start to other_end (exclusive),
+        which have to follow each other in the file. Shares the atom records
+        with the table.
+        """
+        return PDBTable(
+            self.buffer[atom_start : atom_end], self.other_lines[other_start : other_end],
+            self.other_after[other_start : other_end] - atom_start,
+        )
+
+    @classmethod
+    def concatenate(cls, tables):
+        """ Join tables, i.e. parts of a file from take, into a single table. """
+        tables = list(tables)
+        n_atoms = np.cumsum([0] + [len(table) for table in tables])
+        buffers = [table.buffer for table in tables] + [np.zeros((0, RECORD_WIDTH), dtype=np.uint8)]
+        buffer = np.concatenate(buffers)
+        other_lines = [line for table in tables for line in table.other_lines]
+        other_after = np.concatenate(
+            [table.other_after + offset for table, offset in zip(tables, n_atoms)] + [np.zeros(0, dtype=np.int64)]
+        )
+        return cls(buffer, other_lines, other_after)
+
+    def insert_lines(self, other_after, lines):
+        """ Insert non-atom lines into the table. Lines inserted at the same
+        position as existing lines go after them.
+        Arguments:
+            other_after (iterable of int): Number of atom records before each new line.
+            lines (list of str): Lines to be inserted.
+        """
+        self.other_lines.extend(lines)
+        self.other_after = np.concatenate(
+            [self.other_after, np.asarray(other_after, dtype=np.int64)]
+        )
+        order = np.argsort(self.other_after, kind='stable')
+        self.other_after = self.other_after[order]
+        self.other_lines = [self.other_lines[i] for i in order]
+
+    def get_column(self, key):
+        """ Return the field key of all atom records, stripped and as str. """
+        return np.char.strip(self.records[key]).astype(str)
+
+    def set_column(self, key, values, rows=slice(None)):
+        """ Write values into the field key of the atom records in rows. As
+        in PDBLINE.__setitem__, values are right aligned in their field.
+        """
+        start, end = FIELD_COLUMNS[key]
+        width = end - start
+        values = np.asarray(values)
+        if values.dtype.kind not in 'SU':
+            values = values.astype(str)
+        if values.size and np.char.str_len(values).max() > width:
+            raise ValueError(
+                f'The values to be written into field {key} do not fit, when cast '
+                f'to a string, they should have less than or equal than {width} '
+                'characters.'
+            )
+        self.records[key][rows] = np.char.rjust(values, width)
+
+    def set_int_column(self, key, values, rows=slice(None)):
+        """ Write integers right aligned into the field key of the atom records in rows. """
+        start, end = FIELD_COLUMNS[key]
+        self.buffer[rows, start : end] = codec.format_int(values, end - start)
+
+    @property
+    def atomid(self):
+        """ Atom serial numbers as np.ndarray of int. """
+        return self.records['atomid'].astype(np.int64)
+
+    @atomid.setter
+    def atomid(self, values):
+        self.set_int_column('atomid', values)
+
+    @property
+    def resid(self):
+        """ Residue sequence numbers as np.ndarray of int. """
+        return self.records['resid'].astype(np.int64)
+
+    @resid.setter
+    def resid(self, values):
+        self.set_int_column('resid', values)
+
+    @property
+    def atomname(self):
+        return self.get_column('atomname')
+
+    @property
+    def resname(self):
+        return self.get_column('resname')
+
+    @property
+    def chainid(self):
+        return self.get_column('chainid')
+
+    @chainid.setter
+    def chainid(self, values):
+        self.set_column('chainid', values)
+
+    @property
+    def segid(self):
+        return self.get_column('segid')
+
+    @property
+    def element(self):
+        return self.get_column('element')
+
+    @property
+    def occupancy(self):
+        """ Occupancies as np.ndarray of float. """
+        return self.records['occupancy'].astype(np.float64)
+
+    @property
+    def tempfact(self):
+        """ Temperature factors as np.ndarray of float. """
+        return self.records['tempfact'].astype(np.float64)
+
+    @property
+    def xyz(self):
+        """ Atom positions as np.ndarray (-1, 3) of float. """
+        xyz = np.empty((len(self.records), 3))
+        for i, key in enumerate(('posx', 'posy', 'posz')):
+            xyz[:, i] = self.records[key].astype(np.float64)
+        return xyz
+
+    @xyz.setter
+    def xyz(self, positions):
+        self.set_positions(positions)
+
+    def set_positions(self, positions, idx_start=0, idx_end=None):
+        """ Set the positions of the atoms idx_start to idx_end (exclusive),
+        counting only atom records.
+        """
+        if idx_end is None:
+            idx_end = len(self.records)
+        positions = np.asarray(positions, dtype=np.float64)
+        assert (idx_end - idx_start, 3) == positions.shape
+        for i, key in enumerate(('posx', 'posy', 'posz')):
+            start, end = FIELD_COLUMNS[key]
+            self.buffer[idx_start : idx_end, start : end] = codec.format_float(positions[:, i], end - start)
+
+    def render(self, pad_with=' \n'):
+        """ Render all atom records as np.ndarray (-1, RECORD_WIDTH + len(pad_with))
+        of bytes, each row formatted as by PDBLINE.get_line.
+        """
+        return codec.encode_records(self.buffer, pad_with.encode('latin-1'))
+
+    def iter_blocks(self, pad_with=' \n', binary=False):
+        """ Yield the file in blocks: runs of atom records are rendered into
+        a single block, other lines are yielded as they are. Blocks are str,
+        or bytes if binary.
+        """
+        rendered = self.render(pad_with)
+        atom_idx = 0
+        for line, after in zip(self.other_lines, self.other_after):
+            if after > atom_idx:
+                block = rendered[atom_idx : after].tobytes()
+                yield block if binary else block.decode('latin-1')
+                atom_idx = after
+            yield as_bytes(line) if binary else as_text(line)
+        if atom_idx < len(self.records):
+            block = rendered[atom_idx : ].tobytes()
+            yield block if binary else block.decode('latin-1')
+
+    def get_lines(self, pad_with=' \n'):
+        """ Return the file as list of lines, atom records formatted as by PDBLINE.get_line. """
+        rendered = self.render(pad_with)
+        atom_lines = rendered.view(f'S{rendered.shape[1]}').reshape(-1).astype(str).tolist()
+        lines = []
+        atom_idx = 0
+        for line, after in zip(self.other_lines, self.other_after):
+            lines.extend(atom_lines[atom_idx : after])
+            lines.append(as_text(line))
+            atom_idx = after
+        lines.extend(atom_lines[atom_idx : ])
+        return lines
+
+    def write(self, fh, pad_with=' \n'):
+        """ Write the table into an open text or binary file. """
+        binary = not isinstance(fh, io.TextIOBase)
+        for block in self.iter_blocks(pad_with, binary):
+            fh.write(block)
+
+    def save(self, filename, pad_with=' \n', threads=None):
+        """ Write the table into a file, compressed by its extension, see
+        compression.open_output.
+        """
+        with open(filename, 'wb') as raw, open_output(raw, compression_from_name(filename), threads) as fh:
+            self.write(fh, pad_with)
+
+    def __repr__(self):
+        return f'PDBTable({len(self.records)} atom records, {len(self.other_lines)} other lines)'
@@ -0,0 +1,156 @@
+import string
+from write_pdb.pdbrecord import PDBRecord, other_text, parse_line
+from write_pdb.modify_pdb import AtomNumbering, ResidueNumbering, ChainSectioning, IsNewResidue
+from write_pdb.stats import measure, wrap
+
+
+class FusedPipeline:
+    """
+    Plan and run several transformations of the CLI in as few passes as possible.
+    Every atom record is parsed once into a PDBRecord, passed through all requested steps,
+    which share the parsed object and their trackers, and rendered once. Gives the
+    same output as chaining the generator stages of modify_pdb.
+    Sectioning into chains needs the number of residues, which takes an extra
+    counting pass over the input, unless single_pass is set.
+    The input is a single model, multi-model files are split into their
+    models by parallel.ModelPipeline.
+    """
+
+    def __init__(
+        self,
+        kick=None,
+        fix_atom_numbering=False,
+        fix_residue_numbering=False,
+        residues_per_chain=None,
+        n_chains=None,
+        chain_names=string.ascii_uppercase,
+        single_pass=False,
+        restart_atomid_per_chain=True,
+        restart_resid_per_chain=False,
+        stats=None,
+    ):
+        """Arguments:
+        kick (str): Drop lines containing this string, default: None
+        fix_atom_numbering (bool): Renumber the atoms, see modify_pdb.fix_atom_numbering.
+        fix_residue_numbering (bool): Renumber the residues, see modify_pdb.fix_residue_numbering.
+        residues_per_chain, n_chains, chain_names: Section into chains if either
+            residues_per_chain or n_chains is given, see modify_pdb.section_into_chains.
+        single_pass (bool): Section into chains without counting the residues first,
+            only checking the number of residues at the end.
+        stats (PipelineStats): Record the time per stage, default: None
+        """
+        self.kick = kick
+        self.stats = stats
+        # (stage name, step)
+        self.steps = []
+        if fix_atom_numbering:
+            self.steps.append(('fix_atom_numbering', AtomNumbering(restart_atomid_per_chain)))
+        if fix_residue_numbering:
+            self.steps.append(('fix_residue_numbering', ResidueNumbering(restart_resid_per_chain)))
+        self.section = residues_per_chain is not None or n_chains is not None
+        self.residues_per_chain = residues_per_chain
+        self.n_chains = n_chains
+        self.chain_names = chain_names
+        if single_pass and n_chains is not None:
+            raise ValueError("Sectioning into n_chains needs a counting pass.")
+        self.single_pass = single_pass
+        self.is_new_residue = IsNewResidue()
+
+    @property
+    def needs_count(self):
+        """If an extra pass is needed to count the residues."""
+        return self.section and not self.single_pass
+
+    @property
+    def n_passes(self):
+        """Number of passes over the input."""
+        return 2 if self.needs_count else 1
+
+    def iter_records(self, pdb_lines, stats=None):
+        """Yield (line, line_obj) after all steps before the sectioning. line is
+        the text of a line that is not an atom record, see pdbrecord.other_text,
+        or None for atom records, which need to be rendered.
+        Every stage is timed per line if stats are given.
+        """
+        for __, step in self.steps:
+            step.clear()
+        steps = [wrap(stats, name, step) for name, step in self.steps]
+        parse = bool(steps) or self.section
+        kick = self.kick
+        is_kicked = wrap(stats, 'kick', lambda line: kick in line) if kick else None
+        from_line = wrap(stats, 'parse', parse_line)
+        if stats is not None:
+            pdb_lines = stats.iter_timed('read', pdb_lines)
+        for line in pdb_lines:
+            if kick and is_kicked(line):
+                continue
+            if not parse:
+                yield line, None
+                continue
+            line_obj = from_line(line)
+            if not all(step(line_obj) for step in steps):
+                continue
+            # atom lines and TER lines change once parsed by any step
+            if line_obj.is_atom:
+                line = None
+            elif self.steps:
+                line = other_text(line)
+            yield line, line_obj
+
+    def count_residues(self, pdb_lines):
+        """Counting pass, only runs the steps, without rendering any line.
+        Timed as a whole, as stage count_residues.
+        """
+        self.is_new_residue.clear()
+        with measure(self.stats, 'count_residues') as stage:
+            n_residues = sum(self.is_new_residue(line_obj) for __, line_obj in self.iter_records(pdb_lines))
+            stage.add(records=n_residues)
+        return n_residues
+
+    def run(self, pdb_lines, n_residues=None):
+        """Transformation pass, yields the output lines one by one.
+        Arguments:
+            pdb_lines (iterable of str): Input lines.
+            n_residues (int): Result of the counting pass, if needed.
+        """
+        records = self.iter_records(pdb_lines, self.stats)
+        get_line = wrap(self.stats, 'render', PDBRecord.get_line, count_bytes='out')
+        if not self.section:
+            for line, line_obj in records:
+                yield get_line(line_obj) if line is None else line
+            return
+        if self.needs_count and n_residues is None:
+            raise ValueError("Please run the counting pass first, see FusedPipeline.count_residues.")
+        sectioning = wrap(self.stats, 'section_into_chains', ChainSectioning(
+            self.residues_per_chain, self.n_chains, self.chain_names, n_residues
+        ))
+        record = next(records, None)
+        while record is not None:
+            line, line_obj = record
+            next_record = next(records, None)
+            if not line_obj.is_atom:
+                yield "TER \n" if line.startswith("TER") else line
+            else:
+                # check if the next line is a "TER" line, if not, add one
+                if sectioning(line_obj) and (
+                    next_record is None or "TER" not in self.get_text(next_record)
+                ):
+                    yield "TER \n"
+                yield get_line(line_obj)
+            record = next_record
+        sectioning.finish()
+
+    @staticmethod
+    def get_text(record):
+        """Text of a record, as it arrives at the sectioning."""
+        line, line_obj = record
+        return line_obj.get_line() if line is None else line
+
+    def __call__(self, open_lines):
+        """Run all passes and yield the output lines.
+        Arguments:
+            open_lines (callable): Returns a fresh iterable over the input lines
+                for every pass.
+        """
+        n_residues = self.count_residues(open_lines()) if self.needs_count else None
+        yield from self.run(open_lines(), n_residues)
@@ -0,0 +1,110 @@
+import json
+import functools
+from importlib import resources
+import numpy as np
+from write_pdb.pdbtable import PDBTable, FIELD_COLUMNS, RECORD_WIDTH
+from write_pdb.residue_class import Residue
+
+
+# bundled templates of the standard amino acids and common solvent, ions and caps
+REGISTRY_FILE = 'residues.json'
+
+
+class TemplateResidue(Residue):
+    """
+    Residue from the registry. Amino acids use the terminal states of the
+    registry: the first residue of a chain has its amide H replaced by H1, H2
+    and H3 (proline gets H1 and H2 after N), the last one has O replaced by
+    OC1 and OC2. Residues that are not part of a polymer have no terminal states.
+    """
+    def __init__(self, resname, atom_categroy, atomnames, elements, polymer=True):
+        super().__init__(resname, atom_categroy, atomnames, elements)
+        self.polymer = polymer
+
+    def get_atoms(self, first_res=False, last_res=False):
+        atomnames = list(self.atomnames)
+        elements = list(self.elements)
+        if not self.polymer:
+            return atomnames, elements
+        if first_res:
+            if 'H' in atomnames:
+                idx = atomnames.index('H')
+                atomnames[idx : idx + 1] = ['H1', 'H2', 'H3']
+                elements[idx : idx + 1] = ['H', 'H', 'H']
+            else:
+                idx = atomnames.index('N') + 1
+                atomnames[idx : idx] = ['H1', 'H2']
+                elements[idx : idx] = ['H', 'H']
+        if last_res:
+            idx = atomnames.index('O')
+            atomnames[idx : idx + 1] = ['OC1', 'OC2']
+            elements[idx : idx + 1] = ['O', 'O']
+        return atomnames, elements
+
+
+@functools.lru_cache(maxsize=None)
+def load_registry():
+    """ Load the bundled templates on first use, returns a dict resname: entry. """
+    text = resources.files('write_pdb').joinpath('data', REGISTRY_FILE).read_text()
+    return json.loads(text)
+
+
+def available_residues():
+    """ Names of all residues in the registry. """
+    return sorted(load_registry())
+
+
+@functools.lru_cache(maxsize=None)
+def get_residue(resname):
+    """ Return the TemplateResidue for resname, created once. """
+    registry = load_registry()
+    if resname not in registry:
+        raise KeyError(f'No template for residue {resname}, available are {available_residues()}.')
+    entry = registry[resname]
+    atomnames, elements = zip(*entry['atoms'])
+    return TemplateResidue(resname, entry['category'], atomnames, elements, entry['polymer'])
+
+
+@functools.lru_cache(maxsize=None)
+def get_skeleton(resname, first_res=False, last_res=False, chainid='A'):
+    """ Pre-rendered atom records of a residue in a chain as read-only
+    np.ndarray (n_atoms, RECORD_WIDTH) of bytes, with everything but atomid,
+    resid and the positions filled in. Cached per (resname, terminal state, chain).
+    """
+    table = PDBTable(get_residue(resname).get_template(first_res, last_res).copy())
+    table.chainid = chainid
+    table.buffer.flags.writeable = False
+    return table.buffer
+
+
+@functools.lru_cache(maxsize=None)
+def get_skeleton_pieces(resname, first_res=False, last_res=False, chainid='A'):
+    """ The skeleton of get_skeleton cut around the atomid, resid and position
+    columns, as list of bytes per atom record.
+    """
+    columns = [FIELD_COLUMNS[key] for key in ('atomid', 'resid', 'posx')]
+    cuts = [0] + [col for start, end in columns for col in (start, end)] + [RECORD_WIDTH]
+    cuts[-2] = FIELD_COLUMNS['posz'][1]
+    return [
+        [row[start : end] for start, end in zip(cuts[ : : 2], cuts[1 : : 2])]
+        for row in map(bytes, get_skeleton(resname, first_res, last_res, chainid))
+    ]
+
+
+def render_residue(resname, resid, atomid, positions, chainid='A', first_res=False, last_res=False, pad_with=' \n'):
+    """ Atom records of a single residue from the registry as bytes, only
+    atomid, resid and the positions are written into the cached skeleton,
+    see Residue.get_lines for the arguments. Same output as build_chain,
+    but faster for a single residue.
+    """
+    pieces = get_skeleton_pieces(resname, first_res, last_res, chainid)
+    assert (len(pieces), 3) == np.shape(positions)
+    resid = f'{resid:4d}'.encode('ascii')
+    pad_with = pad_with.encode('ascii')
+    records = []
+    for i, ((head, mid, gap, tail), (x, y, z)) in enumerate(zip(pieces, positions)):
+        fields = (f'{atomid + i:5d}'.encode('ascii'), f'{x:8.3f}{y:8.3f}{z:8.3f}'.encode('ascii'))
+        if len(fields[0]) > 5 or len(resid) > 4 or len(fields[1]) > 24:
+            raise ValueError(f'Residue {resname} {resid} does not fit into the fixed-width columns.')
+        records.append(head + fields[0] + mid + resid + gap + fields[1] + tail + pad_with)
+    return b''.join(records)
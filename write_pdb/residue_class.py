@@ -1,4 +1,6 @@
-from write_pdb.pdbline import PDBLINE
+import numpy as np
+from write_pdb import codec
+from write_pdb.pdbtable import PDBTable, FIELD_COLUMNS, RECORD_WIDTH
 
 
 class Residue:
@@ -12,87 +14,100 @@ class Residue:
             atom_categroy (str): Category for the atoms in the residue, ie ATOM or HETATOM.
             atom_names (iterable): Names for the atoms in the residue.
             elements (iterable): Element names for the atoms in the residue.
-            atom_counter (int): Counter for the atom number in the entire chain, which
-                the residue belongs to.
         """
         self.atom_categroy = atom_categroy
-        self.atomnames = atomnames
+        self.atomnames = list(atomnames)
         self.resname = resname
-        self.elements = elements
-        temp = PDBLINE()
-        self.fields = temp.field_templates
-    
-    def sub_line(self, idx1, idx2, word, line):
-        assert idx2 - idx1 + 1 == len(word), f'{idx1 - idx2 + 1} {len(word)}'
-        for i, idx in enumerate(range(idx1, idx2 + 1)):
-            line[idx - 1] = word[i]
-    
-    def get_str_with_len(self, content, length):
-        out_str = str(content)
-        assert len(out_str) <= length, f'content too long: {content}, {length}'
-        while len(out_str) < length:
-            out_str = ' ' + out_str
-        return out_str
-    
-    def get_line(self, to_add):
-        line = 79 * [' ']
-        for key, (colums, __, __) in self.fields.items():
-            if key in to_add:
-                word = self.get_str_with_len(to_add[key], colums[1] - colums[0] + 1)
-                self.sub_line(colums[0], colums[1], word, line)
-        return ''.join(line) + '\n'
-    
-    def get_lines(self, resid, atomid, positions, chainid='A', first_res=False, last_res=False):
-        lines = []
-        counter = 0
-        for i in range(len(self.atom_categroy)):
-            try:
-                lines.append(self.get_line({
-                    'type': self.atom_categroy,
-                    'atomid': counter + atomid,
-                    'atomname': self.atomnames[i],
-                    'resid': resid,
-                    'resname': self.resname,
-                    'chainid': chainid,
-                    'posx': f'{positions[counter, 0]:.3f}',
-                    'posy': f'{positions[counter, 1]:.3f}',
-                    'posz': f'{positions[counter, 2]:.3f}',
-                    'element': self.elements[i],
-                }))
-            except IndexError:
-                print(positions, counter, positions.shape)
-            counter += 1
-            # add charge to Nitrogen, if first residue
-            if first_res and i == 2:
-                lines.append(self.get_line({
-                    'type': self.atom_categroy,
-                    'atomid': counter + atomid,
-                    'atomname': 'H3',
-                    'resid': resid,
-                    'resname': self.resname,
-                    'chainid': chainid,
-                    'posx': f'{positions[counter, 0]:.3f}',
-                    'posy': f'{positions[counter, 1]:.3f}',
-                    'posz': f'{positions[counter, 2]:.3f}',
-                    'element': 'H',
-                }))
-                counter += 1
-        # add charge to Oxigen, if last residue
+        self.elements = list(elements)
+        self.fields = FIELD_COLUMNS
+        # rendered atom records per terminal state, see get_template
+        self.templates = {}
+
+    def get_atoms(self, first_res=False, last_res=False):
+        """ Atom names and elements of the residue. The first residue of a chain
+        gets a charged nitrogen, with H3 after the third atom, in the last residue
+        the last atom is replaced by the charged oxygens OC1 and OC2.
+        """
+        atomnames = list(self.atomnames)
+        elements = list(self.elements)
+        if first_res:
+            atomnames.insert(3, 'H3')
+            elements.insert(3, 'H')
         if last_res:
-            counter -= 1
-            lines.pop(-1)
-            for j in range(2):
-                lines.append(self.get_line({
-                    'type': self.atom_categroy,
-                    'atomid': counter + atomid,
-                    'atomname': f'OC{j}',
-                    'resid': resid,
-                    'resname': self.resname,
-                    'chainid': chainid,
-                    'posx': f'{positions[counter, 0]:.3f}',
-                    'posy': f'{positions[counter, 1]:.3f}',
-                    'posz': f'{positions[counter, 2]:.3f}',
-                    'element': 'O',
-                }))
-                counter += 1
-        return lines
+            atomnames[-1 : ] = ['OC1', 'OC2']
+            elements[-1 : ] = ['O', 'O']
+        return atomnames, elements
+
+    def get_template(self, first_res=False, last_res=False):
+        """ Atom records of the residue as np.ndarray (n_atoms, RECORD_WIDTH) of bytes,
+        with all fields but atomid, resid, chainid and the positions filled in.
+        Rendered once per terminal state.
+        """
+        key = (first_res, last_res)
+        if key not in self.templates:
+            atomnames, elements = self.get_atoms(first_res, last_res)
+            table = PDBTable(np.full((len(atomnames), RECORD_WIDTH), codec.SPACE, dtype=np.uint8))
+            # the record type is left aligned, as in every pdb file
+            table.records['type'] = self.atom_categroy.ljust(6).encode('ascii')
+            table.set_column('atomname', atomnames)
+            table.set_column('resname', self.resname)
+            table.set_column('element', elements)
+            self.templates[key] = table.buffer
+        return self.templates[key]
+
+    def get_lines(self, resid, atomid, positions, chainid='A', first_res=False, last_res=False):
+        """ Lines of the residue, see build_chain.
+        Arguments:
+            resid, atomid (int): Number of the residue and of its first atom.
+            positions (np.ndarray (n_atoms, 3)): Positions of the atoms, see get_atoms.
+            chainid (str): Chain the residue belongs to.
+            first_res, last_res (bool): If the residue is at the start or end of the chain.
+        """
+        table = build_chain([self], positions, chainid, resid, atomid, first_res, last_res)
+        return table.get_lines(pad_with='\n')
+
+
+def build_chain(residues, positions, chainid='A', resid_start=1, atomid_start=1, n_terminus=True, c_terminus=True):
+    """ Build the atom records of a whole chain at once. The records of every
+    residue type are rendered once, gathered for the whole sequence, and only
+    atomid, resid, chainid and the positions are written per chain.
+    Arguments:
+        residues (list of Residue or str): Sequence of the chain, residues given
+            by name are taken from the registry, see registry.get_residue.
+        positions (np.ndarray (n_atoms, 3)): Positions of all atoms of the chain,
+            in the order of Residue.get_atoms.
+        chainid (str): Chain identifier.
+        resid_start, atomid_start (int): Number of the first residue and atom.
+        n_terminus, c_terminus (bool): Charge the first and last residue, see
+            Residue.get_atoms, default: True
+    Returns:
+        PDBTable with the atom records of the chain.
+    """
+    # the registry builds on Residue, so it is only imported here
+    from write_pdb.registry import get_residue
+    n_residues = len(residues)
+    # index every residue type and terminal state into one stack of templates
+    lookup = {}
+    templates = []
+    template_idx = np.empty(n_residues, dtype=np.int64)
+    for i, residue in enumerate(residues):
+        if isinstance(residue, str):
+            residue = get_residue(residue)
+        key = (residue, n_terminus and i == 0, c_terminus and i == n_residues - 1)
+        if key not in lookup:
+            lookup[key] = len(templates)
+            templates.append(residue.get_template(*key[1 : ]))
+        template_idx[i] = lookup[key]
+    if not templates:
+        templates.append(np.zeros((0, RECORD_WIDTH), dtype=np.uint8))
+    sizes = np.array([len(template) for template in templates])
+    offsets = np.cumsum(sizes) - sizes
+    counts = sizes[template_idx]
+    atom_starts = np.cumsum(counts) - counts
+    rows = np.arange(counts.sum()) + np.repeat(offsets[template_idx] - atom_starts, counts)
+    table = PDBTable(np.concatenate(templates)[rows])
+    table.atomid = atomid_start + np.arange(len(table))
+    table.resid = np.repeat(resid_start + np.arange(n_residues), counts)
+    table.chainid = chainid
+    table.set_positions(positions)
+    return table
@@ -0,0 +1,282 @@
+import io
+import sys
+import time
+import contextlib
+# json, cProfile, pstats and tracemalloc are imported when the stats are
+# reported or a stage is profiled, resource where /proc is missing, the CLI
+# imports this module on every run
+
+
+# stages of the CLI, in the order they run for every line
+STAGES = (
+    'read', 'kick', 'parse', 'geometry', 'fix_atom_numbering', 'fix_residue_numbering',
+    'section_into_chains', 'render', 'write',
+)
+PROFILERS = ('cprofile', 'tracemalloc')
+
+
+def peak_rss_mb():
+    """Peak RSS of the current process in MB."""
+    try:
+        with open('/proc/self/status') as fh:
+            return int(fh.read().split('VmHWM:')[1].split()[0]) / 1024
+    except (OSError, IndexError):
+        import resource
+        # ru_maxrss is in kB on linux, but in bytes on macOS
+        scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class StageStats:
+    """Counters of a single stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.records = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.peak_rss_mb = 0.0
+
+    def add(self, records=0, bytes_in=0, bytes_out=0):
+        self.records += records
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def merge(self, counters):
+        """Add the counters of the same stage from another process, see as_dict."""
+        for key in ('seconds', 'calls', 'records', 'bytes_in', 'bytes_out'):
+            setattr(self, key, getattr(self, key) + counters[key])
+        self.peak_rss_mb = max(self.peak_rss_mb, counters['peak_rss_mb'])
+
+    def as_dict(self):
+        return {
+            'seconds': self.seconds, 'calls': self.calls, 'records': self.records,
+            'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out, 'peak_rss_mb': self.peak_rss_mb,
+        }
+
+
+class NullStage:
+    """Stand-in for StageStats when nothing is recorded."""
+
+    def add(self, records=0, bytes_in=0, bytes_out=0):
+        pass
+
+
+class PipelineStats:
+    """
+    Wall time, records, bytes in and out and peak memory per stage of a run,
+    see STAGES. Pass it as stats to FusedPipeline, ChunkedPipeline or
+    process_file. Whole-array stages are timed once per call with measure,
+    per-line stages through the wrappers of wrap and iter_timed, which are
+    only put in place when stats are recorded. Peak memory is the high water
+    mark of the RSS of the process when the stage last finished.
+    Optionally, cProfile or tracemalloc runs around every call of one stage.
+    """
+
+    def __init__(self, profile_stage=None, profiler='cprofile'):
+        """Arguments:
+        profile_stage (str): Stage to run the profiler around, default: None
+        profiler (str): One of PROFILERS.
+        """
+        if profiler not in PROFILERS:
+            raise ValueError(f'Unknown profiler {profiler}, use one of {PROFILERS}.')
+        self.stages = {}
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile = None
+        if profile_stage and profiler == 'cprofile':
+            import cProfile
+            self.profile = cProfile.Profile()
+        self.snapshot = None
+        self.start = time.perf_counter()
+        self.wall_seconds = None
+
+    def __getitem__(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+    def start_profile(self):
+        if self.profile is not None:
+            self.profile.enable()
+        else:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                # tracemalloc cannot pause, so it traces from the first call of the stage on
+                tracemalloc.start()
+
+    def stop_profile(self):
+        if self.profile is not None:
+            self.profile.disable()
+        else:
+            import tracemalloc
+            self.snapshot = tracemalloc.take_snapshot()
+
+    @contextlib.contextmanager
+    def measure(self, name, records=0, bytes_in=0, bytes_out=0):
+        """Time a call of a whole stage, yields its StageStats to add counts."""
+        stage = self[name]
+        profiling = name == self.profile_stage
+        if profiling:
+            self.start_profile()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+            if profiling:
+                self.stop_profile()
+            stage.calls += 1
+            stage.add(records, bytes_in, bytes_out)
+            stage.peak_rss_mb = peak_rss_mb()
+
+    def wrap(self, name, func, count_bytes=None):
+        """Wrap func for a per-line stage, every call is one record.
+        count_bytes ('in' or 'out') adds the length of the first argument to
+        bytes_in or of the result to bytes_out.
+        """
+        if name == self.profile_stage:
+            return ProfiledCall(self, name, func, count_bytes)
+        return TimedCall(self, name, func, count_bytes)
+
+    def iter_timed(self, name, iterable):
+        """Yield from iterable, adding the time spent in it to stage name and
+        the length of every item to its bytes_in.
+        """
+        stage = self[name]
+        items = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            item = next(items, None)
+            stage.seconds += time.perf_counter() - start
+            if item is None:
+                break
+            stage.calls += 1
+            stage.records += 1
+            stage.bytes_in += len(item)
+            yield item
+
+    def finish(self):
+        """Stop the clock of the run and sample the memory of the per-line stages."""
+        self.wall_seconds = time.perf_counter() - self.start
+        rss = peak_rss_mb()
+        for stage in self.stages.values():
+            # per-line stages are not sampled while they run
+            if not stage.peak_rss_mb:
+                stage.peak_rss_mb = rss
+        if self.profile_stage and self.profiler == 'tracemalloc':
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                if self.snapshot is None:
+                    self.snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+
+    def merge(self, stages):
+        """Add the stages recorded in another process, given as in as_dict."""
+        for name, counters in stages.items():
+            self[name].merge(counters)
+
+    def ordered(self):
+        """Stages in the order of STAGES, others after them."""
+        return sorted(
+            self.stages.values(),
+            key=lambda stage: STAGES.index(stage.name) if stage.name in STAGES else len(STAGES),
+        )
+
+    def as_dict(self):
+        return {stage.name: stage.as_dict() for stage in self.ordered()}
+
+    def to_json(self):
+        import json
+        return json.dumps({
+            'wall_seconds': self.wall_seconds,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': self.as_dict(),
+        }, indent=1)
+
+    def format_table(self):
+        lines = [f'{"stage":<24s}{"seconds":>10s}{"calls":>10s}{"records":>12s}{"MB in":>10s}{"MB out":>10s}{"peak MB":>10s}']
+        for stage in self.ordered():
+            lines.append(
+                f'{stage.name:<24s}{stage.seconds:>10.3f}{stage.calls:>10d}{stage.records:>12d}'
+                f'{stage.bytes_in / 1e6:>10.2f}{stage.bytes_out / 1e6:>10.2f}{stage.peak_rss_mb:>10.1f}'
+            )
+        if self.wall_seconds is not None:
+            lines.append(f'{"wall time":<24s}{self.wall_seconds:>10.3f}')
+        return '\n'.join(lines)
+
+    def format_profile(self, n_lines=25):
+        """Report of the profiler, empty if no stage was profiled."""
+        if self.profile is not None:
+            import pstats
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(n_lines)
+            return stream.getvalue()
+        if self.snapshot is not None:
+            top = self.snapshot.statistics('lineno')[ : n_lines]
+            return '\n'.join(str(stat) for stat in top)
+        return ''
+
+    def report(self, fmt='table', fh=None):
+        """Write the stats as 'table' or 'json' and the profile, default to stderr."""
+        fh = fh or sys.stderr
+        fh.write((self.to_json() if fmt == 'json' else self.format_table()) + '\n')
+        profile = self.format_profile()
+        if profile:
+            fh.write(f'\nprofile of stage {self.profile_stage}:\n{profile}\n')
+
+
+class TimedCall:
+    """Call func and add the time to a stage, see PipelineStats.wrap."""
+
+    def __init__(self, stats, name, func, count_bytes=None):
+        self.stats = stats
+        self.stage = stats[name]
+        self.func = func
+        self.count_bytes = count_bytes
+
+    def __call__(self, *args):
+        start = time.perf_counter()
+        result = self.func(*args)
+        stage = self.stage
+        stage.seconds += time.perf_counter() - start
+        stage.calls += 1
+        stage.records += 1
+        if self.count_bytes == 'in':
+            stage.bytes_in += len(args[0])
+        elif self.count_bytes == 'out':
+            stage.bytes_out += len(result)
+        return result
+
+    def __getattr__(self, name):
+        # clear, finish, ... of the wrapped step
+        return getattr(self.func, name)
+
+
+class ProfiledCall(TimedCall):
+    """TimedCall with the profiler running around every call."""
+
+    def __call__(self, *args):
+        self.stats.start_profile()
+        try:
+            return super().__call__(*args)
+        finally:
+            # tracemalloc keeps tracing until PipelineStats.finish
+            if self.stats.profile is not None:
+                self.stats.profile.disable()
+
+
+def measure(stats, name, records=0, bytes_in=0, bytes_out=0):
+    """PipelineStats.measure, or a no-op if stats is None."""
+    if stats is None:
+        return contextlib.nullcontext(NullStage())
+    return stats.measure(name, records, bytes_in, bytes_out)
+
+
+def wrap(stats, name, func, count_bytes=None):
+    """PipelineStats.wrap, or func itself if stats is None."""
+    if stats is None:
+        return func
+    return stats.wrap(name, func, count_bytes)
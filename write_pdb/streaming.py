@@ -0,0 +1,314 @@
+import queue
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from write_pdb.compression import open_input, iter_line_blocks
+from write_pdb.fileio import replace_on_success
+from write_pdb.models import has_models
+from write_pdb.parallel import ChunkedPipeline, ModelPipeline
+from write_pdb.stats import measure
+
+
+# blocks are read this many bytes at a time, then cut at the last newline
+BLOCK_BYTES = 1 << 23
+# blocks waiting between the stages, bounds the memory to a few blocks per queue
+QUEUE_BLOCKS = 4
+# marks the end of a queue
+DONE = object()
+
+
+class BlockReader:
+    """
+    Read a file in a thread, ahead of the consumer, in blocks of whole lines.
+    Compressed files are decompressed in the thread, see open_input.
+    At most queue_blocks blocks wait in the queue, the thread blocks on a full
+    queue. Errors of the thread are raised in the consumer. Iterate over it
+    within a with block, leaving the block stops the thread.
+    """
+
+    def __init__(self, filename, block_bytes=BLOCK_BYTES, queue_blocks=QUEUE_BLOCKS, stats=None):
+        self.filename = filename
+        self.block_bytes = block_bytes
+        self.queue = queue.Queue(queue_blocks)
+        self.stop = threading.Event()
+        self.stats = stats
+        self.thread = threading.Thread(target=self.read, name='write_pdb-reader', daemon=True)
+
+    def read(self):
+        try:
+            items = self.iter_reads()
+            try:
+                for item in items:
+                    if self.stop.is_set():
+                        break
+                    self.put(item)
+            finally:
+                items.close()
+            self.put(DONE)
+        except BaseException as error:
+            self.put(error)
+
+    def iter_reads(self):
+        """Yield the items of the queue, read in the thread: blocks of whole lines."""
+        with open_input(self.filename) as fh:
+            blocks = iter_line_blocks(fh, self.block_bytes)
+            while True:
+                with measure(self.stats, 'read') as stage:
+                    data = next(blocks, None)
+                    stage.add(bytes_in=len(data or b''))
+                if data is None:
+                    return
+                yield data
+
+    def put(self, item):
+        """Put item into the queue, unless the consumer stopped listening."""
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self.thread.join()
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+
+class ModelReader(BlockReader):
+    """
+    Read the models of a file in a thread, ahead of the consumer, as
+    BlockReader does with blocks. The items are the tasks of
+    ModelPipeline.transform_table with the bytes of the model in place of the
+    file name, as for compressed files.
+    """
+
+    def __init__(self, pipeline, tasks, queue_blocks=QUEUE_BLOCKS, stats=None):
+        """Arguments:
+        pipeline (ModelPipeline): Reads the models, see ChunkedPipeline.read_bytes.
+        tasks (list): (filename, start, end, body_start, body_end) per model.
+        """
+        super().__init__(None, queue_blocks=queue_blocks, stats=stats)
+        self.pipeline = pipeline
+        self.tasks = tasks
+
+    def iter_reads(self):
+        """Yield the tasks with the bytes of their model."""
+        for filename, start, end, body_start, body_end in self.tasks:
+            data = self.pipeline.read_bytes(filename, start, end, self.stats)
+            yield data, 0, end - start, body_start - start, body_end - start
+
+
+class BlockWriter:
+    """
+    Write blocks into a binary file in a thread, so that the producer does not
+    wait for the disk. write blocks once queue_blocks blocks are waiting.
+    Errors of the thread are raised by the next write or by close.
+    """
+
+    def __init__(self, fh_out, queue_blocks=QUEUE_BLOCKS, stats=None):
+        self.fh_out = fh_out
+        self.queue = queue.Queue(queue_blocks)
+        self.stats = stats
+        self.error = None
+        self.thread = threading.Thread(target=self.drain, name='write_pdb-writer', daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            block = self.queue.get()
+            if block is DONE:
+                return
+            if self.error is not None:
+                # keep emptying the queue, so that the producer does not block
+                continue
+            try:
+                with measure(self.stats, 'write', records=1, bytes_in=len(block)):
+                    self.fh_out.write(block)
+            except BaseException as error:
+                self.error = error
+
+    def write(self, block):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(block)
+
+    def close(self):
+        """Wait until all blocks are written."""
+        self.queue.put(DONE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class StreamingPipeline(ChunkedPipeline):
+    """
+    Run the transformations of the CLI with reading, transforming and writing
+    overlapped, giving the same output as FusedPipeline. A reader thread
+    prefetches blocks of whole lines, the calling thread transforms them as
+    record batches, see ChunkedPipeline.transform_block, and a writer thread
+    writes them, all joined by bounded queues. The wall time approaches the
+    slowest of the three stages instead of their sum, which pays off on slow
+    or high latency disks. The carries are advanced block by block, so only
+    sectioning into chains needs a first pass, which counts the residues.
+    """
+
+    def __init__(self, block_bytes=BLOCK_BYTES, queue_blocks=QUEUE_BLOCKS, **kwargs):
+        """Arguments:
+        block_bytes (int): Bytes read at a time.
+        queue_blocks (int): Blocks waiting between two stages at most.
+        kwargs: Transformations and stats, see ChunkedPipeline.
+        """
+        super().__init__(jobs=1, **kwargs)
+        self.block_bytes = block_bytes
+        self.queue_blocks = queue_blocks
+
+    def iter_blocks(self, filename):
+        """Blocks of whole lines of filename, read ahead in a thread."""
+        with BlockReader(filename, self.block_bytes, self.queue_blocks, self.stats) as reader:
+            yield from reader
+
+    def summarize(self, table):
+        with measure(self.stats, 'scan'):
+            return super().summarize(table)
+
+    def iter_output(self, filename):
+        """Yield the transformed content of filename as blocks of bytes."""
+        carries = None
+        if self.section:
+            # the blocks are cut at the same places in both passes
+            summaries = [self.summarize(self.decode_block(data, self.stats)) for data in self.iter_blocks(filename)]
+            with measure(self.stats, 'plan', records=len(summaries)):
+                carries = iter(self.plan(summaries))
+        carry = None
+        lines_seen = False
+        for data in self.iter_blocks(filename):
+            if carries is not None:
+                yield self.transform_block(data, next(carries), self.stats)
+            elif self.parse:
+                # the block is parsed once, for its summary and its transformation
+                table = self.decode_block(data, self.stats)
+                summary = self.summarize(table)
+                if not lines_seen:
+                    # reference chain of fix_residue_numbering, see plan
+                    carry = self.start_carries(summary)
+                    lines_seen = bool(summary['n_lines'])
+                yield self.transform_records(table, carry, self.stats)
+                carry = self.advance_carries(carry, summary)
+            else:
+                yield self.transform_block(data, carry, self.stats)
+
+    def run(self, filename, fh_out):
+        """Transform filename and write the result into the binary file fh_out."""
+        write_blocks(self.iter_output(filename), fh_out, self.queue_blocks, self.stats)
+
+
+class StreamingModelPipeline(ModelPipeline):
+    """
+    Run the transformations of the CLI model by model, as ModelPipeline, with
+    reading, transforming and writing overlapped, as StreamingPipeline. A
+    reader thread reads the selected models ahead, see ModelReader, the
+    calling thread transforms them one by one, and a writer thread writes them.
+    """
+
+    def __init__(self, queue_blocks=QUEUE_BLOCKS, **kwargs):
+        """Arguments:
+        queue_blocks (int): Models waiting between two stages at most.
+        kwargs: Models, transformations and stats, see ModelPipeline.
+        """
+        super().__init__(jobs=1, **kwargs)
+        self.queue_blocks = queue_blocks
+
+    def transform_tasks(self, tasks):
+        with ModelReader(self, tasks, self.queue_blocks, self.stats) as reader:
+            yield from map(self.transform_chunk, reader)
+
+    def run(self, filename, fh_out):
+        """Transform filename and write the result into the binary file fh_out."""
+        write_blocks(self.iter_output(filename), fh_out, self.queue_blocks, self.stats)
+
+
+def write_blocks(blocks, fh_out, queue_blocks=QUEUE_BLOCKS, stats=None):
+    """Write the non-empty blocks into the binary file fh_out, in a writer
+    thread, see BlockWriter. If writing fails, blocks is closed, which stops
+    the reader thread behind it.
+    """
+    writer = BlockWriter(fh_out, queue_blocks, stats)
+    try:
+        for block in blocks:
+            if block:
+                writer.write(block)
+    finally:
+        try:
+            writer.close()
+        finally:
+            if hasattr(blocks, 'close'):
+                blocks.close()
+
+
+def open_pipeline(filename, block_bytes=BLOCK_BYTES, queue_blocks=QUEUE_BLOCKS, models=None, **kwargs):
+    """StreamingPipeline for filename, or a StreamingModelPipeline if filename
+    has MODEL records or models are selected, so that every model is
+    transformed on its own.
+    """
+    if models is not None or has_models(filename):
+        return StreamingModelPipeline(queue_blocks, models=models, **kwargs)
+    return StreamingPipeline(block_bytes, queue_blocks, **kwargs)
+
+
+def stream_file(filename, save=None, stats=None, threads=None, **kwargs):
+    """Transform a pdb file with pipelined reads and writes, with the same
+    result as the CLI. Compressed files are read and written by their magic
+    bytes or extension.
+    Multi-model files are transformed model by model, see open_pipeline.
+    Arguments:
+        filename (str): Load name.
+        save (str): Save name, default: overwrite filename.
+        stats (PipelineStats): Record the time per stage, default: None
+        threads (int): Threads that compress the output, default: os.cpu_count()
+        kwargs: Transformations, block sizes and models, see open_pipeline.
+    """
+    pipeline = open_pipeline(filename, stats=stats, **kwargs)
+    with replace_on_success(save or filename, threads=threads) as fh_out:
+        pipeline.run(filename, fh_out)
+    return pipeline
+
+
+async def aiter_output(filename, **kwargs):
+    """Yield the transformed content of filename as blocks of bytes, without
+    blocking the event loop, see StreamingPipeline.iter_output.
+    Arguments:
+        filename (str): Load name.
+        kwargs: Transformations and block sizes, see StreamingPipeline.
+    """
+    blocks = open_pipeline(filename, **kwargs).iter_output(filename)
+    loop = asyncio.get_running_loop()
+    # a single thread runs the steps in order, so that closing the blocks
+    # waits for a step that is still running when the consumer is cancelled
+    executor = ThreadPoolExecutor(1, thread_name_prefix='write_pdb-stream')
+    try:
+        while True:
+            block = await loop.run_in_executor(executor, next, blocks, None)
+            if block is None:
+                return
+            yield block
+    finally:
+        executor.submit(blocks.close)
+        executor.shutdown(wait=False)
+
+
+async def stream_file_async(filename, save=None, stats=None, threads=None, **kwargs):
+    """stream_file in a thread, to be awaited from an event loop."""
+    return await asyncio.to_thread(stream_file, filename, save, stats, threads, **kwargs)
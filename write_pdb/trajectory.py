@@ -0,0 +1,132 @@
+import os
+import numpy as np
+from write_pdb import codec
+from write_pdb.compression import compression_from_name, open_output
+from write_pdb.pdbtable import PDBTable, FIELD_COLUMNS, as_bytes, as_text
+
+
+# lines of the template that are not repeated in every model
+FRAME_EXCLUDE = ('MODEL', 'ENDMDL', 'END')
+
+
+class TrajectoryWriter:
+    """
+    Write many frames of coordinates as MODEL/ENDMDL blocks of a multi-model pdb,
+    all sharing the topology of a single template. The template is parsed once
+    and every model is rendered into the same preallocated buffer, of which only
+    the coordinate columns are formatted per frame, so memory use is bounded by
+    one frame.
+    Lines of the template before the first atom record (REMARK, CRYST1, ...)
+    are written once before the first model, TER lines are repeated in every
+    model and END is written on close.
+    """
+    def __init__(self, template, fh, pad_with=' \n', threads=None):
+        """ Arguments:
+            template (PDBTable, list of str or str): Topology of every frame,
+                given as table, pdb lines or file name.
+            fh (str or binary file object): File name or open file to write to.
+                File names ending in .gz, .xz or .zst are compressed in
+                parallel blocks, see compression.open_output.
+            pad_with (str): Line ending of the atom records, as in PDBLINE.get_line.
+            threads (int): Threads that compress the output, default: os.cpu_count()
+        """
+        if isinstance(template, (str, os.PathLike)):
+            template = PDBTable.from_file(template)
+        elif not isinstance(template, PDBTable):
+            template = PDBTable.from_lines(template)
+        self.n_atoms = len(template)
+        self.owns_fh = isinstance(fh, (str, os.PathLike))
+        self.raw = None
+        if self.owns_fh:
+            self.raw = open(fh, 'wb')
+            fh = open_output(self.raw, compression_from_name(fh), threads)
+        self.fh = fh
+        self.n_frames = 0
+        keep = [
+            i for i, line in enumerate(template.other_lines)
+            if as_text(line)[ : 6].strip() not in FRAME_EXCLUDE
+        ]
+        header = [i for i in keep if template.other_after[i] == 0]
+        inner = [i for i in keep if template.other_after[i] > 0]
+        self.header = b''.join(as_bytes(template.other_lines[i]) for i in header)
+        self.header_written = False
+        # render one frame into a flat buffer, and keep 2D views on every run of atom records
+        rendered = template.render(pad_with)
+        pieces = []
+        runs = []
+        offset = 0
+        atom_idx = 0
+        for i in inner + [None]:
+            after = self.n_atoms if i is None else template.other_after[i]
+            if after > atom_idx:
+                pieces.append(rendered[atom_idx : after].reshape(-1))
+                runs.append((atom_idx, after, offset))
+                offset += pieces[-1].size
+                atom_idx = after
+            if i is not None:
+                pieces.append(np.frombuffer(as_bytes(template.other_lines[i]), dtype=np.uint8))
+                offset += pieces[-1].size
+        self.frame = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.uint8)
+        self.runs = [
+            (start, end, self.frame[offset : offset + (end - start) * rendered.shape[1]].reshape(end - start, -1))
+            for start, end, offset in runs
+        ]
+
+    def write_frame(self, positions, model_id=None):
+        """ Write a single MODEL block with the positions np.ndarray (n_atoms, 3).
+        Models are numbered from 1, unless model_id is given.
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        assert (self.n_atoms, 3) == positions.shape
+        if not self.header_written:
+            self.fh.write(self.header)
+            self.header_written = True
+        self.n_frames += 1
+        if model_id is None:
+            model_id = self.n_frames
+        for i, key in enumerate(('posx', 'posy', 'posz')):
+            start_col, end_col = FIELD_COLUMNS[key]
+            formatted = codec.format_float(positions[:, i], end_col - start_col)
+            for start, end, view in self.runs:
+                view[:, start_col : end_col] = formatted[start : end]
+        self.fh.write(f'MODEL     {model_id:4d}\n'.encode('ascii'))
+        self.fh.write(self.frame.data)
+        self.fh.write(b'ENDMDL\n')
+
+    def write_frames(self, frames):
+        """ Write all frames, given as iterable of np.ndarray (n_atoms, 3) or as
+        np.ndarray (n_frames, n_atoms, 3), which may be a np.memmap. Frames are
+        read one at a time.
+        """
+        for positions in frames:
+            self.write_frame(positions)
+
+    def close(self):
+        """ Write the END line and close the file, if opened by the writer. """
+        if not self.header_written:
+            self.fh.write(self.header)
+            self.header_written = True
+        self.fh.write(b'END\n')
+        if self.owns_fh:
+            self.fh.close()
+            self.raw.close()
+        else:
+            self.fh.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_trajectory(template, frames, filename, pad_with=' \n', threads=None):
+    """Write frames into a multi-model pdb, see TrajectoryWriter.
+    Arguments
+        template (PDBTable, list of str or str): Topology of every frame.
+        frames (np.ndarray (n_frames, n_atoms, 3) or iterable): Positions per frame.
+        filename (str): Save name, compressed by its extension.
+        threads (int): Threads that compress the output, default: os.cpu_count()
+    """
+    with TrajectoryWriter(template, filename, pad_with, threads) as writer:
+        writer.write_frames(frames)